@@ -0,0 +1,280 @@
+#!/usr/bin/env python3
+"""
+Map Static Assets
+Writes the map as a small index.html plus content-hashed files in public/assets:
+the page CSS, the page JS and the two data files (facility payload and shift
+index). A changed file gets a new name, so everything under assets/ (and the
+versioned Leaflet copy under vendor/) can be cached forever and a rebuild only
+re-downloads the files whose content changed. Every asset gets precompressed
+.gz and, when the brotli package is installed, .br siblings for the server or
+any static host. assets/manifest.json maps logical names to hashed files. With
+Pillow installed the marker logos go into one sprite sheet (see logo_sprites.py),
+and every build adds its changes to the feed open pages poll (see change_feed.py).
+"""
+
+import argparse
+import gzip
+import hashlib
+import importlib.util
+import json
+import logging
+import os
+import re
+import shutil
+import time
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PUBLIC_DIR = 'public'
+ASSETS_DIR = 'assets'
+VENDOR_DIR = 'vendor'
+MANIFEST_FILE = 'manifest.json'
+HASH_LENGTH = 12
+# Nombres con hash de contenido (map.3f2a9c1b04de.js); el servidor los marca como immutable
+HASHED_NAME = re.compile(r'\.[0-9a-f]{%d}\.[a-z]+$' % HASH_LENGTH)
+LEAFLET_FILES = ('leaflet.js', 'leaflet.css', 'images/layers.png', 'images/layers-2x.png',
+                 'images/marker-icon.png', 'images/marker-icon-2x.png', 'images/marker-shadow.png')
+COMPRESSIBLE = ('.js', '.css', '.json', '.html', '.svg')
+READ_CHUNK = 1 << 20
+# Tras un fallo de descarga de Leaflet, no se reintenta en cada build (el daemon reconstruye a menudo)
+VENDOR_RETRY_SECONDS = 24 * 3600
+
+
+def has_brotli():
+    return importlib.util.find_spec('brotli') is not None
+
+
+class _AssetWriter:
+    """Text file writer that hashes what it writes; with js_string=True the text goes inside a '...' JS literal"""
+
+    def __init__(self, f, js_string=False):
+        self.f = f
+        self.js_string = js_string
+        self.digest = hashlib.sha256()
+
+    def write(self, text):
+        if isinstance(text, bytes):
+            self.digest.update(text)
+            self.f.write(text)
+            return
+        if self.js_string:
+            text = (text.replace('\\', '\\\\').replace("'", "\\'")
+                    .replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').replace('\n', '\\n'))
+        data = text.encode('utf-8')
+        self.digest.update(data)
+        self.f.write(data)
+
+
+def _write_hashed(assets_dir, stem, extension, write):
+    """Stream write(writer) into assets_dir/<stem>.<hash><extension>; returns the file name"""
+    tmp_path = os.path.join(assets_dir, f'.{stem}{extension}.tmp')
+    with open(tmp_path, 'wb') as f:
+        writer = _AssetWriter(f)
+        write(writer)
+    name = f'{stem}.{writer.digest.hexdigest()[:HASH_LENGTH]}{extension}'
+    os.replace(tmp_path, os.path.join(assets_dir, name))
+    return name
+
+
+def _write_data_script(assets_dir, stem, global_name, write_json):
+    """Data as a classic script, window.<global_name> = JSON.parse('...') (works from file:// too)"""
+    def write(writer):
+        writer.write(f"window.{global_name} = JSON.parse('")
+        writer.js_string = True
+        write_json(writer)
+        writer.js_string = False
+        writer.write("');\n")
+    return _write_hashed(assets_dir, stem, '.js', write)
+
+
+def precompress(path):
+    """Write path.gz (and path.br when brotli is available) next to path, reading it in chunks"""
+    written = []
+    with open(path, 'rb') as src, open(f'{path}.gz', 'wb') as raw:
+        # mtime=0: el mismo contenido produce siempre el mismo .gz
+        with gzip.GzipFile(filename='', mode='wb', fileobj=raw, compresslevel=9, mtime=0) as gz:
+            shutil.copyfileobj(src, gz, READ_CHUNK)
+    written.append(f'{path}.gz')
+    if has_brotli():
+        import brotli
+        compressor = brotli.Compressor(quality=11)
+        with open(path, 'rb') as src, open(f'{path}.br', 'wb') as dst:
+            for chunk in iter(lambda: src.read(READ_CHUNK), b''):
+                dst.write(compressor.process(chunk))
+            dst.write(compressor.finish())
+        written.append(f'{path}.br')
+    return written
+
+
+def vendor_leaflet(public_dir=PUBLIC_DIR, timeout=30, retry=False):
+    """Copy of Leaflet under public/vendor/leaflet-<version> (downloaded once); returns its relative dir or None.
+    A failed download is recorded in leaflet-<version>.failed and only retried after VENDOR_RETRY_SECONDS or with retry"""
+    from map import LEAFLET_CDN, LEAFLET_VERSION
+    relative = f'{VENDOR_DIR}/leaflet-{LEAFLET_VERSION}'
+    target = os.path.join(public_dir, VENDOR_DIR, f'leaflet-{LEAFLET_VERSION}')
+    failed_marker = f'{target}.failed'
+    missing = [name for name in LEAFLET_FILES if not os.path.isfile(os.path.join(target, name))]
+    if not missing:
+        return relative
+    if (not retry and os.path.isfile(failed_marker)
+            and time.time() - os.path.getmtime(failed_marker) < VENDOR_RETRY_SECONDS):
+        logger.debug(f"Leaflet download failed recently ({failed_marker}), loading it from the CDN")
+        return None
+    try:
+        import requests
+        for name in missing:
+            response = requests.get(f'{LEAFLET_CDN}/{name}', timeout=timeout)
+            response.raise_for_status()
+            path = os.path.join(target, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(f'{path}.tmp', 'wb') as f:
+                f.write(response.content)
+            os.replace(f'{path}.tmp', path)
+            if path.endswith(COMPRESSIBLE):
+                precompress(path)
+        if os.path.isfile(failed_marker):
+            os.remove(failed_marker)
+        logger.info(f"📦 Leaflet {LEAFLET_VERSION} vendored in {target}")
+        return relative
+    except Exception as e:
+        os.makedirs(os.path.dirname(failed_marker), exist_ok=True)
+        with open(failed_marker, 'w', encoding='utf-8') as f:
+            f.write(f"{e}\n")
+        logger.warning(f"⚠️ Could not vendor Leaflet ({e}), the page will load it from the CDN "
+                       f"(next try in {VENDOR_RETRY_SECONDS // 3600} h or with assets.py --vendor)")
+        return None
+
+
+def leaflet_tags(vendor=None):
+    """<link>/<script> for Leaflet: the vendored copy with the CDN as fallback, or the CDN alone"""
+    from map import LEAFLET_CDN
+    if vendor is None:
+        return (f'    <link rel="stylesheet" href="{LEAFLET_CDN}/leaflet.css" />\n'
+                f'    <script src="{LEAFLET_CDN}/leaflet.js"></script>')
+    return (f'    <link rel="stylesheet" href="{vendor}/leaflet.css" '
+            f'onerror="this.onerror=null;this.href=\'{LEAFLET_CDN}/leaflet.css\'" />\n'
+            f'    <script src="{vendor}/leaflet.js"></script>\n'
+            f'    <script>window.L || document.write(\'<script src="{LEAFLET_CDN}/leaflet.js"><\\/script>\')</script>')
+
+
+def _load_manifest(assets_dir):
+    try:
+        with open(os.path.join(assets_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _prune(assets_dir, keep):
+    """Remove hashed files (and their .gz/.br) that are in neither the new nor the previous manifest"""
+    removed = 0
+    for name in os.listdir(assets_dir):
+        base = re.sub(r'\.(gz|br)$', '', name)
+        if HASHED_NAME.search(base) and base not in keep:
+            os.remove(os.path.join(assets_dir, name))
+            removed += 1
+    return removed
+
+
+def build_map_assets(facilities_df, shifts_df, offers_df=None, public_dir=PUBLIC_DIR, vendor=True, data_dir='data'):
+    """Write index.html and the hashed, precompressed assets; returns the manifest or None"""
+    from change_feed import update_change_feed
+    from coordinate_validation import default_regions
+    from logo_sprites import build_logo_sprite, load_cached_facility_logos
+    from map import MAP_CSS, PAGE_END, map_script, page_start, prepare_map_data
+    from payload import to_json, write_json_columns
+    prepared = prepare_map_data(facilities_df, shifts_df, offers_df)
+    if prepared is None:
+        return None
+    payload, shift_index = prepared
+    assets_dir = os.path.join(public_dir, ASSETS_DIR)
+    os.makedirs(assets_dir, exist_ok=True)
+    previous = _load_manifest(assets_dir)
+
+    # Un único sprite con todos los logos (sin Pillow los marcadores cargan los ficheros originales)
+    facility_ids = set(payload.facility_ids)
+    sprite = build_logo_sprite(public_dir, {fac_id: path for fac_id, path in load_cached_facility_logos(data_dir).items()
+                                            if fac_id in facility_ids})
+    files = {}
+    css = MAP_CSS
+    if sprite is not None:
+        png = sprite.to_png()
+        files['logos.png'] = _write_hashed(assets_dir, 'logos', '.png', lambda w: w.write(png))
+        css += sprite.css(files['logos.png'])
+    files.update({
+        'map.css': _write_hashed(assets_dir, 'map', '.css', lambda w: w.write(css)),
+        'map.js': _write_hashed(assets_dir, 'map', '.js', lambda w: w.write(map_script(default_regions(data_dir)))),
+        # Los datos se escriben columna a columna directamente al fichero (ver payload.FacilityPayload)
+        'facilities.js': _write_data_script(assets_dir, 'facilities', 'FACILITY_PAYLOAD', payload.write),
+        'shifts.js': _write_data_script(assets_dir, 'shifts', 'SHIFT_INDEX', lambda w: write_json_columns(
+            w, ((None, key, values) for key, values in shift_index.items()))),
+    })
+    manifest = {}
+    for logical, name in files.items():
+        path = os.path.join(assets_dir, name)
+        compressed = [p for p in (f'{path}.gz', f'{path}.br') if os.path.isfile(p)]
+        if not compressed and path.endswith(COMPRESSIBLE):
+            compressed = precompress(path)
+        manifest[logical] = {
+            'file': f'{ASSETS_DIR}/{name}',
+            'bytes': os.path.getsize(path),
+            **{os.path.splitext(p)[1][1:]: os.path.getsize(p) for p in compressed},
+        }
+
+    leaflet = vendor_leaflet(public_dir) if vendor else None
+    head_tags = f'{leaflet_tags(leaflet)}\n    <link rel="stylesheet" href="{manifest["map.css"]["file"]}" />'
+    if sprite is not None:
+        # Índice logo/facility -> tile del sprite (pequeño, va con el index.html)
+        head_tags += f'\n    <script>window.LOGO_SPRITE = {to_json(sprite.index())};</script>'
+    # Versión de esta build en el feed de cambios: la página aplica los parches posteriores sin recargar
+    head_tags += f'\n    <script>window.FEED_VERSION = {update_change_feed(payload, public_dir, data_dir)};</script>'
+    index_path = os.path.join(public_dir, 'index.html')
+    with open(f'{index_path}.tmp', 'w', encoding='utf-8') as f:
+        f.write(page_start(len(payload), head_tags))
+        for logical in ('facilities.js', 'shifts.js', 'map.js'):
+            f.write(f'    <script src="{manifest[logical]["file"]}"></script>\n')
+        f.write(PAGE_END)
+    os.replace(f'{index_path}.tmp', index_path)
+    precompress(index_path)
+
+    tmp_manifest = os.path.join(assets_dir, f'{MANIFEST_FILE}.tmp')
+    with open(tmp_manifest, 'w', encoding='utf-8') as f:
+        json.dump(manifest, f, indent=2)
+    os.replace(tmp_manifest, os.path.join(assets_dir, MANIFEST_FILE))
+    # Se conservan también los ficheros de la build anterior: páginas ya abiertas pueden seguir pidiéndolos
+    keep = {os.path.basename(entry['file']) for entry in list(manifest.values()) + list(previous.values())
+            if isinstance(entry, dict) and 'file' in entry}
+    removed = _prune(assets_dir, keep)
+    logger.info(f"📦 {len(files)} hashed assets in {assets_dir} ({'gzip + brotli' if has_brotli() else 'gzip'})"
+                + (f", {removed} stale files removed" if removed else ''))
+    return manifest
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Write the map as index.html plus hashed, precompressed assets")
+    parser.add_argument('--data-dir', default='data')
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    vendor = parser.add_mutually_exclusive_group()
+    vendor.add_argument('--no-vendor', action='store_true', help="Load Leaflet from the CDN instead of public/vendor")
+    vendor.add_argument('--vendor', action='store_true', help="Download Leaflet now, even if the last try failed recently")
+    args = parser.parse_args(argv)
+
+    if args.vendor:
+        vendor_leaflet(args.public_dir, retry=True)
+
+    from map import load_facilities_and_shifts
+    facilities_df, shifts_df, offers_df = load_facilities_and_shifts(args.data_dir)
+    manifest = build_map_assets(facilities_df, shifts_df, offers_df, args.public_dir, vendor=not args.no_vendor,
+                                data_dir=args.data_dir)
+    if manifest is None:
+        return False
+    for logical, entry in manifest.items():
+        sizes = '  '.join(f"{key} {entry[key] / 1024:.1f} KB" for key in ('bytes', 'gz', 'br') if key in entry)
+        print(f"{logical:<14} {entry['file']:<40} {sizes}")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
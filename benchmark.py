@@ -0,0 +1,640 @@
+#!/usr/bin/env python3
+"""
+Pipeline Benchmarks
+Generates synthetic facilities, shifts and offers matching the real schemas at a
+multiple of the real data volume, times and memory-profiles every pipeline stage
+and compares the results against stored baselines to catch regressions.
+"""
+
+import argparse
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+BASELINE_FILE = os.path.join('data', 'benchmark_baselines.json')
+CLI_SCRIPT = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'cli.py')
+
+# Presupuesto de arranque para comandos triviales y módulos que no deben cargar
+STARTUP_BUDGET_MS = 100
+HEAVY_MODULES = ('pandas', 'numpy', 'requests', 'dotenv', 'geopy', 'pytz')
+
+# Volumen aproximado de los datos reales (escala 1x)
+BASE_FACILITIES = 100
+BASE_SHIFTS = 3800
+BASE_OFFERS = 2800
+
+CITIES = [
+    ('Barcelona', 41.3851, 2.1734, '08'), ('Madrid', 40.4168, -3.7038, '28'), ('Valencia', 39.4699, -0.3763, '46'),
+    ('Sevilla', 37.3891, -5.9845, '41'), ('Zaragoza', 41.6488, -0.8891, '50'), ('Málaga', 36.7213, -4.4217, '29'),
+    ('Bilbao', 43.2627, -2.9253, '48'), ('Las Palmas', 28.1235, -15.4366, '35'), ('Granollers', 41.6079, 2.2876, '08'),
+    ('Gijón', 43.5453, -5.6619, '33'),
+]
+NAME_PREFIXES = ['Hospital', 'Clínica', 'Centro Médico', 'Residencia', 'CAP', 'Hospital Quirónsalud',
+                 'Fresenius', 'Diaverum', 'Colisee', 'Grup Mutuam', 'HLA']
+SPECIALIZATIONS = [
+    ('OPERATING_ROOM', 'Quirófano'), ('EMERGENCY', 'Urgencias'), ('HOSPITALIZATION', 'Hospitalización'),
+    ('ICU', 'UCI'), ('GERIATRICS', 'Geriatría'), ('PEDIATRICS', 'Pediatría'), ('DIALYSIS', 'Diálisis'),
+]
+
+
+def generate_synthetic_data(scale=10, seed=42):
+    """Return synthetic raw facilities, corrections, raw shifts and offers at scale x the real volume"""
+    rng = np.random.default_rng(seed)
+    n_fac = BASE_FACILITIES * scale
+    n_shifts = BASE_SHIFTS * scale
+    n_offers = BASE_OFFERS * scale
+
+    # --- Facilities -------------------------------------------------------
+    ids = np.arange(1, n_fac + 1)
+    city_idx = rng.integers(0, len(CITIES), n_fac)
+    city_names = np.array([c[0] for c in CITIES], dtype=object)[city_idx]
+    lat = np.array([c[1] for c in CITIES])[city_idx] + rng.normal(0, 0.05, n_fac)
+    lon = np.array([c[2] for c in CITIES])[city_idx] + rng.normal(0, 0.05, n_fac)
+    # Un 5% con coordenadas extremas como en los datos reales (4.04427e+15)
+    broken = rng.random(n_fac) < 0.05
+    lat = np.where(broken, lat * 1e14, lat)
+    lon = np.where(broken, lon * 1e14, lon)
+    prefixes = np.array(NAME_PREFIXES, dtype=object)[rng.integers(0, len(NAME_PREFIXES), n_fac)]
+    names = [f"{p} {c} {i}" for p, c, i in zip(prefixes, city_names, ids)]
+    # Un 10% con texto mal codificado (UTF-8 leído como Latin-1)
+    names = [n.encode('utf-8').decode('latin-1') if i % 10 == 0 else n for i, n in enumerate(names)]
+    raw_facilities = pd.DataFrame({
+        'id': ids,
+        'name': names,
+        'facility_type': 'HOSPITAL',
+        'other_facility_type_name': None,
+        'verification_status': 'VERIFIED',
+        'address': [f"Carrer de Prova, {i % 300}, {CITIES[c][3]}{i % 1000:03d}" for i, c in zip(ids, city_idx)],
+        'address_city': city_names,
+        'address_country': 'España',
+        'address_latitude': lat,
+        'address_longitude': lon,
+        'address_map_link': '',
+        'avg_review_rating': np.round(rng.uniform(3, 5, n_fac), 1),
+        'total_review': rng.integers(0, 2000, n_fac),
+        'logo_url': '',
+    })
+
+    corrections = pd.DataFrame({
+        'Nombre_Original': raw_facilities['name'],
+        'Nombre_Correcto': raw_facilities['name'],
+        'Ciudad': raw_facilities['address_city'],
+        'Tipo': 'HOSPITAL',
+        'Direccion': raw_facilities['address'],
+        'Latitud_Corregida': np.where(broken, lat / 1e14, lat),
+        'Longitud_Corregida': np.where(broken, lon / 1e14, lon),
+        'Fuente_Problema': 'Synthetic',
+        'facility_id': ids,
+    })
+
+    # --- Shifts -----------------------------------------------------------
+    now = pd.Timestamp.now(tz='UTC').floor('h')
+    start = now + pd.to_timedelta(rng.integers(-24 * 30, 24 * 90, n_shifts), unit='h')
+    duration = pd.to_timedelta(rng.choice([7, 8, 10, 12], n_shifts), unit='h')
+    spec_idx = rng.integers(0, len(SPECIALIZATIONS), n_shifts)
+    shift_fac = rng.integers(1, n_fac + 1, n_shifts)
+    raw_shifts = pd.DataFrame({
+        'facility_id': shift_fac,
+        'id': np.arange(1, n_shifts + 1),
+        'start_time_utc': start.strftime('%Y-%m-%d %H:%M:%S+00:00'),
+        'finish_time_utc': (start + duration).strftime('%Y-%m-%dT%H:%M:%S'),
+        'specialization': np.array([s[0] for s in SPECIALIZATIONS], dtype=object)[spec_idx],
+        'specialization_display_text': np.array([s[1] for s in SPECIALIZATIONS], dtype=object)[spec_idx],
+        'category': rng.choice(['ENF', 'TCAE'], n_shifts),
+        'capacity': rng.integers(1, 4, n_shifts),
+        'facility_name': np.array(names, dtype=object)[shift_fac - 1],
+        'status': rng.choice(['PUBLISHED', 'CANCELLED', 'FILLED'], n_shifts, p=[0.7, 0.1, 0.2]),
+        'external_visible': rng.random(n_shifts) < 0.9,
+    })
+
+    # --- Offers -----------------------------------------------------------
+    offers = pd.DataFrame({
+        'ID': np.arange(1, n_offers + 1),
+        'External ID': [f"SYN{i:08d}" for i in range(n_offers)],
+        'Facility ID': rng.integers(1, n_fac + 1, n_offers),
+        'Category': rng.choice(['ENF', 'TCAE'], n_offers),
+        'Skill': np.array([s[0] for s in SPECIALIZATIONS], dtype=object)[rng.integers(0, len(SPECIALIZATIONS), n_offers)],
+        'Status': rng.choice(['PUBLISHED', 'CLOSED'], n_offers, p=[0.1, 0.9]),
+        'Salary Min': rng.integers(1500, 2200, n_offers),
+        'Salary Max': rng.integers(2200, 3200, n_offers),
+        'Salary Period': 'MONTHLY',
+        'Contract Type': rng.choice(['PERMANENT', 'TEMPORARY'], n_offers),
+        'Start Date': (now + pd.to_timedelta(rng.integers(0, 90, n_offers), unit='D')).strftime('%Y-%m-%d'),
+        'Job Description': 'Buscamos profesional de enfermería para incorporación inmediata. ' * 3,
+    })
+
+    return {
+        'raw_facilities': raw_facilities,
+        'corrections': corrections,
+        'raw_shifts': raw_shifts,
+        'offers': offers,
+    }
+
+
+def write_synthetic_data(datasets, data_dir):
+    """Write synthetic datasets with the same file names and separators as data/"""
+    os.makedirs(data_dir, exist_ok=True)
+    datasets['raw_facilities'].to_csv(os.path.join(data_dir, 'raw_facilities.csv'), index=False)
+    datasets['corrections'].drop(columns=['facility_id']).to_csv(
+        os.path.join(data_dir, 'facilities_corrected_coords.csv'), sep=';', index=False)
+    datasets['corrections'].to_csv(os.path.join(data_dir, 'all_corrected_facilities.csv'), sep=';', index=False)
+    datasets['raw_shifts'].to_csv(os.path.join(data_dir, 'raw_shifts.csv'), index=False)
+    datasets['offers'].to_csv(os.path.join(data_dir, 'available_offers.csv'), index=False)
+
+
+def measure(func, repeats=1):
+    """Return (best wall time in seconds, peak traced memory in MB) for func()"""
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+
+    tracemalloc.start()
+    try:
+        func()
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return best, peak / (1024 * 1024)
+
+
+def benchmark_cases(datasets, data_dir):
+    """Return a list of (name, callable) benchmark cases over synthetic data in data_dir"""
+    import data as data_module
+    import map as map_module
+    from coordinate_checker import CoordinateChecker
+    from demand_cube import DemandCube
+    from demand_timeline import DemandTimeline
+
+    raw_facilities = datasets['raw_facilities']
+    corrections = datasets['corrections'].drop(columns=['facility_id'])
+    lower_corrections = corrections.copy()
+    lower_corrections.columns = lower_corrections.columns.str.lower()
+
+    # Datos de entrada del mapa, cargados igual que en producción
+    data_module.process_available_shifts(datasets['raw_shifts'], data_dir)
+    facilities_df, shifts_df, offers_df = map_module.load_facilities_and_shifts(data_dir)
+    checker = CoordinateChecker(data_dir=data_dir)
+
+    def write_map_file(path):
+        with open(path, 'w', encoding='utf-8') as f:
+            return map_module.write_facilities_map(f, facilities_df, shifts_df, offers_df)
+
+    return [
+        ('process_available_shifts', lambda: data_module.process_available_shifts(datasets['raw_shifts'], data_dir)),
+        ('process_facilities', lambda: map_module.process_facilities(raw_facilities, lower_corrections)),
+        ('apply_encoding_fix_to_dataframe', lambda: map_module.apply_encoding_fix_to_dataframe(raw_facilities)),
+        ('analyze_coordinates', lambda: checker.analyze_coordinates(raw_facilities)),
+        ('create_facilities_map_with_shifts',
+         lambda: map_module.create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df)),
+        ('write_facilities_map', lambda: write_map_file(os.path.join(data_dir, 'index.html'))),
+        ('build_demand_cube', lambda: DemandCube.from_frames(shifts_df, offers_df)),
+        ('demand_timeline_peaks', lambda: DemandTimeline(shifts_df).peaks()),
+    ]
+
+
+def run_benchmarks(scales, repeats=1, only=None, seed=42):
+    """Run every benchmark case at each scale; returns {'<case>@<scale>x': {'seconds', 'peak_mb', 'rows'}}"""
+    results = {}
+    # Silenciar los logs de las etapas durante las mediciones
+    previous_level = logging.root.level
+    for scale in scales:
+        tmp_dir = tempfile.mkdtemp(prefix=f'facility_bench_{scale}x_')
+        try:
+            logger.info(f"🧪 Generating synthetic data at {scale}x ...")
+            datasets = generate_synthetic_data(scale, seed)
+            write_synthetic_data(datasets, tmp_dir)
+            logging.root.setLevel(logging.WARNING)
+            cases = benchmark_cases(datasets, tmp_dir)
+            for name, func in cases:
+                if only and name not in only:
+                    continue
+                seconds, peak_mb = measure(func, repeats)
+                results[f'{name}@{scale}x'] = {
+                    'seconds': round(seconds, 4),
+                    'peak_mb': round(peak_mb, 2),
+                    'rows': {k: len(v) for k, v in datasets.items()},
+                }
+                logging.root.setLevel(previous_level)
+                logger.info(f"⏱️ {name:<36} {scale:>5}x  {seconds:>9.3f}s  {peak_mb:>9.1f} MB")
+                logging.root.setLevel(logging.WARNING)
+        finally:
+            logging.root.setLevel(previous_level)
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+    return results
+
+
+def engine_cases(datasets):
+    """Return (operation, func(engine) -> DataFrame) cases for comparing dataframe engines"""
+    import map as map_module
+    from repository import normalize_facility_ids, standardize_columns
+
+    now_utc = pd.Timestamp('2025-01-01', tz='UTC')
+    shift_columns = ['facility_id', 'id', 'start_time_utc', 'finish_time_utc', 'specialization',
+                     'specialization_display_text', 'category', 'capacity', 'facility_name']
+    facility = datasets['raw_facilities'].rename(columns={
+        'name': 'facility_name', 'address_latitude': 'latitude', 'address_longitude': 'longitude'})
+    corrections = datasets['corrections'].drop_duplicates('Nombre_Original').set_index('Nombre_Original')
+    corrections.columns = corrections.columns.str.lower()
+    corrections.index.name = 'nombre_original'
+    keys = map_module.resolve_correction_keys(facility, corrections.index)
+    shifts = datasets['raw_shifts'].copy()
+    shifts['facility_id'] = normalize_facility_ids(shifts['facility_id'])
+    offers = standardize_columns(datasets['offers'].copy())
+    offers['facility_id'] = normalize_facility_ids(offers['facility_id'])
+
+    return [
+        ('filter_available_shifts', lambda e: e.filter_available_shifts(datasets['raw_shifts'], now_utc, shift_columns)),
+        ('apply_coordinate_corrections', lambda e: e.apply_coordinate_corrections(facility, keys, corrections)),
+        ('facility_stats', lambda e: e.facility_stats(shifts, offers)),
+    ]
+
+
+def run_engine_comparison(scales, engines, repeats=1, seed=42):
+    """Time each engine operation per engine and check results against the pandas engine"""
+    from engine import available_engines, get_engine
+
+    results, mismatches = {}, []
+    installed = available_engines()
+    for name in engines:
+        if name not in installed:
+            logger.warning(f"⚠️ Engine '{name}' not installed, skipping")
+    engines = [name for name in engines if name in installed]
+    for scale in scales:
+        datasets = generate_synthetic_data(scale, seed)
+        for operation, func in engine_cases(datasets):
+            reference = func(get_engine('pandas')).reset_index(drop=True)
+            for name in engines:
+                engine = get_engine(name)
+                seconds, peak_mb = measure(lambda: func(engine), repeats)
+                results[f'engine:{operation}[{name}]@{scale}x'] = {
+                    'seconds': round(seconds, 4),
+                    'peak_mb': round(peak_mb, 2),
+                    'rows': {k: len(v) for k, v in datasets.items()},
+                }
+                logger.info(f"⚙️ {operation:<30} {name:<7} {scale:>5}x  {seconds:>9.3f}s  {peak_mb:>9.1f} MB")
+                try:
+                    pd.testing.assert_frame_equal(func(engine).reset_index(drop=True), reference,
+                                                  check_dtype=False, check_categorical=False)
+                except AssertionError as e:
+                    mismatches.append(f"{operation}[{name}]@{scale}x: {str(e).splitlines()[0]}")
+    return results, mismatches
+
+
+def run_load_test(scale=10, seconds=5.0, clients=8, seed=42):
+    """Drive server.py with concurrent clients on synthetic data; returns rps and latency percentiles"""
+    import threading
+    import urllib.request
+    import data as data_module
+    from server import create_server
+
+    tmp_dir = tempfile.mkdtemp(prefix=f'facility_load_{scale}x_')
+    server = None
+    try:
+        datasets = generate_synthetic_data(scale, seed)
+        data_dir = os.path.join(tmp_dir, 'data')
+        write_synthetic_data(datasets, data_dir)
+        data_module.process_available_shifts(datasets['raw_shifts'], data_dir)
+        os.makedirs(os.path.join(tmp_dir, 'public'), exist_ok=True)
+        with open(os.path.join(tmp_dir, 'public', 'index.html'), 'w', encoding='utf-8') as f:
+            f.write('<!DOCTYPE html><html><body>load test</body></html>')
+
+        server = create_server(port=0, data_dir=data_dir, public_dir=os.path.join(tmp_dir, 'public'))
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        base = f'http://127.0.0.1:{server.server_port}'
+
+        # Mezcla de consultas: bbox alrededor de cada ciudad, conteos y turnos por centro
+        rng = np.random.default_rng(seed)
+        facility_ids = datasets['raw_facilities']['id'].astype(str).tolist()
+        paths = []
+        for _, lat, lon, _ in CITIES:
+            bbox = f'{lon - 0.5},{lat - 0.5},{lon + 0.5},{lat + 0.5}'
+            paths += [f'/api/facilities?bbox={bbox}', f'/api/counts?bbox={bbox}&category=ENF']
+        paths += [f'/api/facilities/{fid}/shifts' for fid in rng.choice(facility_ids, 50)]
+
+        latencies = []
+        lock = threading.Lock()
+        deadline = time.perf_counter() + seconds
+
+        def client(worker):
+            local = []
+            i = worker
+            while time.perf_counter() < deadline:
+                request = urllib.request.Request(base + paths[i % len(paths)], headers={'Accept-Encoding': 'gzip'})
+                start = time.perf_counter()
+                with urllib.request.urlopen(request) as response:
+                    response.read()
+                local.append(time.perf_counter() - start)
+                i += clients
+            with lock:
+                latencies.extend(local)
+
+        workers = [threading.Thread(target=client, args=(w,)) for w in range(clients)]
+        start = time.perf_counter()
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        elapsed = time.perf_counter() - start
+    finally:
+        if server is not None:
+            server.shutdown()
+            server.server_close()
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    latencies = np.array(latencies)
+    result = {
+        'requests': int(len(latencies)),
+        'rps': round(len(latencies) / elapsed, 1),
+        'p50_ms': round(float(np.percentile(latencies, 50)) * 1000, 2),
+        'p99_ms': round(float(np.percentile(latencies, 99)) * 1000, 2),
+        # 'seconds' = latencia p99 para reutilizar la comparación con baselines
+        'seconds': round(float(np.percentile(latencies, 99)), 4),
+        'peak_mb': 0.0,
+    }
+    logger.info(f"🌐 server load {scale}x, {clients} clients: {result['rps']} req/s, "
+                f"p50 {result['p50_ms']} ms, p99 {result['p99_ms']} ms ({result['requests']} requests)")
+    return result
+
+
+def synthetic_professionals(n, seed=42):
+    """Professionals around the synthetic cities; half with a specialization, half with a time window"""
+    rng = np.random.default_rng(seed)
+    city_idx = rng.integers(0, len(CITIES), n)
+    now = pd.Timestamp.now(tz='UTC').floor('h')
+    available_from = now + pd.to_timedelta(rng.integers(0, 24 * 60, n), unit='h')
+    windowed = rng.random(n) < 0.5
+    available_to = available_from + pd.to_timedelta(rng.integers(12, 24 * 14, n), unit='h')
+    specializations = np.array([''] + [s[0] for s in SPECIALIZATIONS], dtype=object)
+    return pd.DataFrame({
+        'professional_id': [f"PRO{i:06d}" for i in range(n)],
+        'latitude': np.array([c[1] for c in CITIES])[city_idx] + rng.normal(0, 0.1, n),
+        'longitude': np.array([c[2] for c in CITIES])[city_idx] + rng.normal(0, 0.1, n),
+        'category': rng.choice(['ENF', 'TCAE'], n),
+        'specialization': specializations[np.where(rng.random(n) < 0.5, 0, rng.integers(1, len(specializations), n))],
+        'available_from': np.where(windowed, available_from.astype(str), None),
+        'available_to': np.where(windowed, available_to.astype(str), None),
+        'max_distance_km': rng.choice([5, 10, 25, 50], n),
+    })
+
+
+def run_matching_benchmark(scale=10, professionals=10_000, repeats=1, seed=42):
+    """Time ShiftMatcher index build and batch match on synthetic shifts and professionals"""
+    from matching import ShiftMatcher
+    from spatial_index import SpatialIndex
+
+    datasets = generate_synthetic_data(scale, seed)
+    corrections = datasets['corrections']
+    index = SpatialIndex(corrections['Latitud_Corregida'], corrections['Longitud_Corregida'],
+                         corrections['facility_id'], corrections['Nombre_Correcto'])
+    shifts = datasets['raw_shifts']
+    shifts = shifts[shifts['status'] == 'PUBLISHED']
+    pros = synthetic_professionals(professionals, seed)
+
+    results = {}
+    build_seconds, build_peak = measure(lambda: ShiftMatcher(shifts, index), repeats)
+    results[f'match_build_index@{scale}x'] = {'seconds': round(build_seconds, 4), 'peak_mb': round(build_peak, 1)}
+    matcher = ShiftMatcher(shifts, index)
+    match_seconds, match_peak = measure(lambda: matcher.match(pros), repeats)
+    matches = matcher.match(pros)
+    results[f'match_{professionals}_professionals@{scale}x'] = {'seconds': round(match_seconds, 4),
+                                                               'peak_mb': round(match_peak, 1)}
+    logger.info(f"🤝 matching {scale}x: {len(shifts)} shifts, {professionals} professionals -> "
+                f"{len(matches)} matches; index {build_seconds:.3f}s, match {match_seconds:.3f}s, "
+                f"peak {match_peak:.1f} MB")
+    return results
+
+
+def measure_js_parse(text, decode=False, repeats=5):
+    """Best JSON.parse (+ decodeFacilityPayload) time in seconds under node, or None if node is not installed"""
+    from payload import DECODER_JS
+    node = shutil.which('node')
+    if node is None:
+        return None
+    tmp_dir = tempfile.mkdtemp(prefix='facility_payload_')
+    try:
+        payload_file = os.path.join(tmp_dir, 'payload.json')
+        with open(payload_file, 'w', encoding='utf-8') as f:
+            f.write(text)
+        script = DECODER_JS + f"""
+        const text = require('fs').readFileSync({json.dumps(payload_file)}, 'utf8');
+        let best = Infinity;
+        for (let i = 0; i < {repeats}; i++) {{
+            const start = process.hrtime.bigint();
+            const parsed = JSON.parse(text);
+            if ({'true' if decode else 'false'}) decodeFacilityPayload(parsed);
+            best = Math.min(best, Number(process.hrtime.bigint() - start) / 1e9);
+        }}
+        console.log(best);
+        """
+        result = subprocess.run([node, '-e', script], capture_output=True, text=True, check=True)
+        return float(result.stdout.strip())
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def run_payload_benchmark(scale=10, repeats=1, seed=42):
+    """Compare the row and columnar map payloads: build time, bytes, gzip bytes and parse time"""
+    import data as data_module
+    import map as map_module
+    from demand_cube import DemandCube
+    from payload import build_facility_payload, build_facility_records, compare_formats, to_json
+
+    tmp_dir = tempfile.mkdtemp(prefix=f'facility_payload_{scale}x_')
+    previous_level = logging.root.level
+    try:
+        datasets = generate_synthetic_data(scale, seed)
+        write_synthetic_data(datasets, tmp_dir)
+        logging.root.setLevel(logging.WARNING)
+        data_module.process_available_shifts(datasets['raw_shifts'], tmp_dir)
+        facilities_df, shifts_df, offers_df = map_module.load_facilities_and_shifts(tmp_dir)
+        stats = DemandCube.from_frames(shifts_df, offers_df).facility_stats()
+        builders = {
+            'rows': lambda: build_facility_records(facilities_df, shifts_df, offers_df, stats),
+            'columnar': lambda: build_facility_payload(facilities_df, shifts_df, offers_df, stats),
+        }
+        built = {name: build() for name, build in builders.items()}
+        comparison = compare_formats(built['rows'], built['columnar'], max(repeats, 3))
+        texts = {'rows': json.dumps(built['rows'], ensure_ascii=False), 'columnar': to_json(built['columnar'])}
+    finally:
+        logging.root.setLevel(previous_level)
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    results = {}
+    for name, build in builders.items():
+        seconds, peak_mb = measure(build, repeats)
+        js_seconds = measure_js_parse(texts[name], decode=name == 'columnar')
+        results[f'payload_{name}@{scale}x'] = {
+            'seconds': round(seconds, 4),
+            'peak_mb': round(peak_mb, 1),
+            'bytes': comparison[name]['bytes'],
+            'gzip_bytes': comparison[name]['gzip_bytes'],
+            'json_loads_seconds': round(comparison[name]['parse_seconds'], 4),
+            'js_parse_seconds': None if js_seconds is None else round(js_seconds, 4),
+        }
+        js_text = 'n/a' if js_seconds is None else f"{js_seconds * 1000:.1f} ms"
+        logger.info(f"📦 payload {name:<8} {scale:>5}x  build {seconds:.3f}s  {comparison[name]['bytes'] / 1024:,.0f} KB "
+                    f"(gzip {comparison[name]['gzip_bytes'] / 1024:,.0f} KB)  json.loads "
+                    f"{comparison[name]['parse_seconds'] * 1000:.1f} ms  JS parse{'+decode' if name == 'columnar' else ''} {js_text}")
+    return results
+
+
+def _best_run_ms(command, repeats, cwd=None):
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        subprocess.run(command, cwd=cwd, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+        best = min(best, time.perf_counter() - start)
+    return best * 1000
+
+
+def measure_startup(cli_args, repeats=5, cwd=None):
+    """Best wall time in ms of `python cli.py <cli_args>` net of a bare interpreter start, and the heavy modules it imported"""
+    # El arranque del intérprete (site, .pth de los paquetes instalados) depende de la máquina, no del repo
+    interpreter_ms = _best_run_ms([sys.executable, '-c', 'pass'], repeats, cwd)
+    ms = _best_run_ms([sys.executable, CLI_SCRIPT] + list(cli_args), repeats, cwd)
+
+    # -X importtime lista cada módulo importado en stderr ("import time: self | cumulative | name")
+    traced = subprocess.run([sys.executable, '-X', 'importtime', CLI_SCRIPT] + list(cli_args), cwd=cwd,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True)
+    imported = {line.rsplit('|', 1)[-1].strip().split('.')[0]
+                for line in traced.stderr.splitlines() if line.startswith('import time:')}
+    return max(ms - interpreter_ms, 0.0), sorted(imported & set(HEAVY_MODULES))
+
+
+def run_startup_checks(budget_ms=STARTUP_BUDGET_MS, repeats=5):
+    """Check `cli.py --help` and a no-op pipeline rebuild against the startup budget; returns failures"""
+    failures = []
+    tmp_dir = tempfile.mkdtemp(prefix='facility_startup_')
+    try:
+        write_synthetic_data(generate_synthetic_data(1), os.path.join(tmp_dir, 'data'))
+        os.makedirs(os.path.join(tmp_dir, 'public'), exist_ok=True)
+        noop_args = ['pipeline', '--only', 'process_shifts,process_offers,build_map']
+        # Primera ejecución real para que la segunda sea un rebuild sin cambios
+        subprocess.run([sys.executable, CLI_SCRIPT] + noop_args, cwd=tmp_dir,
+                       stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL, check=True)
+
+        for label, cli_args in (('cli --help', ['--help']), ('no-op rebuild', noop_args)):
+            ms, heavy = measure_startup(cli_args, repeats, cwd=tmp_dir)
+            logger.info(f"🚀 {label:<15} {ms:>7.1f} ms over interpreter start  heavy imports: {', '.join(heavy) or 'none'}")
+            if ms > budget_ms:
+                failures.append(f"{label}: {ms:.1f} ms > budget {budget_ms} ms")
+            if heavy:
+                failures.append(f"{label}: imports {', '.join(heavy)}")
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+    return failures
+
+
+def load_baselines(path=BASELINE_FILE):
+    if not os.path.exists(path):
+        return {}
+    with open(path, encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baselines(results, path=BASELINE_FILE):
+    baselines = load_baselines(path)
+    baselines.update(results)
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, indent=2, sort_keys=True)
+    logger.info(f"💾 Saved {len(results)} baselines to {path}")
+
+
+def compare_with_baselines(results, baselines, tolerance=0.25):
+    """Return a list of human-readable regressions (time or peak memory above baseline * (1 + tolerance))"""
+    regressions = []
+    for key, result in results.items():
+        baseline = baselines.get(key)
+        if not baseline:
+            continue
+        for metric in ('seconds', 'peak_mb'):
+            limit = baseline[metric] * (1 + tolerance)
+            if result[metric] > limit and result[metric] - baseline[metric] > 0.01:
+                regressions.append(f"{key}: {metric} {result[metric]} > baseline {baseline[metric]} (+{tolerance:.0%})")
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the facility map pipeline on synthetic data")
+    parser.add_argument('--scales', default='10,100', help="Comma-separated scale factors (e.g. 10,100,1000)")
+    parser.add_argument('--repeats', type=int, default=1, help="Timing repeats per case (best is kept)")
+    parser.add_argument('--only', help="Comma-separated benchmark case names")
+    parser.add_argument('--save-baseline', action='store_true', help="Store results as the new baselines")
+    parser.add_argument('--check', action='store_true', help="Exit with an error if any case regressed")
+    parser.add_argument('--tolerance', type=float, default=0.25, help="Allowed slowdown before flagging (0.25 = 25%%)")
+    parser.add_argument('--baseline-file', default=BASELINE_FILE)
+    parser.add_argument('--engines', help="Also compare dataframe engines (e.g. pandas,polars) and check parity")
+    parser.add_argument('--load', action='store_true', help="Also load-test server.py (requests/s and p99 latency)")
+    parser.add_argument('--load-seconds', type=float, default=5.0)
+    parser.add_argument('--load-clients', type=int, default=8)
+    parser.add_argument('--matching', action='store_true', help="Also time batch professional-to-shift matching")
+    parser.add_argument('--professionals', type=int, default=10_000, help="Synthetic professionals for --matching")
+    parser.add_argument('--payload', action='store_true', help="Also compare the row and columnar map payloads")
+    parser.add_argument('--startup', action='store_true',
+                        help="Only check that --help and no-op rebuilds start within the import budget")
+    parser.add_argument('--startup-budget-ms', type=float, default=STARTUP_BUDGET_MS)
+    args = parser.parse_args(argv)
+
+    if args.startup:
+        failures = run_startup_checks(args.startup_budget_ms, max(args.repeats, 5))
+        for failure in failures:
+            logger.error(f"❌ Startup budget exceeded: {failure}")
+        if not failures:
+            logger.info("✅ Startup within budget")
+        return not failures
+
+    scales = [int(s) for s in args.scales.split(',') if s.strip()]
+    only = set(args.only.split(',')) if args.only else None
+    results = run_benchmarks(scales, args.repeats, only)
+    if args.load:
+        for scale in scales:
+            results[f'server_load@{scale}x'] = run_load_test(scale, args.load_seconds, args.load_clients)
+    if args.matching:
+        for scale in scales:
+            results.update(run_matching_benchmark(scale, args.professionals, args.repeats))
+    if args.payload:
+        for scale in scales:
+            results.update(run_payload_benchmark(scale, args.repeats))
+    mismatches = []
+    if args.engines:
+        engine_results, mismatches = run_engine_comparison(scales, args.engines.split(','), args.repeats)
+        results.update(engine_results)
+        for mismatch in mismatches:
+            logger.error(f"❌ Engine parity mismatch: {mismatch}")
+
+    baselines = load_baselines(args.baseline_file)
+    regressions = compare_with_baselines(results, baselines, args.tolerance)
+    for regression in regressions:
+        logger.warning(f"📉 Regression: {regression}")
+    if not regressions:
+        logger.info("✅ No regressions against stored baselines")
+
+    if args.save_baseline:
+        save_baselines(results, args.baseline_file)
+    else:
+        # Los tiempos dependen de la máquina: la primera ejecución de cada caso fija su baseline
+        missing = {key: result for key, result in results.items() if key not in baselines}
+        if missing:
+            logger.info(f"ℹ️ No baseline yet for {', '.join(sorted(missing))} - recording this run")
+            save_baselines(missing, args.baseline_file)
+    return not (args.check and regressions) and not mismatches
+
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
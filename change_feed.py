@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Map Change Feed
+Every map build compares what the page shows (facilities, shifts and offers, as
+decoded from the columnar payload) with the previous build and, when something
+changed, writes a small patch to public/feed/<version>.json: facilities added,
+updated or removed; shifts and offers added, updated (e.g. fewer open slots as a
+shift fills) or removed. Versions are consecutive integers; feed/index.json lists
+the latest version and the last patches, and open pages poll it and apply the
+patches in place instead of reloading the whole dataset. The rows are streamed
+from the payload chunk by chunk; the previous build's snapshot in
+data/feed_snapshot.json only keeps a short hash per row, so only added and
+changed rows are ever held whole.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+from datetime import datetime, timezone
+
+import numpy as np
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+PUBLIC_DIR = 'public'
+FEED_DIR = 'feed'
+FEED_INDEX = 'index.json'
+SNAPSHOT_FILE = 'feed_snapshot.json'
+# Parches que se conservan: una página con una versión más antigua se recarga entera
+FEED_KEEP = 50
+
+FACILITY_COLUMNS = ['key', 'id', 'name', 'city', 'address', 'latitude', 'longitude', 'logo_path',
+                    'total', 'enf', 'tcae', 'offers']
+SHIFT_COLUMNS = ['shift_id', 'facility_id', 'start', 'finish', 'specialization', 'category', 'capacity']
+OFFER_COLUMNS = ['offer_id', 'facility_id', 'external_id', 'category', 'skill', 'contract_type', 'salary_min',
+                 'salary_max', 'salary_period', 'start_date', 'status', 'job_description']
+TABLE_COLUMNS = {'facilities': FACILITY_COLUMNS, 'shifts': SHIFT_COLUMNS, 'offers': OFFER_COLUMNS}
+# Columna del payload de la que sale cada columna de la página cuando no se llaman igual
+PAYLOAD_NAMES = {'logo_path': 'logo', 'shift_id': 'id', 'offer_id': 'id', 'facility_id': 'facility'}
+
+
+def snapshot_rows(payload):
+    """Yield (table, key, row) for what the page shows, streamed chunk by chunk from a FacilityPayload.
+    Facilities are keyed by their unique key (id, or nombre_original without one); row[0] of shifts and offers is their facility_id"""
+    facility_ids = np.asarray(payload.facility_ids, dtype=object)
+    for table, chunk in payload.decoded_chunks():
+        if table != 'facilities':
+            chunk['facility'] = facility_ids[np.asarray(chunk['facility'], dtype=np.int64)].tolist()
+        for row in zip(*(chunk[PAYLOAD_NAMES.get(column, column)] for column in TABLE_COLUMNS[table])):
+            yield table, row[0], list(row[1:])
+
+
+def empty_patch():
+    return {table: {'columns': columns, 'added': [], 'updated': [], 'removed': []} for table, columns in TABLE_COLUMNS.items()}
+
+
+def row_hash(row):
+    """Compact digest of a row: the snapshot keeps only these, not the rows"""
+    text = json.dumps(row, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=8).hexdigest()
+
+
+def diff_payload(payload, previous=None):
+    """(snapshot rows, patch) of a FacilityPayload against the previous snapshot rows
+    ({table: {key: [hash, facility_id]}}, [hash, row] for facilities).
+    Only added and changed rows are kept whole; without previous rows there is no patch"""
+    rows = {table: {} for table in TABLE_COLUMNS}
+    patch = empty_patch()
+    for table, key, row in snapshot_rows(payload):
+        current = rows[table]
+        if key in current:
+            # Filas repetidas: gana la primera, como en la página
+            continue
+        digest = row_hash(row)
+        # Las facilities guardan su fila (son pocas y expire_shifts corrige sus contadores); turnos y ofertas, su facility
+        current[key] = [digest, row if table == 'facilities' else row[0]]
+        if previous is None:
+            continue
+        before = previous[table].get(key)
+        if before is None:
+            patch[table]['added'].append([key] + row)
+        elif before[0] != digest:
+            # Un turno u oferta que cambia de facility: se quita de la anterior y se añade a la nueva
+            if table != 'facilities' and before[1] != row[0]:
+                patch[table]['removed'].append(key)
+                patch[table]['added'].append([key] + row)
+            else:
+                patch[table]['updated'].append([key] + row)
+    if previous is None:
+        return rows, None
+    for table, current in rows.items():
+        patch[table]['removed'] += [key for key in previous[table] if key not in current]
+        if table != 'facilities':
+            patch[table]['removed'] = [[key, previous[table][key][1]] for key in patch[table]['removed']]
+    return rows, patch
+
+
+def patch_size(patch):
+    return sum(len(table[kind]) for table in patch.values() for kind in ('added', 'updated', 'removed'))
+
+
+def _write_json(path, content):
+    from assets import precompress
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(content, f, ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+    os.replace(f'{path}.tmp', path)
+    # El .gz se reescribe con el fichero: el servidor nunca sirve una versión antigua
+    precompress(path)
+
+
+def _load_json(path, default):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return default
+
+
+def load_feed(public_dir=PUBLIC_DIR, data_dir=DATA_DIR):
+    """(feed/index.json, previous snapshot); the snapshot is None when it cannot be patched (the next version restarts the feed)"""
+    index = _load_json(os.path.join(public_dir, FEED_DIR, FEED_INDEX), {'version': 0, 'patches': []})
+    previous = _load_json(os.path.join(data_dir, SNAPSHOT_FILE), None)
+    # Primera build, feed/snapshot desincronizados o columnas distintas: nueva versión sin parche, las páginas se recargan
+    if previous is None or previous.get('version') != index.get('version') or previous.get('columns') != TABLE_COLUMNS:
+        return index, None
+    return index, previous
+
+
+def publish_patch(index, previous, rows, patch, public_dir=PUBLIC_DIR, data_dir=DATA_DIR):
+    """Write the patch as the next feed version (a new version without patch when there is no previous snapshot)
+    and save the snapshot rows; returns the current version"""
+    feed_dir = os.path.join(public_dir, FEED_DIR)
+    os.makedirs(feed_dir, exist_ok=True)
+    built_at = datetime.now(timezone.utc).isoformat(timespec='seconds')
+    if previous is None or patch is None:
+        version, index['patches'] = int(index.get('version', 0)) + 1, []
+        logger.info(f"📰 Change feed (re)started at version {version}")
+    elif patch_size(patch) == 0:
+        logger.info(f"📰 No changes since version {previous['version']}")
+        return previous['version']
+    else:
+        version = previous['version'] + 1
+        name = f'{version}.json'
+        _write_json(os.path.join(feed_dir, name), {'from': version - 1, 'to': version, 'built_at': built_at, **patch})
+        index['patches'] = (index['patches'] + [{
+            'from': version - 1, 'to': version, 'file': name, 'built_at': built_at,
+            'bytes': os.path.getsize(os.path.join(feed_dir, name)),
+        }])[-FEED_KEEP:]
+        logger.info(f"📰 Change feed version {version}: " + ', '.join(
+            f"{table} +{len(patch[table]['added'])} ~{len(patch[table]['updated'])} -{len(patch[table]['removed'])}"
+            for table in patch) + f" ({index['patches'][-1]['bytes']} bytes)")
+
+    index.update({'version': version, 'built_at': built_at})
+    _write_json(os.path.join(feed_dir, FEED_INDEX), index)
+    os.makedirs(data_dir, exist_ok=True)
+    snapshot_path = os.path.join(data_dir, SNAPSHOT_FILE)
+    with open(f'{snapshot_path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'version': version, 'built_at': built_at, 'columns': TABLE_COLUMNS, 'rows': rows},
+                  f, ensure_ascii=False, separators=(',', ':'))
+    os.replace(f'{snapshot_path}.tmp', snapshot_path)
+    # Parches que ya no están en el índice
+    keep = {entry['file'] for entry in index['patches']} | {FEED_INDEX}
+    for name in os.listdir(feed_dir):
+        if name.endswith(('.json', '.json.gz')) and name.removesuffix('.gz') not in keep:
+            os.remove(os.path.join(feed_dir, name))
+    return version
+
+
+def update_change_feed(payload, public_dir=PUBLIC_DIR, data_dir=DATA_DIR):
+    """Diff a FacilityPayload against the previous snapshot, write the patch and feed/index.json; returns the build version"""
+    index, previous = load_feed(public_dir, data_dir)
+    rows, patch = diff_payload(payload, None if previous is None else previous['rows'])
+    return publish_patch(index, previous, rows, patch, public_dir, data_dir)
+
+
+def expire_shifts(started, public_dir=PUBLIC_DIR, data_dir=DATA_DIR):
+    """Publish a patch that only removes started shifts (rows with id and category) and lowers their facilities'
+    counts, without a build; returns how many left the map (0 without a feed: the next build starts it)"""
+    index, previous = load_feed(public_dir, data_dir)
+    if previous is None or started is None or started.empty:
+        return 0
+    rows, patch, gone = previous['rows'], empty_patch(), {}
+    categories = started['category'] if 'category' in started.columns else [None] * len(started)
+    for shift_id, category in zip(started['id'].astype(str), categories):
+        entry = rows['shifts'].pop(shift_id, None)
+        if entry is None:
+            # Ya expirado en una pasada anterior, o de una facility que no está en el mapa
+            continue
+        patch['shifts']['removed'].append([shift_id, entry[1]])
+        counts = gone.setdefault(entry[1], {'total': 0, 'enf': 0, 'tcae': 0})
+        counts['total'] += 1
+        if category in ('ENF', 'TCAE'):
+            counts[category.lower()] += 1
+    if not patch['shifts']['removed']:
+        return 0
+    # Mismos contadores que engine.facility_stats tras quitar los turnos (las filas no incluyen la clave)
+    id_position = FACILITY_COLUMNS.index('id') - 1
+    for key, (_, row) in rows['facilities'].items():
+        counts = gone.get(row[id_position])
+        if counts is None:
+            continue
+        for stat, value in counts.items():
+            row[FACILITY_COLUMNS.index(stat) - 1] -= value
+        rows['facilities'][key] = [row_hash(row), row]
+        patch['facilities']['updated'].append([key] + row)
+    publish_patch(index, previous, rows, patch, public_dir, data_dir)
+    return len(patch['shifts']['removed'])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Show the map change feed (feed/index.json and its patches)")
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    parser.add_argument('--show', type=int, help="Print the patch that produced this version")
+    args = parser.parse_args(argv)
+
+    feed_dir = os.path.join(args.public_dir, FEED_DIR)
+    index = _load_json(os.path.join(feed_dir, FEED_INDEX), None)
+    if index is None:
+        logger.error(f"❌ No change feed in {feed_dir}, build the map first (map.py / assets.py)")
+        return False
+    if args.show is not None:
+        entry = next((entry for entry in index['patches'] if entry['to'] == args.show), None)
+        if entry is None:
+            logger.error(f"❌ No patch for version {args.show} in the feed")
+            return False
+        print(json.dumps(_load_json(os.path.join(feed_dir, entry['file']), {}), ensure_ascii=False, indent=2))
+        return True
+    print(f"Version {index['version']} (built {index.get('built_at', '?')}), {len(index['patches'])} patches")
+    for entry in index['patches']:
+        print(f"  {entry['from']:>5} -> {entry['to']:<5} {entry['file']:<12} {entry['bytes']:>8} bytes  {entry['built_at']}")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
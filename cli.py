@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+Facility Map CLI
+Single entry point for the project scripts. Each command imports its module only
+when it runs, so `--help` and no-op pipeline runs start without loading pandas,
+requests or geopy.
+"""
+
+import argparse
+import importlib
+import os
+import sys
+
+# Comando -> (módulo, descripción, acepta argumentos propios)
+COMMANDS = {
+    'fetch': ('data', "Fetch facilities, shifts and offers from Metabase", False),
+    'geocode': ('coordinate_checker', "Check and geocode facility coordinates", True),
+    'map': ('map', "Generate public/index.html", False),
+    'pipeline': ('pipeline', "Run the cached fetch -> geocode -> map pipeline", True),
+    'spatial': ('spatial_index', "Nearest-facility, radius and bbox queries", True),
+    'match': ('matching', "Match professionals to nearby open shifts", True),
+    'shifts': ('shift_intervals', "Shifts per facility overlapping a date/time window", True),
+    'expire': ('expiry', "Remove shifts that have already started from the open maps without a rebuild", True),
+    'demand': ('demand_cube', "Shift demand by facility, category, specialization or day", True),
+    'timeline': ('demand_timeline', "Concurrent open shift slots per facility and category", True),
+    'payload': ('payload', "Compare the row and columnar map payloads on the current data", True),
+    'assets': ('assets', "Write the map as index.html plus hashed, precompressed assets", True),
+    'logos': ('logo_sprites', "Cache the facility logos and report the map's logo sprite sheet", True),
+    'shards': ('shards', "Build one map per city or healthcare group in parallel", True),
+    'feed': ('change_feed', "Show the map change feed (feed/index.json and its patches)", True),
+    'serve': ('server', "Serve public/ and the JSON query API", True),
+    'daemon': ('daemon', "Refresh each dataset on its own schedule and rebuild what changed", True),
+    'benchmark': ('benchmark', "Benchmark the pipeline on synthetic data", True),
+}
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(
+        prog='cli.py',
+        description="Healthcare facilities map tools",
+        epilog="Run 'cli.py <command> --help' for the options of a command.",
+        formatter_class=argparse.RawDescriptionHelpFormatter,
+    )
+    parser.add_argument('--engine', choices=['pandas', 'polars'],
+                        help="Dataframe engine for the processing steps (default: $FACILITY_MAP_ENGINE or pandas)")
+    subparsers = parser.add_subparsers(dest='command', metavar='<command>')
+    for name, (_, description, takes_args) in COMMANDS.items():
+        # Los comandos con opciones propias dejan --help al parser del módulo
+        subparsers.add_parser(name, help=description, description=description, add_help=not takes_args)
+    return parser
+
+
+def main(argv=None):
+    """Parse the command name and hand the remaining arguments to the module's main()"""
+    argv = sys.argv[1:] if argv is None else argv
+    parser = build_parser()
+    args, rest = parser.parse_known_args(argv)
+    if args.command is None:
+        parser.print_help()
+        return True
+
+    module_name, _, takes_args = COMMANDS[args.command]
+    if rest and not takes_args:
+        parser.error(f"'{args.command}' takes no arguments: {' '.join(rest)}")
+
+    if args.engine:
+        # Por variable de entorno para que llegue a todos los módulos y etapas del pipeline
+        os.environ['FACILITY_MAP_ENGINE'] = args.engine
+
+    module = importlib.import_module(module_name)
+    success = module.main(rest) if takes_args else module.main()
+
+    from metrics import write_metrics
+    write_metrics()
+    return success
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -4,20 +4,21 @@ Comprehensive Coordinate Checker and Geocoder
 Checks facility coordinates, geocodes problematic ones, and updates corrections file.
 """
 
+import argparse
+import importlib.util
 import pandas as pd
-import requests
 import time
 import logging
 import os
-from dotenv import load_dotenv
+from name_matching import FacilityNameIndex
+from coordinate_validation import city_centroid, default_regions, describe_issue, is_plausible, validate_coordinates
+from fingerprints import FingerprintStore, facility_key
+from facility_store import FacilityStore, classify_source
+from repository import get_repository
+from metrics import track_stage, write_metrics
 
-# Try to import geocoding libraries
-try:
-    from geopy.geocoders import Nominatim
-    from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
-    GEOPY_AVAILABLE = True
-except ImportError:
-    GEOPY_AVAILABLE = False
+# geopy is only imported when Nominatim is actually used
+GEOPY_AVAILABLE = importlib.util.find_spec('geopy') is not None
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -26,18 +27,22 @@ logger = logging.getLogger(__name__)
 class CoordinateChecker:
     """Comprehensive coordinate checking and geocoding system"""
     
-    def __init__(self):
+    def __init__(self, data_dir='data'):
         # Load environment variables
+        from dotenv import load_dotenv
         load_dotenv()
         
         self.api_key = os.getenv('GOOGLE_MAPS_API_KEY')
         self.base_url = "https://maps.googleapis.com/maps/api/geocode/json"
         
         # Data directories
-        self.data_dir = 'data'
+        self.data_dir = data_dir
         self.raw_file = os.path.join(self.data_dir, 'raw_facilities.csv')
         self.corrections_file = os.path.join(self.data_dir, 'facilities_corrected_coords.csv')
-        self.new_geocoded_file = os.path.join(self.data_dir, 'newly_geocoded_facilities.csv')
+        self.combined_file = os.path.join(self.data_dir, 'all_corrected_facilities.csv')
+        self.store_file = os.path.join(self.data_dir, 'facility_master.db')
+        self.repository = get_repository(self.data_dir)
+        self.fingerprints = FingerprintStore(os.path.join(self.data_dir, 'geocode_fingerprints.json'))
         
     def load_data(self):
         """Load raw facility data"""
@@ -46,7 +51,7 @@ class CoordinateChecker:
             logger.error("Please run data.py first to fetch data from Metabase")
             return None
         
-        raw_data = pd.read_csv(self.raw_file)
+        raw_data = self.repository.get('raw_facilities')
         logger.info(f"✅ Loaded {len(raw_data)} raw facilities")
         return raw_data
     
@@ -55,7 +60,7 @@ class CoordinateChecker:
         corrections = None
         if os.path.exists(self.corrections_file):
             try:
-                corrections = pd.read_csv(self.corrections_file, sep=';')
+                corrections = self.repository.get('corrections')
                 logger.info(f"✅ Loaded {len(corrections)} existing corrections")
             except Exception as e:
                 logger.warning(f"⚠️ Could not load corrections: {e}")
@@ -64,6 +69,12 @@ class CoordinateChecker:
         
         return corrections
     
+    def build_corrections_index(self, corrections):
+        """Build a fuzzy name index over the corrections, mapping each name to its row label"""
+        if corrections is None or corrections.empty:
+            return FacilityNameIndex()
+        return FacilityNameIndex(corrections['Nombre_Original'], keys=corrections.index)
+    
     def analyze_coordinates(self, raw_data):
         """Analyze coordinate quality and identify problems"""
         logger.info("🔍 Analyzing coordinate quality...")
@@ -76,26 +87,27 @@ class CoordinateChecker:
             'extreme_coordinates': 0,
             'default_coordinates': 0,
             'outside_spain': 0,
+            'far_from_city': 0,
             'already_corrected': 0,
             'needs_geocoding': [],
             'corrected_coordinates': []
         }
         
         corrections = self.load_corrections()
-        corrected_names = set()
-        if corrections is not None:
-            corrected_names = set(corrections['Nombre_Original'].str.lower())
+        corrections_index = self.build_corrections_index(corrections)
+        validation = validate_coordinates(raw_data, 'address_latitude', 'address_longitude',
+                                          'address_city', 'address', regions=default_regions(self.data_dir))
         
-        for _, facility in raw_data.iterrows():
-            name = facility['name'].lower()
+        for idx, facility in raw_data.iterrows():
             lat = facility['address_latitude']
             lon = facility['address_longitude']
             
             # Check if already corrected
-            if name in corrected_names:
+            correction_row = corrections_index.lookup(facility['name'])
+            if correction_row is not None:
                 analysis['already_corrected'] += 1
                 # Get the corrected coordinates
-                correction = corrections[corrections['Nombre_Original'].str.lower() == name].iloc[0]
+                correction = corrections.loc[correction_row]
                 analysis['corrected_coordinates'].append({
                     'name': facility['name'],
                     'original_lat': lat,
@@ -147,7 +159,7 @@ class CoordinateChecker:
                     'original_lat': lat,
                     'original_lon': lon
                 })
-            elif not (35 <= lat <= 44) or not (-10 <= lon <= 5):
+            elif validation.at[idx, 'region'] == '':
                 analysis['outside_spain'] += 1
                 analysis['needs_geocoding'].append({
                     'name': facility['name'],
@@ -157,6 +169,16 @@ class CoordinateChecker:
                     'original_lat': lat,
                     'original_lon': lon
                 })
+            elif not validation.at[idx, 'plausible']:
+                analysis['far_from_city'] += 1
+                analysis['needs_geocoding'].append({
+                    'name': facility['name'],
+                    'address': facility['address'],
+                    'city': facility['address_city'],
+                    'reason': describe_issue(validation.loc[idx]),
+                    'original_lat': lat,
+                    'original_lon': lon
+                })
             else:
                 analysis['good_coordinates'] += 1
         
@@ -174,6 +196,7 @@ class CoordinateChecker:
         logger.info(f"❌ Extreme coordinates: {analysis['extreme_coordinates']}")
         logger.info(f"❌ Default coordinates: {analysis['default_coordinates']}")
         logger.info(f"❌ Outside Spain: {analysis['outside_spain']}")
+        logger.info(f"❌ Far from declared city/postal code: {analysis['far_from_city']}")
         logger.info(f"🔄 Need geocoding: {len(analysis['needs_geocoding'])}")
         logger.info("=" * 40)
         
@@ -199,13 +222,13 @@ class CoordinateChecker:
         # Try Google Maps API first (if available)
         if self.api_key:
             result = self._geocode_google_maps(facility)
-            if result:
+            if result and self.is_plausible_result(result, facility):
                 return result
         
         # Try OpenStreetMap Nominatim (free)
         if GEOPY_AVAILABLE:
             result = self._geocode_nominatim(facility)
-            if result:
+            if result and self.is_plausible_result(result, facility):
                 return result
         
         # Try simple address lookup
@@ -216,6 +239,15 @@ class CoordinateChecker:
         logger.warning(f"⚠️ Could not geocode: {facility['name']}")
         return None
     
+    def is_plausible_result(self, result, facility):
+        """Reject geocoding results that fall outside Spain or far from the declared city"""
+        if is_plausible(result['Latitud_Corregida'], result['Longitud_Corregida'],
+                        facility.get('city'), facility.get('address'), regions=default_regions(self.data_dir)):
+            return True
+        logger.warning(f"⚠️ Discarding implausible result for {facility['name']}: "
+                       f"({result['Latitud_Corregida']}, {result['Longitud_Corregida']})")
+        return False
+    
     def _geocode_google_maps(self, facility):
         """Geocode using Google Maps API"""
         try:
@@ -231,6 +263,7 @@ class CoordinateChecker:
             }
             
             # Make request
+            import requests
             response = requests.get(self.base_url, params=params, timeout=10)
             
             if response.status_code == 200:
@@ -268,6 +301,8 @@ class CoordinateChecker:
     
     def _geocode_nominatim(self, facility):
         """Geocode using OpenStreetMap Nominatim (free)"""
+        from geopy.geocoders import Nominatim
+        from geopy.exc import GeocoderTimedOut, GeocoderUnavailable
         try:
             geolocator = Nominatim(user_agent="facility_map_geocoder")
             
@@ -309,71 +344,11 @@ class CoordinateChecker:
     def _geocode_simple_lookup(self, facility):
         """Simple geocoding using city-based lookup"""
         try:
-            # Simple city-based coordinates for Spain
-            city_coords = {
-                'barcelona': (41.3851, 2.1734),
-                'madrid': (40.4168, -3.7038),
-                'valencia': (39.4699, -0.3763),
-                'sevilla': (37.3891, -5.9845),
-                'zaragoza': (41.6488, -0.8891),
-                'málaga': (36.7213, -4.4217),
-                'murcia': (37.9922, -1.1307),
-                'palma': (39.5696, 2.6502),
-                'las palmas': (28.1235, -15.4366),
-                'bilbao': (43.2627, -2.9253),
-                'alicante': (38.3452, -0.4815),
-                'cordoba': (37.8882, -4.7794),
-                'valladolid': (41.6523, -4.7245),
-                'vigo': (42.2406, -8.7207),
-                'gijón': (43.5453, -5.6619),
-                'granada': (37.1765, -3.5976),
-                'oviedo': (43.3623, -5.8493),
-                'santander': (43.4623, -3.8099),
-                'tarrasa': (41.5606, 2.0104),
-                'sabadell': (41.5463, 2.1074),
-                'alcorcón': (40.3494, -3.8313),
-                'móstoles': (40.3233, -3.8644),
-                'fuenlabrada': (40.2842, -3.7942),
-                'badalona': (41.4500, 2.2474),
-                'hospitalet': (41.3597, 2.0998),
-                'alcalá de henares': (40.4820, -3.3635),
-                'terrassa': (41.5606, 2.0104),
-                'jerez de la frontera': (36.6866, -6.1372),
-                'marbella': (36.5097, -4.8860),
-                'león': (42.5987, -5.5671),
-                'tarragona': (41.1187, 1.2453),
-                'lleida': (41.6148, 0.6268),
-                'castellón': (39.9864, -0.0513),
-                'burgos': (42.3408, -3.6997),
-                'salamanca': (40.9645, -5.6630),
-                'albacete': (38.9952, -1.8557),
-                'huelva': (37.2614, -6.9447),
-                'logroño': (42.4627, -2.4449),
-                'cádiz': (36.5297, -6.2926),
-                'lucena': (37.4088, -4.4852),
-                'jaén': (37.7796, -3.7849),
-                'orense': (42.3355, -7.8639),
-                'girona': (41.9794, 2.8214),
-                'lugo': (43.0097, -7.5560),
-                'cáceres': (39.4765, -6.3722),
-                'talavera de la reina': (39.9603, -4.8303),
-                'santiago de compostela': (42.8805, -8.5456),
-                'lérida': (41.6148, 0.6268),
-                'cartagena': (37.6057, -0.9913),
-                'toledo': (39.8584, -4.0226),
-                'elche': (38.2672, -0.6987),
-                'oviedo': (43.3623, -5.8493),
-                'guadalajara': (40.6296, -3.1665),
-                'tudela': (42.0644, -1.6044),
-                'ceuta': (35.8894, -5.3213),
-                'melilla': (35.2923, -2.9381)
-            }
+            # Shared city centroids (exact match first, then partial match)
+            coords = city_centroid(facility['city'], partial=True)
             
-            city = facility['city'].lower()
-            
-            # Try exact city match
-            if city in city_coords:
-                lat, lng = city_coords[city]
+            if coords:
+                lat, lng = coords
                 logger.info(f"✅ Geocoded (City lookup): {facility['name']} -> ({lat}, {lng})")
                 
                 return {
@@ -387,23 +362,6 @@ class CoordinateChecker:
                     'Fuente_Problema': f"Geocoded via city lookup - {facility['city']}"
                 }
             
-            # Try partial city match
-            for known_city, coords in city_coords.items():
-                if known_city in city or city in known_city:
-                    lat, lng = coords
-                    logger.info(f"✅ Geocoded (City lookup): {facility['name']} -> ({lat}, {lng})")
-                    
-                    return {
-                        'Nombre_Original': facility['name'],
-                        'Nombre_Correcto': facility['name'],
-                        'Ciudad': facility['city'],
-                        'Tipo': 'TO_BE_DETERMINED',
-                        'Direccion': facility['address'],
-                        'Latitud_Corregida': lat,
-                        'Longitud_Corregida': lng,
-                        'Fuente_Problema': f"Geocoded via city lookup - {facility['city']}"
-                    }
-            
             logger.warning(f"⚠️ No city match found for: {facility['name']} ({facility['city']})")
             return None
             
@@ -435,56 +393,63 @@ class CoordinateChecker:
         logger.info(f"✅ Geocoding completed: {len(geocoded_results)} successful")
         return geocoded_results
     
+    def open_store(self):
+        """Open the facility master store, bootstrapping it from the combined CSV on first use"""
+        is_new = not os.path.exists(self.store_file)
+        store = FacilityStore(self.store_file)
+        if is_new and os.path.exists(self.combined_file):
+            logger.info(f"📥 Bootstrapping facility store from {self.combined_file}")
+            store.import_csv(self.combined_file)
+        return store
+    
     def update_corrections_file(self, new_corrections):
-        """Save new geocoded results to a separate file (don't modify original corrections)"""
-        # Save new geocoded results to separate file
+        """Upsert new geocoded results into the facility master store (manual corrections keep precedence)"""
         new_corrections_df = pd.DataFrame(new_corrections)
-        new_corrections_df.to_csv(self.new_geocoded_file, sep=';', index=False)
-        logger.info(f"✅ Saved new geocoded facilities to: {self.new_geocoded_file}")
+        store = self.open_store()
+        try:
+            store.upsert_many(new_corrections_df)
+        finally:
+            store.close()
+        logger.info(f"✅ Stored new geocoded facilities in: {self.store_file}")
         logger.info(f"📊 New geocoded facilities: {len(new_corrections_df)}")
-        
-        # Also show how to combine them manually
-        logger.info("💡 To combine with original corrections:")
-        logger.info(f"   • Original corrections: {self.corrections_file}")
-        logger.info(f"   • New geocoded: {self.new_geocoded_file}")
-        logger.info("   • You can manually merge them if needed")
-        
         return new_corrections_df
     
     def save_final_combined(self, geocoded_results):
-        """Combina correcciones manuales y nuevas geocodificadas en un solo archivo final, sin duplicados y con facility_id."""
+        """Upsert correcciones manuales y nuevas geocodificadas en el almacén maestro y exporta all_corrected_facilities.csv.
+        Las filas sin cambios no se tocan; la prioridad es manual > proveedor > centroide de ciudad."""
         # Cargar correcciones manuales
-        corrections = None
-        if os.path.exists(self.corrections_file):
-            corrections = pd.read_csv(self.corrections_file, sep=';')
-        else:
-            corrections = pd.DataFrame()
+        corrections = self.load_corrections()
+        # Sin archivo de correcciones legible no se borra nada del almacén
+        synced = corrections is not None
+        corrections = pd.DataFrame() if corrections is None else corrections.copy()
         # Convertir resultados nuevos a DataFrame
         df_geocoded = pd.DataFrame(geocoded_results)
-        # Cargar raw para obtener ids
-        raw = pd.read_csv(self.raw_file)
-        name_to_id = dict(zip(raw['name'].str.lower(), raw['id']))
-        # Añadir facility_id a ambos dataframes
+        # Raw (ya cargado en el repositorio) para obtener ids
+        raw = self.repository.get('raw_facilities', required=True)
+        raw_index = FacilityNameIndex(raw['name'], keys=raw['id'])
+        # Añadir facility_id a ambos dataframes (emparejando nombres normalizados)
         if not corrections.empty:
-            corrections['facility_id'] = corrections['Nombre_Original'].str.lower().map(name_to_id)
+            corrections['facility_id'] = corrections['Nombre_Original'].map(raw_index.lookup)
         if not df_geocoded.empty:
-            df_geocoded['facility_id'] = df_geocoded['Nombre_Original'].str.lower().map(name_to_id)
-        # Unificar columnas
-        if not corrections.empty:
-            corrections.columns = [c.strip() for c in corrections.columns]
-        if not df_geocoded.empty:
-            df_geocoded.columns = [c.strip() for c in df_geocoded.columns]
-        # Concatenar y eliminar duplicados por 'Nombre_Original' (prioridad a correcciones manuales)
-        df_all = pd.concat([corrections, df_geocoded], ignore_index=True)
-        df_all = df_all.drop_duplicates(subset=['Nombre_Original'], keep='first')
-        # Guardar archivo final
-        output_file = os.path.join(self.data_dir, 'all_corrected_facilities.csv')
-        df_all.to_csv(output_file, sep=';', index=False, encoding='utf-8')
-        logger.info(f"✅ Archivo combinado generado: {output_file} ({len(df_all)} instalaciones)")
-        return output_file
+            df_geocoded['facility_id'] = df_geocoded['Nombre_Original'].map(raw_index.lookup)
+        # Upsert con prioridad: las correcciones manuales siempre ganan
+        store = self.open_store()
+        try:
+            if synced:
+                # Una corrección borrada del CSV deja de imponerse a los datos
+                store.prune_manual(corrections.get('Nombre_Original', []))
+            store.upsert_many(corrections, source='manual')
+            store.upsert_many(df_geocoded)
+            # Vista CSV compatible para revisión manual
+            store.export_csv(self.combined_file)
+            total = len(store)
+        finally:
+            store.close()
+        logger.info(f"✅ Archivo combinado generado: {self.combined_file} ({total} instalaciones)")
+        return self.combined_file
     
-    def run_full_check(self):
-        """Run the complete coordinate checking and geocoding process (geocode all except already-corrected)"""
+    def run_full_check(self, force=False):
+        """Run the coordinate checking and geocoding process for new or changed facilities (all of them with force=True)"""
         logger.info("🚀 Starting comprehensive coordinate check")
         logger.info("=" * 50)
         
@@ -495,26 +460,40 @@ class CoordinateChecker:
         
         # Load corrections
         corrections = self.load_corrections()
-        corrected_names = set()
-        if corrections is not None:
-            corrected_names = set(corrections['Nombre_Original'].str.lower())
+        corrections_index = self.build_corrections_index(corrections)
         
-        # Build list of facilities to geocode: all except already-corrected
+        # Fingerprint addresses to find facilities that are new or changed since the last run
+        fingerprints = self.fingerprints.compute(raw_data)
+        status = self.fingerprints.classify(raw_data['id'], fingerprints)
+        changed_ids = set(status['changed'])
+        unchanged_ids = set() if force else set(status['unchanged'])
+        
+        # Build list of facilities to geocode: new or changed, except already-corrected
         facilities_to_geocode = []
         already_corrected = []
-        for _, facility in raw_data.iterrows():
-            name = facility['name'].lower()
-            if name in corrected_names:
+        counts = {'new': 0, 'changed': 0, 'skipped': 0}
+        for idx, facility in raw_data.iterrows():
+            if facility['name'] in corrections_index:
                 already_corrected.append(facility['name'])
                 continue
+            key = facility_key(facility['id'])
+            if key in unchanged_ids:
+                counts['skipped'] += 1
+                continue
+            counts['changed' if key in changed_ids else 'new'] += 1
             # Build dict for geocoding
             facilities_to_geocode.append({
                 'name': facility['name'],
                 'address': facility.get('address', ''),
                 'city': facility.get('address_city', '') or facility.get('city', ''),
+                'facility_id': key,
+                'fingerprint': fingerprints.at[idx],
             })
         
         logger.info(f"⏭️ Already corrected: {len(already_corrected)}")
+        logger.info(f"⏭️ Skipped (address unchanged): {counts['skipped']}")
+        logger.info(f"🆕 New facilities: {counts['new']}")
+        logger.info(f"✏️ Changed facilities: {counts['changed']}")
         logger.info(f"🔄 Will geocode: {len(facilities_to_geocode)} facilities")
         if already_corrected:
             logger.info("🔧 Already corrected facilities:")
@@ -531,21 +510,44 @@ class CoordinateChecker:
             logger.warning("You can still view the analysis above")
             return True
         
-        # Geocode all facilities except already-corrected
-        geocoded_results = self.geocode_facilities(facilities_to_geocode)
+        # Geocode new or changed facilities except already-corrected
+        with track_stage('geocode', rows_in=len(facilities_to_geocode)) as stage:
+            geocoded_results = self.geocode_facilities(facilities_to_geocode)
+            stage.rows_out = len(geocoded_results)
         # Guardar archivo combinado final
-        self.save_final_combined(geocoded_results)
+        with track_stage('save_corrections', rows_in=len(geocoded_results)):
+            self.save_final_combined(geocoded_results)
+        
+        # Record fingerprints only for precise geocodes: failures and city-centroid fallbacks are retried next run
+        by_name = {f['name']: f for f in facilities_to_geocode}
+        fallbacks = 0
+        for result in geocoded_results:
+            facility = by_name.get(result['Nombre_Original'])
+            if facility is None:
+                continue
+            if classify_source(result['Fuente_Problema']) == 'city_centroid':
+                fallbacks += 1
+                self.fingerprints.discard(facility['facility_id'])
+                continue
+            self.fingerprints.update(facility['facility_id'], facility['fingerprint'])
+        self.fingerprints.save()
+        logger.info(f"🔏 Fingerprints stored: {len(self.fingerprints)}"
+                    + (f" ({fallbacks} city-centroid fallbacks will be geocoded again)" if fallbacks else ""))
         logger.info("🎉 Coordinate checking y combinación completadas!")
         logger.info("💡 Next steps:")
         logger.info("   1. Revisa el archivo combinado all_corrected_facilities.csv")
         logger.info("   2. Ejecuta 'python map.py' para generar el mapa")
         return True
 
-def main():
+def main(argv=None):
     """Main function"""
+    parser = argparse.ArgumentParser(description="Check and geocode facility coordinates")
+    parser.add_argument('--force', action='store_true',
+                        help="Geocode every facility, ignoring stored address fingerprints")
+    args = parser.parse_args(argv)
     try:
         checker = CoordinateChecker()
-        success = checker.run_full_check()
+        success = checker.run_full_check(force=args.force)
         
         if success:
             logger.info("✅ Process completed successfully!")
@@ -559,4 +561,5 @@ def main():
         return False
 
 if __name__ == "__main__":
-    main() 
\ No newline at end of file
+    main()
+    write_metrics() 
\ No newline at end of file
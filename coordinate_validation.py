@@ -0,0 +1,361 @@
+"""
+Coordinate Plausibility Validation
+Vectorized checks of geocoded coordinates: haversine distance to the declared
+city / postal-code centroid and point-in-polygon tests against Spain's regions.
+"""
+
+import json
+import os
+import re
+import unicodedata
+import numpy as np
+import pandas as pd
+
+EARTH_RADIUS_KM = 6371.0088
+
+# Coordenadas de referencia de ciudades españolas (lat, lon)
+CITY_CENTROIDS = {
+    'barcelona': (41.3851, 2.1734),
+    'madrid': (40.4168, -3.7038),
+    'valencia': (39.4699, -0.3763),
+    'sevilla': (37.3891, -5.9845),
+    'zaragoza': (41.6488, -0.8891),
+    'málaga': (36.7213, -4.4217),
+    'murcia': (37.9922, -1.1307),
+    'palma': (39.5696, 2.6502),
+    'las palmas': (28.1235, -15.4366),
+    'santa cruz de tenerife': (28.4636, -16.2518),
+    'bilbao': (43.2627, -2.9253),
+    'alicante': (38.3452, -0.4815),
+    'cordoba': (37.8882, -4.7794),
+    'valladolid': (41.6523, -4.7245),
+    'vigo': (42.2406, -8.7207),
+    'gijón': (43.5453, -5.6619),
+    'granada': (37.1765, -3.5976),
+    'oviedo': (43.3623, -5.8493),
+    'santander': (43.4623, -3.8099),
+    'tarrasa': (41.5606, 2.0104),
+    'sabadell': (41.5463, 2.1074),
+    'alcorcón': (40.3494, -3.8313),
+    'móstoles': (40.3233, -3.8644),
+    'fuenlabrada': (40.2842, -3.7942),
+    'badalona': (41.4500, 2.2474),
+    'hospitalet': (41.3597, 2.0998),
+    'alcalá de henares': (40.4820, -3.3635),
+    'terrassa': (41.5606, 2.0104),
+    'jerez de la frontera': (36.6866, -6.1372),
+    'marbella': (36.5097, -4.8860),
+    'león': (42.5987, -5.5671),
+    'tarragona': (41.1187, 1.2453),
+    'lleida': (41.6148, 0.6268),
+    'castellón': (39.9864, -0.0513),
+    'burgos': (42.3408, -3.6997),
+    'salamanca': (40.9645, -5.6630),
+    'albacete': (38.9952, -1.8557),
+    'huelva': (37.2614, -6.9447),
+    'logroño': (42.4627, -2.4449),
+    'cádiz': (36.5297, -6.2926),
+    'lucena': (37.4088, -4.4852),
+    'jaén': (37.7796, -3.7849),
+    'orense': (42.3355, -7.8639),
+    'girona': (41.9794, 2.8214),
+    'lugo': (43.0097, -7.5560),
+    'cáceres': (39.4765, -6.3722),
+    'talavera de la reina': (39.9603, -4.8303),
+    'santiago de compostela': (42.8805, -8.5456),
+    'lérida': (41.6148, 0.6268),
+    'cartagena': (37.6057, -0.9913),
+    'toledo': (39.8584, -4.0226),
+    'elche': (38.2672, -0.6987),
+    'guadalajara': (40.6296, -3.1665),
+    'tudela': (42.0644, -1.6044),
+    'ceuta': (35.8894, -5.3213),
+    'melilla': (35.2923, -2.9381),
+    'a coruña': (43.3623, -8.4115),
+    'pontevedra': (42.4310, -8.6444),
+    'sant cugat del vallès': (41.4722, 2.0861),
+    'granollers': (41.6079, 2.2876),
+    'mataró': (41.5381, 2.4445),
+    'blanes': (41.6741, 2.7903),
+    'figueres': (42.2666, 2.9617),
+    'martorell': (41.4742, 1.9306),
+    'igualada': (41.5791, 1.6171),
+    'sant pere de ribes': (41.2599, 1.7717),
+    'pineda de mar': (41.6277, 2.6894),
+    'calella': (41.6136, 2.6544),
+    'sant boi de llobregat': (41.3436, 2.0366),
+    'caravaca de la cruz': (38.1064, -1.8605),
+    'getafe': (40.3083, -3.7327),
+    'majadahonda': (40.4735, -3.8718),
+    'alcobendas': (40.5475, -3.6420),
+    'torrejón de ardoz': (40.4554, -3.4697),
+}
+
+# Códigos y nombres comarcales que aparecen en el campo ciudad
+CITY_ALIASES = {
+    'mad': 'madrid',
+    'bcn': 'barcelona',
+    'gjn': 'gijón',
+    'maresme': 'mataró',
+    'el vallès': 'sabadell',
+}
+
+# Capital de provincia por prefijo de código postal (dos primeros dígitos)
+PROVINCE_CENTROIDS = {
+    '01': (42.8467, -2.6716), '02': (38.9943, -1.8585), '03': (38.3452, -0.4810),
+    '04': (36.8381, -2.4597), '05': (40.6566, -4.6818), '06': (38.8794, -6.9707),
+    '07': (39.5696, 2.6502), '08': (41.3851, 2.1734), '09': (42.3439, -3.6969),
+    '10': (39.4753, -6.3724), '11': (36.5271, -6.2886), '12': (39.9864, -0.0513),
+    '13': (38.9848, -3.9274), '14': (37.8882, -4.7794), '15': (43.3623, -8.4115),
+    '16': (40.0704, -2.1374), '17': (41.9794, 2.8214), '18': (37.1773, -3.5986),
+    '19': (40.6296, -3.1665), '20': (43.3183, -1.9812), '21': (37.2614, -6.9447),
+    '22': (42.1401, -0.4089), '23': (37.7796, -3.7849), '24': (42.5987, -5.5671),
+    '25': (41.6176, 0.6200), '26': (42.4627, -2.4449), '27': (43.0097, -7.5560),
+    '28': (40.4168, -3.7038), '29': (36.7213, -4.4217), '30': (37.9922, -1.1307),
+    '31': (42.8125, -1.6458), '32': (42.3358, -7.8639), '33': (43.3614, -5.8593),
+    '34': (42.0095, -4.5288), '35': (28.1235, -15.4366), '36': (42.4310, -8.6444),
+    '37': (40.9701, -5.6635), '38': (28.4636, -16.2518), '39': (43.4623, -3.8099),
+    '40': (40.9429, -4.1088), '41': (37.3891, -5.9845), '42': (41.7640, -2.4688),
+    '43': (41.1189, 1.2445), '44': (40.3457, -1.1065), '45': (39.8628, -4.0273),
+    '46': (39.4699, -0.3763), '47': (41.6523, -4.7245), '48': (43.2630, -2.9350),
+    '49': (41.5035, -5.7446), '50': (41.6488, -0.8891), '51': (35.8894, -5.3213),
+    '52': (35.2923, -2.9381),
+}
+
+# Contornos simplificados (lat, lon) de las regiones de España, con margen
+# costero. data/spain_regions.geojson los sustituye por límites reales (default_regions()).
+SPAIN_REGIONS = {
+    'peninsula': [[
+        (43.85, -9.45), (43.85, -7.50), (43.70, -5.80), (43.60, -3.50), (43.50, -1.80),
+        (43.30, -1.35), (43.05, -0.70), (42.80, 0.00), (42.90, 0.70), (42.55, 1.40),
+        (42.45, 2.00), (42.45, 3.25), (42.35, 3.45), (41.75, 3.30), (41.40, 2.45),
+        (41.05, 1.35), (40.55, 0.95), (40.00, 0.15), (39.40, -0.15), (38.75, 0.35),
+        (38.30, -0.35), (37.60, -0.55), (36.65, -2.10), (36.60, -4.40), (36.15, -5.25),
+        (35.95, -5.65), (36.40, -6.40), (36.95, -6.70), (37.15, -7.45), (37.55, -7.55),
+        (38.20, -7.15), (38.85, -7.10), (39.40, -7.35), (39.70, -7.60), (40.05, -7.05),
+        (40.40, -6.85), (41.05, -6.95), (41.60, -6.25), (41.95, -6.60), (41.95, -7.25),
+        (42.05, -8.20), (41.85, -8.90), (42.20, -9.05), (42.90, -9.40), (43.20, -9.35),
+    ]],
+    'baleares': [
+        [(38.60, 1.10), (39.20, 1.10), (39.20, 1.70), (38.60, 1.70)],
+        [(39.20, 2.25), (40.05, 2.25), (40.05, 3.55), (39.20, 3.55)],
+        [(39.75, 3.75), (40.15, 3.75), (40.15, 4.40), (39.75, 4.40)],
+    ],
+    'canarias': [[
+        (27.55, -18.25), (29.50, -18.25), (29.50, -13.30), (27.55, -13.30),
+    ]],
+    'ceuta': [[
+        (35.85, -5.40), (35.93, -5.40), (35.93, -5.25), (35.85, -5.25),
+    ]],
+    'melilla': [[
+        (35.25, -2.98), (35.33, -2.98), (35.33, -2.91), (35.25, -2.91),
+    ]],
+}
+
+DATA_DIR = 'data'
+REGIONS_FILE = 'spain_regions.geojson'
+
+POSTAL_CODE_PATTERN = re.compile(r'\b(0[1-9]|[1-4]\d|5[0-2])\d{3}\b')
+
+
+def normalize_place_name(name):
+    """Lowercase and strip accents so 'Gijón' and 'gijon' compare equal"""
+    if name is None or pd.isna(name):
+        return ''
+    text = unicodedata.normalize('NFKD', str(name).strip().lower())
+    return ''.join(ch for ch in text if not unicodedata.combining(ch))
+
+
+_NORMALIZED_CITIES = {normalize_place_name(k): v for k, v in CITY_CENTROIDS.items()}
+_NORMALIZED_ALIASES = {normalize_place_name(k): normalize_place_name(v) for k, v in CITY_ALIASES.items()}
+
+
+def city_centroid(city, partial=False):
+    """Return (lat, lon) for a city name or code, optionally allowing partial name matches"""
+    key = normalize_place_name(city)
+    if not key:
+        return None
+    key = _NORMALIZED_ALIASES.get(key, key)
+    if key in _NORMALIZED_CITIES:
+        return _NORMALIZED_CITIES[key]
+    if partial:
+        for known_city, coords in _NORMALIZED_CITIES.items():
+            if known_city in key or key in known_city:
+                return coords
+    return None
+
+
+def postal_code_centroid(address):
+    """Return the province capital (lat, lon) for the first Spanish postal code found in an address"""
+    if address is None or pd.isna(address):
+        return None
+    match = POSTAL_CODE_PATTERN.search(str(address))
+    if not match:
+        return None
+    return PROVINCE_CENTROIDS.get(match.group(1))
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """Vectorized great-circle distance in kilometres (inputs broadcast like NumPy arrays)"""
+    lat1, lon1, lat2, lon2 = (np.radians(np.asarray(v, dtype=float)) for v in (lat1, lon1, lat2, lon2))
+    a = np.sin((lat2 - lat1) / 2.0) ** 2 + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2.0) ** 2
+    return 2.0 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(np.clip(a, 0.0, 1.0)))
+
+
+def load_region_polygons(geojson_path):
+    """Load region multi-polygons from a GeoJSON file (properties.name names each region)"""
+    with open(geojson_path, encoding='utf-8') as f:
+        collection = json.load(f)
+
+    regions = {}
+    features = collection.get('features', [collection])
+    for i, feature in enumerate(features):
+        geometry = feature.get('geometry', feature)
+        name = (feature.get('properties') or {}).get('name', f'region_{i}')
+        if geometry['type'] == 'Polygon':
+            polygons = [geometry['coordinates']]
+        elif geometry['type'] == 'MultiPolygon':
+            polygons = geometry['coordinates']
+        else:
+            continue
+        # GeoJSON usa (lon, lat); cada anillo se guarda como (lat, lon)
+        for polygon in polygons:
+            for ring in polygon:
+                regions.setdefault(name, []).append([(lat, lon) for lon, lat in ring])
+    return regions
+
+
+_REGIONS_CACHE = {}
+
+
+def default_regions(data_dir=DATA_DIR):
+    """Use data/spain_regions.geojson when available, otherwise the built-in simplified outlines"""
+    geojson_path = os.path.join(data_dir, REGIONS_FILE)
+    try:
+        mtime = os.stat(geojson_path).st_mtime_ns
+    except OSError:
+        return SPAIN_REGIONS
+    # El GeoJSON se parsea una vez por versión del fichero
+    cached = _REGIONS_CACHE.get(geojson_path)
+    if cached is None or cached[0] != mtime:
+        cached = _REGIONS_CACHE[geojson_path] = (mtime, load_region_polygons(geojson_path))
+    return cached[1]
+
+
+def region_bounding_boxes(regions=None):
+    """Return [[min_lat, min_lon, max_lat, max_lon], ...] for every ring of every region (default_regions() by default)"""
+    regions = default_regions() if regions is None else regions
+    boxes = []
+    for rings in regions.values():
+        for ring in rings:
+            ring = np.asarray(ring, dtype=float)
+            boxes.append([float(ring[:, 0].min()), float(ring[:, 1].min()),
+                          float(ring[:, 0].max()), float(ring[:, 1].max())])
+    return boxes
+
+
+def _points_in_ring(lat, lon, ring):
+    """Even-odd ray casting of many points against one ring"""
+    ring = np.asarray(ring, dtype=float)
+    y1, x1 = ring[:, 0], ring[:, 1]
+    y2, x2 = np.roll(y1, -1), np.roll(x1, -1)
+
+    inside = np.zeros(len(lat), dtype=bool)
+    for ya, xa, yb, xb in zip(y1, x1, y2, x2):
+        crosses = (ya > lat) != (yb > lat)
+        if not crosses.any():
+            continue
+        x_cross = xa + (lat - ya) * (xb - xa) / ((yb - ya) if yb != ya else 1e-12)
+        inside ^= crosses & (lon < x_cross)
+    return inside
+
+
+def locate_regions(lat, lon, regions=None):
+    """Return the region name containing each point ('' when outside all regions; default_regions() by default)"""
+    regions = default_regions() if regions is None else regions
+    lat = np.asarray(lat, dtype=float)
+    lon = np.asarray(lon, dtype=float)
+    result = np.full(len(lat), '', dtype=object)
+    valid = np.isfinite(lat) & np.isfinite(lon)
+
+    for name, rings in regions.items():
+        inside_region = np.zeros(len(lat), dtype=bool)
+        for ring in rings:
+            ring_arr = np.asarray(ring, dtype=float)
+            # Prefiltro por caja envolvente: sólo los puntos dentro pasan al ray casting
+            candidates = np.flatnonzero(
+                valid & (result == '')
+                & (lat >= ring_arr[:, 0].min()) & (lat <= ring_arr[:, 0].max())
+                & (lon >= ring_arr[:, 1].min()) & (lon <= ring_arr[:, 1].max())
+            )
+            if len(candidates) == 0:
+                continue
+            inside_region[candidates] ^= _points_in_ring(lat[candidates], lon[candidates], ring_arr)
+        result[inside_region] = name
+    return result
+
+
+def in_spain_mask(lat, lon, regions=None):
+    """Boolean mask of points inside Spain (peninsula, islands, Ceuta and Melilla)"""
+    return locate_regions(lat, lon, regions) != ''
+
+
+def validate_coordinates(df, lat_col='latitude', lon_col='longitude', city_col='city',
+                         address_col='address', max_city_km=35.0, max_province_km=150.0, regions=None):
+    """
+    Check each coordinate against Spain's regions and against its declared city
+    and postal-code centroids. Returns a DataFrame aligned with df.
+    """
+    lat = pd.to_numeric(df[lat_col], errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(df[lon_col], errors='coerce').to_numpy(dtype=float)
+    cities = df[city_col] if city_col in df.columns else pd.Series([None] * len(df), index=df.index)
+    addresses = df[address_col] if address_col in df.columns else pd.Series([None] * len(df), index=df.index)
+
+    # Centroides de referencia: una búsqueda por valor distinto, no por fila
+    city_lookup = {c: city_centroid(c) for c in pd.unique(cities.astype(object))}
+    city_ref = np.array([city_lookup.get(c) or (np.nan, np.nan) for c in cities], dtype=float).reshape(-1, 2)
+    postal_ref = np.array([postal_code_centroid(a) or (np.nan, np.nan) for a in addresses], dtype=float).reshape(-1, 2)
+
+    city_km = haversine_km(lat, lon, city_ref[:, 0], city_ref[:, 1])
+    province_km = haversine_km(lat, lon, postal_ref[:, 0], postal_ref[:, 1])
+    region = locate_regions(lat, lon, regions)
+
+    missing = ~(np.isfinite(lat) & np.isfinite(lon))
+    outside = ~missing & (region == '')
+    far_city = ~missing & ~outside & (city_km > max_city_km)
+    far_province = ~missing & ~outside & ~far_city & (province_km > max_province_km)
+
+    issue = np.full(len(df), '', dtype=object)
+    issue[far_province] = 'Far from postal code province'
+    issue[far_city] = 'Far from declared city'
+    issue[outside] = 'Outside Spain regions'
+    issue[missing] = 'Missing coordinates'
+
+    return pd.DataFrame({
+        'region': region,
+        'city_distance_km': city_km,
+        'postal_distance_km': province_km,
+        'plausible': issue == '',
+        'issue': issue,
+    }, index=df.index)
+
+
+# Distancia que explica cada incidencia de validate_coordinates
+ISSUE_DISTANCE_COLUMNS = {
+    'Far from declared city': 'city_distance_km',
+    'Far from postal code province': 'postal_distance_km',
+}
+
+
+def describe_issue(check):
+    """Issue of a validate_coordinates row with the distance behind it, e.g. 'Far from declared city (48 km)'"""
+    column = ISSUE_DISTANCE_COLUMNS.get(check['issue'])
+    if column is None or pd.isna(check[column]):
+        return check['issue']
+    return f"{check['issue']} ({check[column]:.0f} km)"
+
+
+def is_plausible(lat, lon, city=None, address=None, **kwargs):
+    """Scalar convenience wrapper around validate_coordinates for a single point"""
+    row = pd.DataFrame({'latitude': [lat], 'longitude': [lon], 'city': [city], 'address': [address]})
+    return bool(validate_coordinates(row, **kwargs)['plausible'].iloc[0])
@@ -0,0 +1,249 @@
+#!/usr/bin/env python3
+"""
+Refresh Daemon
+Long-running mode that keeps one Metabase session and the datasets in memory and
+refreshes each question on its own schedule (facilities daily, shifts every 5
+minutes, offers hourly). After a refresh only the affected artifacts are rebuilt:
+facilities -> geocoding + map, shifts -> available_shifts.csv + map,
+offers -> available_offers.csv + map. Unchanged downloads rebuild nothing.
+Between shift refreshes a cheap expiry pass (every minute) removes the shifts
+that have started since from the change feed, without a rebuild (expiry.py).
+Per-dataset refresh times and durations are written to data/daemon_status.json.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import signal
+import threading
+import time
+from datetime import datetime, timezone
+
+import pandas as pd
+
+import data
+from metrics import track_stage, write_metrics
+from repository import get_repository
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+STATUS_FILE = os.path.join(DATA_DIR, 'daemon_status.json')
+
+
+class RefreshJob:
+    """One Metabase question refreshed on a fixed interval"""
+
+    def __init__(self, name, question_id, description, raw_file, interval, process=None, geocode=False):
+        self.name = name
+        self.question_id = question_id
+        self.description = description
+        self.raw_file = raw_file
+        self.interval = interval
+        self.process = process
+        self.geocode = geocode
+        self.next_run = 0.0
+        self.content_hash = None
+        self.status = {'interval_seconds': interval}
+
+
+def default_jobs(facilities_interval=24 * 3600, shifts_interval=5 * 60, offers_interval=3600):
+    return [
+        RefreshJob('facilities', data.FACILITY_QUESTION_ID, "Facility Data", 'raw_facilities.csv',
+                   facilities_interval, geocode=True),
+        RefreshJob('shifts', data.SHIFTS_QUESTION_ID, "Shifts Data", 'raw_shifts.csv',
+                   shifts_interval, process=data.process_available_shifts),
+        RefreshJob('offers', data.OFFERS_QUESTION_ID, "Offers Data", 'raw_offers.csv',
+                   offers_interval, process=data.process_available_offers),
+    ]
+
+
+def frame_hash(df):
+    """Content hash of a DataFrame, used to skip rebuilds when a download did not change"""
+    try:
+        values = pd.util.hash_pandas_object(df, index=False).to_numpy()
+        payload = values.tobytes() + ','.join(map(str, df.columns)).encode('utf-8')
+    except TypeError:
+        payload = df.to_csv(index=False).encode('utf-8')
+    return hashlib.sha1(payload).hexdigest()
+
+
+def _now_iso():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class RefreshDaemon:
+    """Scheduler loop: refresh due datasets, then rebuild the affected artifacts once"""
+
+    def __init__(self, jobs, data_dir=DATA_DIR, status_file=STATUS_FILE, expiry_interval=60):
+        self.jobs = jobs
+        self.expiry_interval = expiry_interval
+        self.next_expiry = 0.0
+        self.expiry_status = {'interval_seconds': expiry_interval}
+        self.data_dir = data_dir
+        self.status_file = status_file
+        self.repository = get_repository(data_dir)
+        self.fetcher = None
+        self.artifacts = {}
+        self._stop = threading.Event()
+
+    def stop(self, *_):
+        logger.info("🛑 Stop requested, finishing current cycle")
+        self._stop.set()
+
+    def _get_fetcher(self):
+        # Una sola sesión de Metabase; se recrea si una petición falla
+        if self.fetcher is None:
+            self.fetcher = data.MetabaseDataFetcher()
+        return self.fetcher
+
+    def _drop_fetcher(self):
+        if self.fetcher is not None:
+            try:
+                self.fetcher.logout()
+            except Exception:
+                pass
+        self.fetcher = None
+
+    def refresh(self, job):
+        """Fetch one dataset; returns True when its content changed and was saved"""
+        start = time.perf_counter()
+        job.status['last_attempt'] = _now_iso()
+        changed = False
+        try:
+            with track_stage(f'refresh_{job.name}') as stage:
+                df = self._get_fetcher().fetch_question_data(job.question_id, job.description)
+                if df is None:
+                    self._drop_fetcher()
+                    raise RuntimeError(f"Metabase returned no data for question {job.question_id}")
+                stage.rows_out = len(df)
+                content_hash = frame_hash(df)
+                if content_hash != job.content_hash:
+                    if not self.fetcher.save_data_to_csv(df, job.raw_file, self.data_dir):
+                        raise RuntimeError(f"Could not save {job.raw_file}")
+                    self.repository.put(f"raw_{job.name}", df)
+                    if job.process is not None:
+                        job.process(df, self.data_dir)
+                    job.content_hash = content_hash
+                    changed = True
+            job.status.update({
+                'last_refresh': _now_iso(),
+                'rows': len(df),
+                'changed': changed,
+                'last_error': None,
+            })
+            logger.info(f"🔄 {job.name}: {len(df)} rows, {'changed' if changed else 'unchanged'}")
+        except Exception as e:
+            job.status['last_error'] = str(e)
+            logger.error(f"❌ Refresh of {job.name} failed: {e}")
+        finally:
+            job.status['duration_seconds'] = round(time.perf_counter() - start, 3)
+            job.next_run = time.time() + job.interval
+            job.status['next_refresh'] = datetime.fromtimestamp(job.next_run, timezone.utc).isoformat()
+        return changed
+
+    def expire(self):
+        """Remove the shifts that started since the last pass from the open maps; returns how many (None on error)"""
+        from expiry import expire_started_shifts
+        start = time.perf_counter()
+        expired = None
+        try:
+            with track_stage('expire_shifts') as stage:
+                expired = expire_started_shifts(self.data_dir, repository=self.repository)
+                stage.rows_out = expired or 0
+            self.expiry_status.update({'last_run': _now_iso(), 'expired': stage.rows_out, 'last_error': None})
+        except Exception as e:
+            self.expiry_status['last_error'] = str(e)
+            logger.error(f"❌ Shift expiry failed: {e}")
+        finally:
+            self.expiry_status['duration_seconds'] = round(time.perf_counter() - start, 3)
+            self.next_expiry = time.time() + self.expiry_interval
+        return expired
+
+    def rebuild(self, geocode):
+        """Rebuild downstream artifacts after at least one dataset changed"""
+        if geocode:
+            from coordinate_checker import CoordinateChecker
+            self._build_artifact('geocode', lambda: CoordinateChecker(data_dir=self.data_dir).run_full_check())
+        import map as map_builder
+        self._build_artifact('map', map_builder.main)
+
+    def _build_artifact(self, name, func):
+        start = time.perf_counter()
+        try:
+            ok = bool(func())
+        except Exception as e:
+            logger.error(f"❌ Rebuilding {name} failed: {e}")
+            ok = False
+        self.artifacts[name] = {
+            'last_build': _now_iso(),
+            'duration_seconds': round(time.perf_counter() - start, 3),
+            'ok': ok,
+        }
+
+    def write_status(self):
+        status = {
+            'updated_at': _now_iso(),
+            'datasets': {job.name: job.status for job in self.jobs},
+            'expiry': self.expiry_status,
+            'artifacts': self.artifacts,
+        }
+        os.makedirs(os.path.dirname(self.status_file) or '.', exist_ok=True)
+        tmp_path = f"{self.status_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(status, f, indent=2)
+        os.replace(tmp_path, self.status_file)
+
+    def run_cycle(self):
+        """Refresh every due dataset and rebuild what they affect"""
+        now = time.time()
+        due = [job for job in self.jobs if job.next_run <= now]
+        changed = [job for job in due if self.refresh(job)]
+        if changed:
+            self.rebuild(geocode=any(job.geocode for job in changed))
+        # Los turnos que empiezan solo generan un parche en el feed, sin reconstruir el mapa
+        if self.expiry_interval and self.next_expiry <= now:
+            self.expire()
+        self.write_status()
+        write_metrics()
+        return due
+
+    def run(self, once=False):
+        logger.info("🚀 Refresh daemon started: " +
+                    ", ".join(f"{job.name} every {job.interval}s" for job in self.jobs))
+        try:
+            while not self._stop.is_set():
+                self.run_cycle()
+                if once:
+                    break
+                next_runs = [job.next_run for job in self.jobs] + ([self.next_expiry] if self.expiry_interval else [])
+                wait = max(0.0, min(next_runs) - time.time())
+                self._stop.wait(wait)
+        finally:
+            self._drop_fetcher()
+        logger.info("👋 Refresh daemon stopped")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Keep the facility map fresh with per-dataset refresh intervals")
+    parser.add_argument('--facilities-interval', type=int, default=24 * 3600, help="Seconds between facility refreshes")
+    parser.add_argument('--shifts-interval', type=int, default=5 * 60, help="Seconds between shift refreshes")
+    parser.add_argument('--offers-interval', type=int, default=3600, help="Seconds between offer refreshes")
+    parser.add_argument('--expiry-interval', type=int, default=60, help="Seconds between started-shift expiry passes (0 disables)")
+    parser.add_argument('--once', action='store_true', help="Refresh every dataset once and exit")
+    args = parser.parse_args(argv)
+
+    daemon = RefreshDaemon(default_jobs(args.facilities_interval, args.shifts_interval, args.offers_interval),
+                           expiry_interval=args.expiry_interval)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    daemon.run(once=args.once)
+    return all(not job.status.get('last_error') for job in daemon.jobs)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -6,14 +6,20 @@ Supports both username/password and API key authentication.
 
 import pandas as pd
 import os
-import requests
 import logging
-from dotenv import load_dotenv
+from repository import get_repository
+from metrics import track_stage, write_metrics
+from engine import get_engine
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# Configuration - Change these question IDs according to your Metabase setup
+FACILITY_QUESTION_ID = 4846  # Change this to your facility question ID
+SHIFTS_QUESTION_ID = 4659    # Optional: for shifts data (if needed)
+OFFERS_QUESTION_ID = 4925    # NEW: for offers data
+
 class MetabaseDataFetcher:
     """Enhanced class to fetch data from Metabase API with flexible authentication"""
     
@@ -31,7 +37,8 @@ class MetabaseDataFetcher:
             logger.error("    METABASE_API_KEY=your_api_key")
             raise FileNotFoundError(".env file is required but was not found")
         
-        # Load variables from .env file
+        # Load variables from .env file (imported here so processing-only callers skip dotenv/requests)
+        from dotenv import load_dotenv
         load_dotenv(dotenv_path='.env')
         
         # Get credentials from .env
@@ -61,6 +68,7 @@ class MetabaseDataFetcher:
             raise ValueError("Missing authentication credentials in .env file")
         
         self.metabase_url = self.metabase_url.rstrip('/')
+        import requests
         self.session = requests.Session()
         self.session_token = None
         
@@ -262,32 +270,28 @@ def process_available_shifts(shifts_data, data_dir='data'):
     """Procesa los shifts para dejar solo los disponibles y los guarda en available_shifts.csv"""
     import pandas as pd
     from datetime import datetime, timezone
-    import pytz
     if shifts_data is None or shifts_data.empty:
         logging.warning("⚠️ No shifts data to process.")
         return False
     
-    # Filtrar solo shifts publicados, futuros y con external_visible = true
-    now_utc = pd.Timestamp(datetime.now(timezone.utc))
-    shifts_data['start_time_utc'] = pd.to_datetime(shifts_data['start_time_utc'], utc=True, errors='coerce')
-    
-    # Aplicar filtros: status = PUBLISHED, fecha futura, y external_visible = true
-    available = shifts_data[
-        (shifts_data['status'] == 'PUBLISHED') & 
-        (shifts_data['start_time_utc'] > now_utc) &
-        (shifts_data['external_visible'] == True)
-    ]
-    
-    # Seleccionar columnas clave
-    cols = [
-        'facility_id', 'id', 'start_time_utc', 'finish_time_utc', 'specialization',
-        'specialization_display_text', 'category', 'capacity', 'facility_name'
-    ]
-    available = available[cols]
-    
-    # Guardar
-    out_path = os.path.join(data_dir, 'available_shifts.csv')
-    available.to_csv(out_path, index=False, encoding='utf-8')
+    with track_stage('process_shifts', rows_in=len(shifts_data)) as stage:
+        # Filtrar solo shifts publicados, futuros y con external_visible = true
+        now_utc = pd.Timestamp(datetime.now(timezone.utc))
+        
+        # Seleccionar columnas clave
+        cols = [
+            'facility_id', 'id', 'start_time_utc', 'finish_time_utc', 'specialization',
+            'specialization_display_text', 'category', 'capacity', 'facility_name'
+        ]
+        # Aplicar filtros: status = PUBLISHED, fecha futura, y external_visible = true
+        available = get_engine().filter_available_shifts(shifts_data, now_utc, cols)
+        # Ordenados por inicio: expiry.py quita los ya empezados como un prefijo (searchsorted)
+        available = available.sort_values('start_time_utc', kind='stable')
+        
+        # Guardar
+        out_path = os.path.join(data_dir, 'available_shifts.csv')
+        available.to_csv(out_path, index=False, encoding='utf-8')
+        stage.rows_out = len(available)
     logging.info(f"✅ Available shifts saved to: {out_path} ({len(available)} shifts)")
     logging.info(f"📊 Filtered shifts: PUBLISHED + future dates + external_visible=true")
     return True
@@ -296,7 +300,6 @@ def process_available_offers(offers_data, data_dir='data'):
     """Procesa las ofertas para dejar solo las disponibles y las guarda en available_offers.csv"""
     import pandas as pd
     from datetime import datetime, timezone
-    import pytz
     if offers_data is None or offers_data.empty:
         logging.warning("⚠️ No offers data to process.")
         return False
@@ -307,15 +310,17 @@ def process_available_offers(offers_data, data_dir='data'):
     try:
         # Guardar todas las columnas por ahora para analizar la estructura
         out_path = os.path.join(data_dir, 'available_offers.csv')
-        available.to_csv(out_path, index=False, encoding='utf-8')
+        with track_stage('process_offers', rows_in=len(offers_data)) as stage:
+            available.to_csv(out_path, index=False, encoding='utf-8')
+            stage.rows_out = len(available)
         logging.info(f"✅ Available offers saved to: {out_path} ({len(available)} offers)")
         return True
     except Exception as e:
         logging.error(f"❌ Error processing offers: {e}")
         return False
 
-def main():
-    """Main function to fetch data from Metabase and save to files"""
+def main(process=True):
+    """Main function to fetch data from Metabase and save to files (process=False only saves the raw files)"""
     try:
         # Create data directory if it doesn't exist
         data_dir = 'data'
@@ -325,14 +330,11 @@ def main():
         # Initialize data fetcher and connect to Metabase
         fetcher = MetabaseDataFetcher()
         
-        # Configuration - Change these question IDs according to your Metabase setup
-        FACILITY_QUESTION_ID = 4846  # Change this to your facility question ID
-        SHIFTS_QUESTION_ID = 4659    # Optional: for shifts data (if needed)
-        OFFERS_QUESTION_ID = 4925    # NEW: for offers data
-        
         # Fetch facility data from Metabase
         logger.info("🔄 Fetching facility data from Metabase...")
-        facility_data = fetcher.fetch_question_data(FACILITY_QUESTION_ID, "Facility Data")
+        with track_stage('fetch_facilities') as stage:
+            facility_data = fetcher.fetch_question_data(FACILITY_QUESTION_ID, "Facility Data")
+            stage.rows_out = 0 if facility_data is None else len(facility_data)
         
         if facility_data is None or facility_data.empty:
             logger.error("❌ No facility data fetched")
@@ -342,28 +344,41 @@ def main():
         if not fetcher.save_data_to_csv(facility_data, 'raw_facilities.csv', data_dir):
             logger.error("❌ Failed to save facility data")
             return False
+        # Share the fetched frames with later stages in this process instead of re-reading the CSVs
+        repository = get_repository(data_dir)
+        repository.put('raw_facilities', facility_data)
         
         # Optionally fetch shifts data
         logger.info("🔄 Fetching shifts data from Metabase...")
-        shifts_data = fetcher.fetch_question_data(SHIFTS_QUESTION_ID, "Shifts Data")
+        with track_stage('fetch_shifts') as stage:
+            shifts_data = fetcher.fetch_question_data(SHIFTS_QUESTION_ID, "Shifts Data")
+            stage.rows_out = 0 if shifts_data is None else len(shifts_data)
         
         if shifts_data is not None and not shifts_data.empty:
             if not fetcher.save_data_to_csv(shifts_data, 'raw_shifts.csv', data_dir):
                 logger.warning("⚠️ Failed to save shifts data")
+            else:
+                repository.put('raw_shifts', shifts_data)
             # Procesar y guardar shifts disponibles
-            process_available_shifts(shifts_data, data_dir)
+            if process:
+                process_available_shifts(shifts_data, data_dir)
         else:
             logger.warning("⚠️ No shifts data fetched")
         
         # NEW: Fetch offers data
         logger.info("🔄 Fetching offers data from Metabase...")
-        offers_data = fetcher.fetch_question_data(OFFERS_QUESTION_ID, "Offers Data")
+        with track_stage('fetch_offers') as stage:
+            offers_data = fetcher.fetch_question_data(OFFERS_QUESTION_ID, "Offers Data")
+            stage.rows_out = 0 if offers_data is None else len(offers_data)
         
         if offers_data is not None and not offers_data.empty:
             if not fetcher.save_data_to_csv(offers_data, 'raw_offers.csv', data_dir):
                 logger.warning("⚠️ Failed to save offers data")
+            else:
+                repository.put('raw_offers', offers_data)
             # Procesar y guardar ofertas disponibles
-            process_available_offers(offers_data, data_dir)
+            if process:
+                process_available_offers(offers_data, data_dir)
         else:
             logger.warning("⚠️ No offers data fetched")
         
@@ -389,6 +404,7 @@ if __name__ == "__main__":
     logger.info("=" * 50)
     
     success = main()
+    write_metrics()
     
     if success:
         logger.info("🎉 Data fetching completed successfully!")
@@ -0,0 +1,293 @@
+#!/usr/bin/env python3
+"""
+Demand Cube
+Dense NumPy aggregate of open shifts indexed by facility × category × specialization
+× day (Europe/Madrid calendar day of the shift start), holding shift counts and
+summed capacity, plus a facility × category matrix of offers. It is built in one
+bincount pass, grows in place when new shifts arrive, and keeps a cumulative sum
+over days so any date range is two lookups instead of a scan. The map stats, the
+/api/counts endpoint and the demand report all slice the same cube.
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from repository import factorize_facility_ids
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+CUBE_FILE = os.path.join(DATA_DIR, 'demand_cube.npz')
+LOCAL_TZ = 'Europe/Madrid'
+# Por debajo de esta fracción de celdas, np.add.at es más barato que un bincount del cubo entero
+ADD_AT_FRACTION = 0.125
+
+
+def _labels(series):
+    codes, labels = factorize_facility_ids(series)
+    return labels.to_numpy()[codes]
+
+
+def _day_numbers(values):
+    """Local calendar day of each timestamp as days since 1970-01-01 (NaT -> None mask)"""
+    times = pd.DatetimeIndex(pd.to_datetime(values, utc=True, errors='coerce', format='mixed'))
+    days = times.tz_convert(LOCAL_TZ).tz_localize(None).to_numpy(dtype='datetime64[D]').astype(np.int64)
+    return days, ~times.isna()
+
+
+def _day_number(value):
+    return int(pd.Timestamp(value).to_datetime64().astype('datetime64[D]').astype(np.int64))
+
+
+class DemandCube:
+    """Shift counts / capacity per facility, category, specialization and day"""
+
+    def __init__(self, facilities=(), categories=(), specializations=(), first_day=0,
+                 shifts=None, capacity=None, offers=None):
+        self.facilities = pd.Index(facilities, dtype=object)
+        self.categories = pd.Index(categories, dtype=object)
+        self.specializations = pd.Index(specializations, dtype=object)
+        self.first_day = int(first_day)
+        shape = (len(self.facilities), len(self.categories), len(self.specializations), 0)
+        self.shifts = shifts if shifts is not None else np.zeros(shape, dtype=np.int32)
+        self.capacity = capacity if capacity is not None else np.zeros(shape, dtype=np.int32)
+        self.offers = offers if offers is not None else np.zeros(shape[:2], dtype=np.int32)
+        self._cumulative = {}
+        self._lookup = {}
+
+    @classmethod
+    def from_frames(cls, shifts=None, offers=None):
+        cube = cls()
+        cube.add_shifts(shifts)
+        cube.add_offers(offers)
+        return cube
+
+    @property
+    def n_days(self):
+        return self.shifts.shape[3]
+
+    @property
+    def days(self):
+        """Calendar dates of the day axis"""
+        return pd.to_datetime(np.arange(self.first_day, self.first_day + self.n_days), unit='D')
+
+    def _extend(self, facilities=(), categories=(), specializations=(), days=None):
+        """Grow the axes with unseen labels / days, keeping the existing counts"""
+        grown = False
+        axes = []
+        for name, labels in (('facilities', facilities), ('categories', categories),
+                             ('specializations', specializations)):
+            index = getattr(self, name)
+            new = pd.Index(pd.unique(np.asarray(labels, dtype=object)), dtype=object).difference(index, sort=False)
+            if len(new):
+                setattr(self, name, index.append(new))
+                self._lookup.pop(name, None)
+                grown = True
+            axes.append(len(getattr(self, name)))
+        first_day, n_days = self.first_day, self.n_days
+        if days is not None and len(days):
+            lo = int(days.min()) if n_days == 0 else min(first_day, int(days.min()))
+            hi = int(days.max()) + 1 if n_days == 0 else max(first_day + n_days, int(days.max()) + 1)
+            if (lo, hi) != (first_day, first_day + n_days):
+                first_day, n_days, grown = lo, hi - lo, True
+        if not grown:
+            return
+        offset = self.first_day - first_day if self.n_days else 0
+        old_f, old_c, old_s, old_d = self.shifts.shape
+        for name in ('shifts', 'capacity'):
+            resized = np.zeros((axes[0], axes[1], axes[2], n_days), dtype=np.int32)
+            resized[:old_f, :old_c, :old_s, offset:offset + old_d] = getattr(self, name)
+            setattr(self, name, resized)
+        offers = np.zeros((axes[0], axes[1]), dtype=np.int32)
+        offers[:old_f, :old_c] = self.offers
+        self.offers = offers
+        self.first_day = first_day
+
+    def _accumulate(self, target, coords, weights=None):
+        flat = np.ravel_multi_index(coords, target.shape)
+        if len(flat) < ADD_AT_FRACTION * target.size:
+            np.add.at(target.reshape(-1), flat, 1 if weights is None else weights)
+        else:
+            target += np.bincount(flat, weights=weights, minlength=target.size).astype(np.int32).reshape(target.shape)
+
+    def add_shifts(self, shifts):
+        """Add shifts (facility_id, category, specialization, start_time_utc, capacity) to the cube"""
+        if shifts is None or shifts.empty:
+            return 0
+        days, valid = _day_numbers(shifts['start_time_utc'])
+        shifts, days = shifts[valid], days[valid]
+        facilities = _labels(shifts['facility_id'])
+        categories = shifts['category'].astype(str).to_numpy()
+        specializations = (shifts['specialization'].fillna('').astype(str).to_numpy() if 'specialization' in shifts
+                           else np.full(len(shifts), '', dtype=object))
+        self._extend(facilities, categories, specializations, days)
+        coords = (self.facilities.get_indexer(facilities), self.categories.get_indexer(categories),
+                  self.specializations.get_indexer(specializations), days - self.first_day)
+        self._accumulate(self.shifts, coords)
+        if 'capacity' in shifts:
+            capacity = pd.to_numeric(shifts['capacity'], errors='coerce').fillna(1).to_numpy().astype(np.int32)
+        else:
+            capacity = np.ones(len(shifts), dtype=np.int32)
+        self._accumulate(self.capacity, coords, capacity)
+        self._cumulative.clear()
+        return len(shifts)
+
+    def add_offers(self, offers):
+        """Add offers (facility_id, category) to the facility × category matrix"""
+        if offers is None or offers.empty:
+            return 0
+        facilities = _labels(offers['facility_id'])
+        categories = (offers['category'].astype(str).to_numpy() if 'category' in offers
+                      else np.full(len(offers), '', dtype=object))
+        self._extend(facilities, categories)
+        np.add.at(self.offers, (self.facilities.get_indexer(facilities), self.categories.get_indexer(categories)), 1)
+        return len(offers)
+
+    def _day_range(self, start=None, end=None):
+        """[lo, hi) positions on the day axis for the inclusive dates start..end"""
+        lo = 0 if start is None else _day_number(start) - self.first_day
+        hi = self.n_days if end is None else _day_number(end) - self.first_day + 1
+        lo, hi = min(max(lo, 0), self.n_days), min(max(hi, 0), self.n_days)
+        return lo, max(lo, hi)
+
+    def _range_sum(self, measure, start=None, end=None, facility=slice(None)):
+        """facility × category × specialization totals over a date range from the cumulative day sums"""
+        lo, hi = self._day_range(start, end)
+        cumulative = self._cumulative.get(measure)
+        if cumulative is None and lo == 0 and hi == self.n_days:
+            # Todos los días: suma directa, sin materializar las sumas acumuladas (int64, tamaño del cubo)
+            return getattr(self, measure)[facility].sum(axis=-1, dtype=np.int64)
+        if cumulative is None:
+            # El día va primero para que cada extremo del rango sea un bloque contiguo
+            values = np.moveaxis(getattr(self, measure), 3, 0)
+            cumulative = np.zeros((values.shape[0] + 1,) + values.shape[1:], dtype=np.int64)
+            np.cumsum(values, axis=0, out=cumulative[1:])
+            self._cumulative[measure] = cumulative
+        return cumulative[hi, facility] - cumulative[lo, facility]
+
+    def _position(self, axis, label):
+        """Position of a label on an axis ('facilities', 'categories', 'specializations'), -1 when absent"""
+        lookup = self._lookup.get(axis)
+        if lookup is None:
+            lookup = self._lookup[axis] = {value: i for i, value in enumerate(getattr(self, axis))}
+        return lookup.get(label, -1)
+
+    def _select(self, axis, label):
+        if label is None:
+            return slice(None)
+        position = self._position(axis, label)
+        return [position] if position >= 0 else []
+
+    def totals(self, category=None, specialization=None, start=None, end=None, measure='shifts'):
+        """Per-facility totals (aligned with self.facilities) for any category / specialization / date slice"""
+        values = self._range_sum(measure, start, end)
+        values = values[:, self._select('categories', category)][:, :, self._select('specializations', specialization)]
+        return values.sum(axis=(1, 2))
+
+    def value(self, facility, category=None, specialization=None, start=None, end=None, measure='shifts'):
+        """Total for a single facility"""
+        position = self._position('facilities', facility)
+        if position < 0:
+            return 0
+        values = self._range_sum(measure, start, end, position)
+        return int(values[self._select('categories', category)][:, self._select('specializations', specialization)].sum())
+
+    def offer_totals(self, category=None):
+        return self.offers[:, self._select('categories', category)].sum(axis=1)
+
+    def facility_positions(self, facility_ids):
+        """Cube row of each facility id (-1 when it has no shifts or offers)"""
+        return self.facilities.get_indexer(pd.Index(facility_ids, dtype=object))
+
+    def facility_stats(self, start=None, end=None):
+        """Per facility_id total / ENF / TCAE shifts and offers, the same frame as engine.facility_stats"""
+        stats = pd.DataFrame({
+            'total': self.totals(start=start, end=end),
+            'enf': self.totals('ENF', start=start, end=end),
+            'tcae': self.totals('TCAE', start=start, end=end),
+            'offers': self.offer_totals(),
+        }, index=pd.Index(self.facilities, name='facility_id'), dtype=np.int64)
+        return stats[stats.any(axis=1)].sort_index()
+
+    def report(self, by='day', category=None, specialization=None, start=None, end=None, measure='shifts'):
+        """Totals grouped by one axis (facility, category, specialization or day) for a slice"""
+        lo, hi = self._day_range(start, end)
+        values = getattr(self, measure)[:, self._select('categories', category)]
+        values = values[:, :, self._select('specializations', specialization), lo:hi]
+        if by == 'day':
+            return pd.Series(values.sum(axis=(0, 1, 2)), index=self.days[lo:hi], name=measure)
+        axis = {'facility': 0, 'category': 1, 'specialization': 2}[by]
+        labels = {'facility': self.facilities, 'category': self.categories, 'specialization': self.specializations}[by]
+        if by == 'category' and category is not None:
+            labels = labels[self._select('categories', category)]
+        if by == 'specialization' and specialization is not None:
+            labels = labels[self._select('specializations', specialization)]
+        other = tuple(a for a in range(4) if a != axis)
+        return pd.Series(values.sum(axis=other), index=labels, name=measure)
+
+    def save(self, path=CUBE_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez_compressed(tmp_path, shifts=self.shifts, capacity=self.capacity, offers=self.offers,
+                            facilities=self.facilities.to_numpy(dtype=str),
+                            categories=self.categories.to_numpy(dtype=str),
+                            specializations=self.specializations.to_numpy(dtype=str), first_day=self.first_day)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path=CUBE_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            return cls(data['facilities'].astype(object), data['categories'].astype(object),
+                       data['specializations'].astype(object), int(data['first_day']),
+                       data['shifts'], data['capacity'], data['offers'])
+
+
+def build_cube(data_dir=DATA_DIR, path=None):
+    """Build the cube from available_shifts.csv / available_offers.csv and save it"""
+    from repository import get_repository
+    repository = get_repository(data_dir)
+    offers = repository.get('offers')
+    if offers is not None and 'status' in offers.columns:
+        offers = offers[offers['status'] == 'PUBLISHED']
+    cube = DemandCube.from_frames(repository.get('shifts'), offers)
+    cube.save(path or os.path.join(data_dir, 'demand_cube.npz'))
+    logger.info(f"🧊 Demand cube: {len(cube.facilities)} facilities × {len(cube.categories)} categories × "
+                f"{len(cube.specializations)} specializations × {cube.n_days} days "
+                f"({cube.shifts.nbytes / 1e6:.1f} MB)")
+    return cube
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shift demand by facility, category, specialization or day")
+    parser.add_argument('--by', choices=['day', 'facility', 'category', 'specialization'], default='day')
+    parser.add_argument('--category', help="ENF or TCAE")
+    parser.add_argument('--specialization', help="Specialization code (e.g. EMERGENCY)")
+    parser.add_argument('--from', dest='start', help="First day (inclusive, YYYY-MM-DD)")
+    parser.add_argument('--to', dest='end', help="Last day (inclusive, YYYY-MM-DD)")
+    parser.add_argument('--measure', choices=['shifts', 'capacity'], default='shifts')
+    parser.add_argument('--rebuild', action='store_true', help="Rebuild data/demand_cube.npz from the CSV files")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    path = os.path.join(args.data_dir, 'demand_cube.npz')
+    cube = DemandCube.load(path) if os.path.exists(path) and not args.rebuild else build_cube(args.data_dir, path)
+    report = cube.report(args.by, args.category, args.specialization, args.start, args.end, args.measure)
+    report = report[report > 0]
+    if args.by != 'day':
+        report = report.sort_values(ascending=False)
+    for label, value in report.items():
+        label = label.strftime('%Y-%m-%d') if args.by == 'day' else label
+        print(f"{str(label):>20}  {int(value):>7}")
+    logger.info(f"📊 {int(report.sum())} {args.measure} in {len(report)} {args.by} rows")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,202 @@
+#!/usr/bin/env python3
+"""
+Concurrent Demand Timelines
+Step functions of open shift slots (capacity) per facility and category, built
+with a vectorized sweep-line: every shift becomes a +capacity event at its start
+and a -capacity event at its finish, all events are sorted once by (facility,
+category, time) with ends before starts at the same minute, and a single cumulative
+sum gives the open slots after each event (each group's events sum to zero, so the
+running total restarts at every group). Peaks come from reduceat over the group
+boundaries and hourly profiles from expanding each constant segment over the hours
+it touches. Everything is O(n log n) in the number of shifts.
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from repository import factorize_facility_ids
+from shift_intervals import to_epoch_minutes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+LOCAL_TZ = 'Europe/Madrid'
+MINUTES_PER_HOUR = 60
+
+
+def _minutes_to_utc(minutes):
+    return pd.to_datetime(np.asarray(minutes, dtype=np.int64) * 60, unit='s', utc=True)
+
+
+class DemandTimeline:
+    """Open-slot step function per (facility, category) from one sorted event array"""
+
+    def __init__(self, shifts):
+        if shifts is None or shifts.empty:
+            shifts = pd.DataFrame(columns=['facility_id', 'category', 'start_time_utc', 'finish_time_utc', 'capacity'])
+        start = to_epoch_minutes(shifts['start_time_utc'])
+        finish = to_epoch_minutes(shifts['finish_time_utc'])
+        # Turnos sin hora de fin (o de duración cero) no ocupan ningún intervalo
+        valid = (start >= 0) & (finish > start)
+        dropped = int((~valid).sum())
+        if dropped:
+            logger.info(f"ℹ️ {dropped} shifts without a valid start/finish interval ignored")
+        shifts = shifts[valid]
+        start, finish = start[valid], finish[valid]
+        capacity = (pd.to_numeric(shifts['capacity'], errors='coerce').fillna(1).to_numpy(dtype=np.int64)
+                    if 'capacity' in shifts else np.ones(len(shifts), dtype=np.int64))
+
+        fac_codes, self.facilities = factorize_facility_ids(shifts['facility_id'])
+        cat_codes, categories = pd.factorize(shifts['category'].astype(str).to_numpy())
+        self.categories = pd.Index(categories, dtype=object)
+        groups = fac_codes.astype(np.int64) * max(len(self.categories), 1) + cat_codes
+        self.n_shifts = len(shifts)
+        self.shift_groups = groups
+        self.capacity_minutes = capacity * (finish - start)
+        self.shift_capacity = capacity
+
+        # Eventos: +capacity al inicio, -capacity al fin; a igual minuto los fines van primero
+        event_groups = np.concatenate([groups, groups])
+        event_times = np.concatenate([start, finish])
+        deltas = np.concatenate([capacity, -capacity])
+        order = np.lexsort((deltas, event_times, event_groups))
+        self.event_groups = event_groups[order]
+        self.event_times = event_times[order]
+        self.levels = np.cumsum(deltas[order])
+
+        self.group_starts = np.flatnonzero(np.r_[True, np.diff(self.event_groups) != 0]) if len(order) else np.empty(0, dtype=np.int64)
+        self.group_ids = self.event_groups[self.group_starts]
+
+    def __len__(self):
+        return self.n_shifts
+
+    def _group_labels(self, group_ids):
+        n_cat = max(len(self.categories), 1)
+        return self.facilities[group_ids // n_cat], self.categories[group_ids % n_cat]
+
+    def _group_code(self, facility_id, category):
+        fac = self.facilities.get_indexer([str(facility_id)])[0]
+        cat = self.categories.get_indexer([str(category)])[0]
+        return -1 if fac < 0 or cat < 0 else fac * max(len(self.categories), 1) + cat
+
+    def _segments(self):
+        """(group, start, end, level) of every segment with open slots; level is constant on [start, end)"""
+        if len(self.levels) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty, empty
+        same_group = np.r_[self.event_groups[1:] == self.event_groups[:-1], False]
+        ends = np.r_[self.event_times[1:], self.event_times[-1]]
+        keep = same_group & (self.levels > 0) & (ends > self.event_times)
+        return self.event_groups[keep], self.event_times[keep], ends[keep], self.levels[keep]
+
+    def peaks(self):
+        """Per facility and category: peak open slots, when it starts and ends, shifts and slot-hours"""
+        columns = ['facility_id', 'category', 'peak_open_slots', 'peak_start_utc', 'peak_end_utc', 'shifts', 'slot_hours']
+        if len(self.levels) == 0:
+            return pd.DataFrame(columns=columns)
+        peak = np.maximum.reduceat(self.levels, self.group_starts)
+        # Primer evento de cada grupo que alcanza su pico; el pico dura hasta el siguiente evento
+        is_peak = self.levels == np.repeat(peak, np.diff(np.r_[self.group_starts, len(self.levels)]))
+        first_peak = np.minimum.reduceat(np.where(is_peak, np.arange(len(self.levels)), len(self.levels)), self.group_starts)
+        per_group = pd.DataFrame({'group': self.shift_groups, 'minutes': self.capacity_minutes})
+        per_group = per_group.groupby('group')['minutes'].agg(['size', 'sum']).reindex(self.group_ids)
+        facility, category = self._group_labels(self.group_ids)
+        return pd.DataFrame({
+            'facility_id': facility,
+            'category': category,
+            'peak_open_slots': peak,
+            'peak_start_utc': _minutes_to_utc(self.event_times[first_peak]),
+            'peak_end_utc': _minutes_to_utc(self.event_times[first_peak + 1]),
+            'shifts': per_group['size'].to_numpy(),
+            'slot_hours': np.round(per_group['sum'].to_numpy() / MINUTES_PER_HOUR, 2),
+        }, columns=columns).sort_values(['peak_open_slots', 'slot_hours'], ascending=False, ignore_index=True)
+
+    def step_function(self, facility_id, category):
+        """Open slots from each change point on (time_utc, open_slots) for one facility and category"""
+        code = self._group_code(facility_id, category)
+        position = np.searchsorted(self.group_ids, code)
+        if code < 0 or position >= len(self.group_ids) or self.group_ids[position] != code:
+            return pd.DataFrame(columns=['time_utc', 'open_slots'])
+        lo = self.group_starts[position]
+        hi = self.group_starts[position + 1] if position + 1 < len(self.group_starts) else len(self.levels)
+        times, levels = self.event_times[lo:hi], self.levels[lo:hi]
+        # Varios eventos en el mismo minuto: cuenta el nivel tras el último
+        last = np.r_[times[1:] != times[:-1], True]
+        return pd.DataFrame({'time_utc': _minutes_to_utc(times[last]), 'open_slots': levels[last]})
+
+    def hourly_profile(self):
+        """Peak open slots in every hour (UTC hour start) with demand, per facility and category"""
+        groups, starts, ends, levels = self._segments()
+        first_hour = starts // MINUTES_PER_HOUR
+        counts = (ends - 1) // MINUTES_PER_HOUR - first_hour + 1
+        # Expandir cada segmento a las horas que toca (sin bucles en Python)
+        total = int(counts.sum())
+        owner = np.repeat(np.arange(len(counts)), counts)
+        offsets = np.arange(total) - np.repeat(np.cumsum(counts) - counts, counts)
+        hours = first_hour[owner] + offsets
+        hour_groups, hour_levels = groups[owner], levels[owner]
+        if total == 0:
+            return pd.DataFrame(columns=['facility_id', 'category', 'hour_utc', 'peak_open_slots'])
+        # Los segmentos ya están ordenados por (grupo, tiempo): las horas quedan ordenadas dentro de cada grupo
+        boundaries = np.flatnonzero(np.r_[True, (np.diff(hour_groups) != 0) | (np.diff(hours) != 0)])
+        facility, category = self._group_labels(hour_groups[boundaries])
+        return pd.DataFrame({
+            'facility_id': facility,
+            'category': category,
+            'hour_utc': _minutes_to_utc(hours[boundaries] * MINUTES_PER_HOUR),
+            'peak_open_slots': np.maximum.reduceat(hour_levels, boundaries),
+        })
+
+    def hour_of_day_profile(self, statistic='max'):
+        """Facility × category rows with 24 local-hour columns (max or mean peak open slots over the days)"""
+        hourly = self.hourly_profile()
+        if hourly.empty:
+            return pd.DataFrame(columns=['facility_id', 'category'] + list(range(24)))
+        hourly['hour'] = hourly['hour_utc'].dt.tz_convert(LOCAL_TZ).dt.hour
+        profile = hourly.pivot_table(index=['facility_id', 'category'], columns='hour',
+                                     values='peak_open_slots', aggfunc=statistic, fill_value=0)
+        return profile.reindex(columns=range(24), fill_value=0).reset_index()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Concurrent open shift slots per facility and category")
+    parser.add_argument('--facility', help="Print the step function of one facility_id")
+    parser.add_argument('--category', default='ENF', help="Category for --facility (default ENF)")
+    parser.add_argument('--top', type=int, default=10, help="Peaks to print")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    from repository import get_repository
+    shifts = get_repository(args.data_dir).get('shifts')
+    if shifts is None:
+        logger.error(f"❌ No available shifts found in {args.data_dir}")
+        return False
+    timeline = DemandTimeline(shifts)
+
+    if args.facility:
+        steps = timeline.step_function(args.facility, args.category)
+        for row in steps.itertuples(index=False):
+            print(f"{row.time_utc.tz_convert(LOCAL_TZ):%Y-%m-%d %H:%M}  {row.open_slots:>4}")
+        logger.info(f"📈 {len(steps)} change points for facility {args.facility} ({args.category})")
+        return True
+
+    peaks = timeline.peaks()
+    peaks_file = os.path.join(args.data_dir, 'demand_peaks.csv')
+    hourly_file = os.path.join(args.data_dir, 'demand_hour_of_day.csv')
+    peaks.to_csv(peaks_file, index=False, encoding='utf-8')
+    timeline.hour_of_day_profile().to_csv(hourly_file, index=False, encoding='utf-8')
+    for row in peaks.head(args.top).itertuples(index=False):
+        print(f"{row.facility_id:>8} {row.category:<5} peak {row.peak_open_slots:>4} open slots at "
+              f"{row.peak_start_utc.tz_convert(LOCAL_TZ):%Y-%m-%d %H:%M}  ({row.shifts} shifts, {row.slot_hours:.0f} slot-hours)")
+    logger.info(f"✅ Peaks saved to {peaks_file}, hour-of-day profiles to {hourly_file}")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
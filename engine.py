@@ -0,0 +1,175 @@
+"""
+Dataframe Engines
+Backends for the filter / join / group-by work of the processing layer. The pandas
+engine is always available; the Polars engine runs the same operations as
+multi-threaded lazy queries when polars (and pyarrow) are installed. Both take and
+return pandas DataFrames so callers do not depend on the backend.
+
+The engine is chosen with get_engine(name), the FACILITY_MAP_ENGINE environment
+variable or `cli.py --engine`.
+"""
+
+import importlib.util
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_ENGINE = 'pandas'
+STAT_COLUMNS = ['total', 'enf', 'tcae', 'offers']
+
+
+def _empty_stats():
+    return pd.DataFrame({col: pd.Series(dtype='int64') for col in STAT_COLUMNS},
+                        index=pd.Index([], name='facility_id'))
+
+
+class PandasEngine:
+    """Reference implementation on pandas"""
+
+    name = 'pandas'
+
+    def filter_available_shifts(self, shifts, now_utc, columns):
+        """PUBLISHED, external_visible and future shifts with the given columns (start_time_utc parsed to UTC)"""
+        shifts = shifts.copy()
+        shifts['start_time_utc'] = pd.to_datetime(shifts['start_time_utc'], utc=True, errors='coerce')
+        available = shifts[
+            (shifts['status'] == 'PUBLISHED') &
+            (shifts['start_time_utc'] > now_utc) &
+            (shifts['external_visible'] == True)
+        ]
+        return available[columns]
+
+    def apply_coordinate_corrections(self, facility, keys, corrections):
+        """
+        Overwrite latitude/longitude where keys (one correction name per row, None for no match)
+        is found in corrections, a frame indexed by nombre_original.
+        """
+        facility = facility.copy()
+        matched = keys.notna() & keys.isin(corrections.index)
+        for target, source in (('latitude', 'latitud_corregida'), ('longitude', 'longitud_corregida')):
+            values = keys[matched].map(corrections[source])
+            if target not in facility.columns:
+                facility[target] = None
+            facility.loc[matched, target] = values
+        return facility
+
+    def facility_stats(self, shifts, offers):
+        """Per facility_id counts of shifts (total, ENF, TCAE) and offers"""
+        parts = []
+        if shifts is not None and not shifts.empty:
+            by_facility = shifts['facility_id']
+            parts.append(pd.DataFrame({
+                'total': shifts.groupby(by_facility, sort=False).size(),
+                'enf': (shifts['category'] == 'ENF').groupby(by_facility, sort=False).sum(),
+                'tcae': (shifts['category'] == 'TCAE').groupby(by_facility, sort=False).sum(),
+            }))
+        if offers is not None and not offers.empty:
+            parts.append(offers.groupby('facility_id', sort=False).size().rename('offers').to_frame())
+        if not parts:
+            return _empty_stats()
+        stats = pd.concat(parts, axis=1).reindex(columns=STAT_COLUMNS).fillna(0).astype('int64')
+        stats.index.name = 'facility_id'
+        return stats.sort_index()
+
+
+class PolarsEngine:
+    """Same operations as lazy Polars queries (multi-threaded)"""
+
+    name = 'polars'
+
+    def __init__(self):
+        import polars as pl
+        self.pl = pl
+
+    def filter_available_shifts(self, shifts, now_utc, columns):
+        pl = self.pl
+        shifts = shifts.copy()
+        # El parseo de fechas se hace con pandas para aceptar exactamente los mismos formatos
+        shifts['start_time_utc'] = pd.to_datetime(shifts['start_time_utc'], utc=True, errors='coerce')
+        return (
+            pl.from_pandas(shifts).lazy()
+            .filter(
+                (pl.col('status') == 'PUBLISHED') &
+                (pl.col('start_time_utc') > now_utc.to_pydatetime()) &
+                (pl.col('external_visible') == True)
+            )
+            .select(columns)
+            .collect()
+            .to_pandas()
+        )
+
+    def apply_coordinate_corrections(self, facility, keys, corrections):
+        pl = self.pl
+        lookup = pl.from_pandas(
+            corrections[['latitud_corregida', 'longitud_corregida']].rename_axis('_key').reset_index()
+        )
+        joined = (
+            pl.DataFrame({'_key': pl.Series(keys.where(keys.notna(), None).tolist(), dtype=pl.Utf8)}).lazy()
+            .with_row_index('_row')
+            .join(lookup.lazy(), on='_key', how='left')
+            .sort('_row')
+            .collect()
+        )
+        facility = facility.copy()
+        matched = joined['_key'].is_in(lookup['_key']).fill_null(False).to_numpy()
+        for target, source in (('latitude', 'latitud_corregida'), ('longitude', 'longitud_corregida')):
+            if target not in facility.columns:
+                facility[target] = None
+            facility.loc[matched, target] = joined[source].to_numpy()[matched]
+        return facility
+
+    def facility_stats(self, shifts, offers):
+        pl = self.pl
+        frames = []
+        if shifts is not None and not shifts.empty:
+            frames.append(
+                pl.from_pandas(shifts[['facility_id', 'category']].astype({'category': str})).lazy()
+                .group_by('facility_id')
+                .agg(
+                    pl.len().alias('total'),
+                    (pl.col('category') == 'ENF').sum().alias('enf'),
+                    (pl.col('category') == 'TCAE').sum().alias('tcae'),
+                )
+            )
+        if offers is not None and not offers.empty:
+            frames.append(
+                pl.from_pandas(offers[['facility_id']]).lazy()
+                .group_by('facility_id')
+                .agg(pl.len().alias('offers'))
+            )
+        if not frames:
+            return _empty_stats()
+        query = frames[0]
+        for other in frames[1:]:
+            query = query.join(other, on='facility_id', how='full', coalesce=True)
+        result = query.collect().to_pandas().set_index('facility_id')
+        result = result.reindex(columns=STAT_COLUMNS).fillna(0).astype('int64')
+        return result.sort_index()
+
+
+ENGINES = {
+    'pandas': PandasEngine,
+    'polars': PolarsEngine,
+}
+
+
+def available_engines():
+    """Engine names whose dependencies are installed"""
+    names = ['pandas']
+    if importlib.util.find_spec('polars') is not None and importlib.util.find_spec('pyarrow') is not None:
+        names.append('polars')
+    return names
+
+
+def get_engine(name=None):
+    """Return an engine instance (falls back to pandas when the requested backend is not installed)"""
+    name = (name or os.getenv('FACILITY_MAP_ENGINE') or DEFAULT_ENGINE).lower()
+    if name not in ENGINES:
+        raise ValueError(f"Unknown engine '{name}' (choose from: {', '.join(ENGINES)})")
+    if name not in available_engines():
+        logger.warning(f"⚠️ Engine '{name}' not available (pip install polars pyarrow), using pandas")
+        name = 'pandas'
+    return ENGINES[name]()
@@ -0,0 +1,143 @@
+#!/usr/bin/env python3
+"""
+Shift Expiry
+available_shifts.csv only keeps the shifts that had not started when it was
+fetched, but between fetches they keep starting. The expiry pass finds the shifts
+started since its previous pass (a binary search when the file is sorted by start,
+a mask otherwise) and, without a Metabase round trip or rewriting the file,
+publishes a change feed patch that removes them for open pages and re-renders the
+shard maps that hold them. Map builds and the local server leave out started
+shifts by themselves; the next fetch replaces the file.
+"""
+
+import argparse
+import json
+import logging
+import os
+import time
+from datetime import datetime, timezone
+
+import numpy as np
+import pandas as pd
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+PUBLIC_DIR = 'public'
+STATE_FILE = 'expiry_state.json'
+
+
+def _utc_timestamp(value):
+    timestamp = pd.Timestamp(datetime.now(timezone.utc) if value is None else value)
+    return timestamp.tz_localize('UTC') if timestamp.tzinfo is None else timestamp
+
+
+def _start_times(shifts):
+    starts = shifts['start_time_utc']
+    if not isinstance(starts.dtype, pd.DatetimeTZDtype):
+        starts = pd.to_datetime(starts, utc=True, errors='coerce', format='mixed')
+    return starts
+
+
+def started_positions(shifts, now=None, since=None):
+    """Positions of the shifts with since < start <= now (full precision, as in process_available_shifts)"""
+    if shifts is None or shifts.empty:
+        return np.array([], dtype=np.int64)
+    starts = _start_times(shifts)
+    now = _utc_timestamp(now)
+    since = None if since is None else _utc_timestamp(since)
+    if starts.is_monotonic_increasing:
+        # Ordenado por inicio (sin NaT): los empezados son un tramo contiguo
+        first = 0 if since is None else starts.searchsorted(since, side='right')
+        return np.arange(first, max(first, starts.searchsorted(now, side='right')))
+    started = starts <= now
+    if since is not None:
+        started &= starts > since
+    return np.flatnonzero(started.to_numpy())
+
+
+def drop_started_shifts(shifts, now=None):
+    """(shifts that have not started, shifts that have), in any row order"""
+    if shifts is None or shifts.empty:
+        return shifts, shifts
+    started = np.zeros(len(shifts), dtype=bool)
+    started[started_positions(shifts, now)] = True
+    return shifts[~started], shifts[started]
+
+
+def _load_state(path):
+    try:
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def _save_state(path, state):
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        json.dump(state, f)
+    os.replace(f'{path}.tmp', path)
+
+
+def refresh_started_shards(facility_ids, data_dir=DATA_DIR, public_dir=PUBLIC_DIR, now=None, workers=None):
+    """Re-render the shard maps holding facility_ids without the shifts started as of now"""
+    from map import load_facilities_and_shifts
+    from shards import refresh_shards
+    shards_dir = os.path.join(public_dir, 'shards')
+    if not facility_ids or not os.path.isdir(shards_dir):
+        return []
+    facilities_df, shifts_df, offers_df = load_facilities_and_shifts(data_dir)
+    if facilities_df is None:
+        return []
+    shifts_df, _ = drop_started_shifts(shifts_df, now)
+    return refresh_shards(facilities_df, shifts_df, offers_df, facility_ids, shards_dir, workers)
+
+
+def expire_started_shifts(data_dir=DATA_DIR, public_dir=PUBLIC_DIR, now=None, repository=None):
+    """Remove the shifts started since the last pass from the change feed and the shard maps;
+    returns how many left the feed (None without the file)"""
+    from change_feed import expire_shifts
+    from repository import get_repository
+    repository = repository or get_repository(data_dir)
+    shifts = repository.get('shifts')
+    if shifts is None:
+        return None
+    now = _utc_timestamp(now)
+    # Solo los empezados desde la pasada anterior sobre el mismo archivo (una descarga nueva vuelve a empezar)
+    state_path = os.path.join(data_dir, STATE_FILE)
+    state = _load_state(state_path)
+    signature = list(repository._signature(repository.path_for('shifts')))
+    since = state.get('expired_up_to') if state.get('shifts') == signature else None
+    if since is not None and _utc_timestamp(since) >= now:
+        return 0
+    started = shifts.iloc[started_positions(shifts, now, since)]
+    expired = expire_shifts(started, public_dir, data_dir)
+    if not started.empty:
+        refresh_started_shards(set(started['facility_id'].astype(str)), data_dir, public_dir, now)
+    _save_state(state_path, {'shifts': signature, 'expired_up_to': now.isoformat()})
+    if expired:
+        logger.info(f"⌛ {expired} started shifts removed from the map ({len(started)} started since the last pass)")
+    return expired
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Remove shifts that have already started from the open maps without a rebuild")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    parser.add_argument('--now', help="Expire as of this UTC time instead of now (e.g. 2025-08-01T08:00)")
+    args = parser.parse_args(argv)
+
+    started = time.perf_counter()
+    expired = expire_started_shifts(args.data_dir, args.public_dir, args.now)
+    if expired is None:
+        logger.error(f"❌ No available_shifts.csv found in {args.data_dir}")
+        return False
+    if not expired:
+        logger.info(f"✅ No started shifts to expire ({time.perf_counter() - started:.3f}s)")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,202 @@
+"""
+Facility Master Store
+SQLite-backed store of corrected facility coordinates, indexed by facility_id and
+normalized name. Upserts are transactional, only touch rows that changed and
+respect source precedence (manual > provider > city centroid).
+"""
+
+import hashlib
+import logging
+import os
+import sqlite3
+from datetime import datetime, timezone
+
+import pandas as pd
+
+from fingerprints import facility_key
+from name_matching import normalize_facility_name
+
+logger = logging.getLogger(__name__)
+
+# Columnas del archivo de correcciones, en el orden de all_corrected_facilities.csv
+CORRECTION_COLUMNS = [
+    'Nombre_Original', 'Nombre_Correcto', 'Ciudad', 'Tipo', 'Direccion',
+    'Latitud_Corregida', 'Longitud_Corregida', 'Fuente_Problema',
+]
+
+# Mayor rango = mayor prioridad
+SOURCE_RANKS = {
+    'manual': 3,
+    'provider': 2,
+    'city_centroid': 1,
+}
+
+
+def classify_source(fuente_problema):
+    """Infer the correction source from the Fuente_Problema text written by the checker"""
+    text = '' if fuente_problema is None or pd.isna(fuente_problema) else str(fuente_problema)
+    if text.startswith('Geocoded via city lookup'):
+        return 'city_centroid'
+    if text.startswith('Geocoded via'):
+        return 'provider'
+    return 'manual'
+
+
+def _clean(value):
+    """Convert pandas missing values to None so SQLite stores NULL"""
+    if value is None:
+        return None
+    try:
+        if pd.isna(value):
+            return None
+    except (TypeError, ValueError):
+        pass
+    return value
+
+
+class FacilityStore:
+    """Transactional facility master table with precedence-aware upserts"""
+
+    def __init__(self, path=os.path.join('data', 'facility_master.db')):
+        self.path = path
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        self.conn = sqlite3.connect(path)
+        self.conn.row_factory = sqlite3.Row
+        self._create_schema()
+
+    def _create_schema(self):
+        columns = ',\n'.join(f'    "{c}" {"REAL" if c.startswith(("Latitud", "Longitud")) else "TEXT"}'
+                             for c in CORRECTION_COLUMNS)
+        with self.conn:
+            self.conn.execute(f'''
+CREATE TABLE IF NOT EXISTS facilities (
+    normalized_name TEXT PRIMARY KEY,
+    facility_id TEXT,
+{columns},
+    source TEXT NOT NULL,
+    source_rank INTEGER NOT NULL,
+    row_hash TEXT NOT NULL,
+    updated_at TEXT NOT NULL
+)''')
+            self.conn.execute('CREATE INDEX IF NOT EXISTS idx_facilities_facility_id ON facilities(facility_id)')
+
+    def close(self):
+        self.conn.close()
+
+    def __len__(self):
+        return self.conn.execute('SELECT COUNT(*) FROM facilities').fetchone()[0]
+
+    @staticmethod
+    def _row_hash(values):
+        payload = '|'.join('' if v is None else str(v) for v in values)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+    def upsert_many(self, records, source=None):
+        """
+        Insert or update correction rows in a single transaction.
+        source forces a precedence class; otherwise it is inferred per row from Fuente_Problema.
+        Returns counts of inserted, updated, unchanged and lower-precedence (skipped) rows.
+        """
+        counts = {'inserted': 0, 'updated': 0, 'unchanged': 0, 'skipped': 0}
+        if records is None or len(records) == 0:
+            return counts
+
+        df = records.copy()
+        df.columns = [str(c).strip() for c in df.columns]
+        for col in CORRECTION_COLUMNS + ['facility_id']:
+            if col not in df.columns:
+                df[col] = None
+
+        now = datetime.now(timezone.utc).isoformat()
+        placeholders = ', '.join('?' * (len(CORRECTION_COLUMNS) + 6))
+        quoted = ', '.join(f'"{c}"' for c in CORRECTION_COLUMNS)
+
+        with self.conn:
+            for record in df[CORRECTION_COLUMNS + ['facility_id']].itertuples(index=False, name=None):
+                values = [_clean(v) for v in record[:-1]]
+                normalized = normalize_facility_name(values[0])
+                if not normalized:
+                    continue
+                fac_id = facility_key(_clean(record[-1])) or None
+                row_source = source or classify_source(values[CORRECTION_COLUMNS.index('Fuente_Problema')])
+                rank = SOURCE_RANKS[row_source]
+                row_hash = self._row_hash([fac_id] + values)
+
+                existing = self.conn.execute(
+                    'SELECT normalized_name, source_rank, row_hash FROM facilities WHERE normalized_name = ?',
+                    (normalized,)
+                ).fetchone()
+                if existing is None and fac_id is not None:
+                    existing = self.conn.execute(
+                        'SELECT normalized_name, source_rank, row_hash FROM facilities WHERE facility_id = ?',
+                        (fac_id,)
+                    ).fetchone()
+
+                if existing is not None:
+                    if existing['source_rank'] > rank:
+                        counts['skipped'] += 1
+                        continue
+                    if existing['row_hash'] == row_hash and existing['normalized_name'] == normalized:
+                        counts['unchanged'] += 1
+                        continue
+                    self.conn.execute('DELETE FROM facilities WHERE normalized_name = ?',
+                                      (existing['normalized_name'],))
+                    counts['updated'] += 1
+                else:
+                    counts['inserted'] += 1
+
+                self.conn.execute(
+                    f'INSERT INTO facilities (normalized_name, facility_id, {quoted}, source, source_rank, row_hash, updated_at) '
+                    f'VALUES ({placeholders})',
+                    [normalized, fac_id] + values + [row_source, rank, row_hash, now]
+                )
+
+        logger.info(f"💾 Facility store upsert: {counts['inserted']} inserted, {counts['updated']} updated, "
+                    f"{counts['unchanged']} unchanged, {counts['skipped']} kept higher-precedence")
+        return counts
+
+    def prune_manual(self, names):
+        """Delete manual rows whose name is no longer among the given correction names; returns the count"""
+        keep = {normalize_facility_name(name) for name in names}
+        stale = [row['normalized_name'] for row in self.conn.execute(
+            'SELECT normalized_name FROM facilities WHERE source = ?', ('manual',)
+        ) if row['normalized_name'] not in keep]
+        with self.conn:
+            self.conn.executemany('DELETE FROM facilities WHERE normalized_name = ?',
+                                  [(name,) for name in stale])
+        if stale:
+            logger.info(f"🗑️ Facility store: {len(stale)} manual corrections removed from the corrections file")
+        return len(stale)
+
+    def get_by_id(self, facility_id):
+        """Return the stored row for a facility id as a dict, or None"""
+        row = self.conn.execute('SELECT * FROM facilities WHERE facility_id = ?',
+                                (facility_key(facility_id),)).fetchone()
+        return dict(row) if row else None
+
+    def get_by_name(self, name):
+        """Return the stored row for a facility name (normalized match) as a dict, or None"""
+        row = self.conn.execute('SELECT * FROM facilities WHERE normalized_name = ?',
+                                (normalize_facility_name(name),)).fetchone()
+        return dict(row) if row else None
+
+    def to_dataframe(self):
+        """Return all rows with the same columns as all_corrected_facilities.csv"""
+        quoted = ', '.join(f'"{c}"' for c in CORRECTION_COLUMNS)
+        df = pd.read_sql_query(
+            f'SELECT {quoted}, facility_id, source FROM facilities ORDER BY source_rank DESC, rowid',
+            self.conn
+        )
+        return df
+
+    def export_csv(self, output_file):
+        """Write the legacy all_corrected_facilities.csv view of the store"""
+        df = self.to_dataframe().drop(columns=['source'])
+        df.to_csv(output_file, sep=';', index=False, encoding='utf-8')
+        return output_file
+
+    def import_csv(self, csv_file):
+        """Bootstrap the store from an existing all_corrected_facilities.csv"""
+        if not os.path.exists(csv_file):
+            return None
+        return self.upsert_many(pd.read_csv(csv_file, sep=';'))
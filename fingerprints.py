@@ -0,0 +1,107 @@
+"""
+Address Fingerprint Store
+Keeps a hash of (address, city, coordinates) per facility id so that geocoding
+only has to run for facilities that are new or whose address data changed.
+"""
+
+import hashlib
+import json
+import logging
+import os
+
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+
+def facility_key(value):
+    """Stable string key for a facility id ('32.0' -> '32')"""
+    if value is None or pd.isna(value):
+        return ''
+    text = str(value).strip()
+    return text[:-2] if text.endswith('.0') else text
+
+
+def _normalize_part(value):
+    """Canonical text for one fingerprint component (NaN and None hash the same)"""
+    if value is None or pd.isna(value):
+        return ''
+    if isinstance(value, float):
+        return repr(round(value, 7))
+    return ' '.join(str(value).split()).lower()
+
+
+def address_fingerprint(address, city, latitude, longitude):
+    """SHA-1 hash of the address, city and coordinates of a facility"""
+    payload = '|'.join(_normalize_part(v) for v in (address, city, latitude, longitude))
+    return hashlib.sha1(payload.encode('utf-8')).hexdigest()
+
+
+class FingerprintStore:
+    """JSON-backed mapping facility id -> address fingerprint"""
+
+    def __init__(self, path=os.path.join('data', 'geocode_fingerprints.json')):
+        self.path = path
+        self.fingerprints = {}
+        self.load()
+
+    def load(self):
+        """Load fingerprints from disk (missing or unreadable file -> empty store)"""
+        if not os.path.exists(self.path):
+            self.fingerprints = {}
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                self.fingerprints = json.load(f)
+            logger.info(f"✅ Loaded {len(self.fingerprints)} address fingerprints")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load fingerprints, starting empty: {e}")
+            self.fingerprints = {}
+
+    def save(self):
+        """Write fingerprints atomically so an interrupted run never leaves a corrupt file"""
+        os.makedirs(os.path.dirname(self.path) or '.', exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.fingerprints, f, indent=0, sort_keys=True)
+        os.replace(tmp_path, self.path)
+
+    def compute(self, raw_data, id_col='id', address_col='address', city_col='address_city',
+                lat_col='address_latitude', lon_col='address_longitude'):
+        """Return a Series of fingerprints indexed like raw_data"""
+        columns = [raw_data[c] if c in raw_data.columns else pd.Series(None, index=raw_data.index)
+                   for c in (address_col, city_col, lat_col, lon_col)]
+        return pd.Series(
+            [address_fingerprint(*values) for values in zip(*columns)],
+            index=raw_data.index
+        )
+
+    def classify(self, ids, fingerprints):
+        """Split facility ids into new, changed and unchanged lists"""
+        result = {'new': [], 'changed': [], 'unchanged': []}
+        for fac_id, fingerprint in zip(ids, fingerprints):
+            key = facility_key(fac_id)
+            previous = self.fingerprints.get(key)
+            if previous is None:
+                result['new'].append(key)
+            elif previous != fingerprint:
+                result['changed'].append(key)
+            else:
+                result['unchanged'].append(key)
+        return result
+
+    def update(self, fac_id, fingerprint):
+        """Record the fingerprint a facility was geocoded with"""
+        key = facility_key(fac_id)
+        if key:
+            self.fingerprints[key] = fingerprint
+
+    def discard(self, fac_id):
+        """Forget a facility's fingerprint so the next run geocodes it again"""
+        self.fingerprints.pop(facility_key(fac_id), None)
+
+    def __contains__(self, fac_id):
+        return facility_key(fac_id) in self.fingerprints
+
+    def __len__(self):
+        return len(self.fingerprints)
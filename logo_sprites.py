@@ -0,0 +1,240 @@
+#!/usr/bin/env python3
+"""
+Logo Sprite Sheet
+Packs the logos shown on the map markers (the group logos in public/ and,
+optionally, each facility's own logo_url downloaded once into a local cache)
+into a single PNG of small square tiles with a CSS/coordinate index, so the
+page fetches one small image instead of every full-size logo. Tiles are drawn
+at 2x the 22 px marker size to stay sharp on HiDPI screens, and identical
+images share a tile. Pillow is optional: without it the markers keep loading
+the original files.
+"""
+
+import argparse
+import hashlib
+import importlib.util
+import io
+import json
+import logging
+import math
+import os
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+PUBLIC_DIR = 'public'
+DATA_DIR = 'data'
+CACHE_DIR = 'logo_cache'
+CACHE_INDEX = 'index.json'
+# Tamaño del logo en el marcador (px CSS) y factor de resolución de los tiles
+LOGO_SIZE = 22
+SCALE = 2
+
+
+def has_pillow():
+    return importlib.util.find_spec('PIL') is not None
+
+
+def group_logo_sources(public_dir=PUBLIC_DIR):
+    """Logo path as used by the map (get_facility_logo) -> file in public_dir, for the files that exist"""
+    from repository import DEFAULT_LOGO, GROUP_LOGOS
+    logos = sorted(set(GROUP_LOGOS.values()) | {DEFAULT_LOGO})
+    return {logo: os.path.join(public_dir, logo) for logo in logos if os.path.isfile(os.path.join(public_dir, logo))}
+
+
+def facility_logo_urls(raw_facilities):
+    """facility_id -> logo_url from raw_facilities (http(s) URLs only)"""
+    from repository import normalize_facility_ids
+    if raw_facilities is None or 'logo_url' not in raw_facilities.columns:
+        return {}
+    urls = raw_facilities['logo_url'].astype(object).where(raw_facilities['logo_url'].notna(), '').astype(str).str.strip()
+    ids = normalize_facility_ids(raw_facilities['id'])
+    keep = urls.str.match(r'https?://') & (ids != '')
+    return dict(zip(ids[keep], urls[keep]))
+
+
+def _cache_dir(data_dir):
+    return os.path.join(data_dir, CACHE_DIR)
+
+
+def cache_facility_logos(raw_facilities, data_dir=DATA_DIR, refresh=False, timeout=15):
+    """Download every facility's logo_url once into data/logo_cache; returns facility_id -> cached file"""
+    import requests
+    urls = facility_logo_urls(raw_facilities)
+    cache_dir = _cache_dir(data_dir)
+    os.makedirs(cache_dir, exist_ok=True)
+    session = requests.Session()
+    files, downloaded, failed = {}, 0, 0
+    for url in sorted(set(urls.values())):
+        # Varias facilities comparten URL: un único fichero por URL
+        name = hashlib.sha256(url.encode('utf-8')).hexdigest()[:16]
+        path = os.path.join(cache_dir, name)
+        if refresh or not os.path.isfile(path):
+            try:
+                response = session.get(url, timeout=timeout)
+                response.raise_for_status()
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(response.content)
+                os.replace(f'{path}.tmp', path)
+                downloaded += 1
+            except Exception as e:
+                failed += 1
+                logger.debug(f"Could not download logo {url}: {e}")
+        if os.path.isfile(path):
+            files[url] = name
+    index = {fac_id: files[url] for fac_id, url in urls.items() if url in files}
+    with open(os.path.join(cache_dir, f'{CACHE_INDEX}.tmp'), 'w', encoding='utf-8') as f:
+        json.dump(index, f, indent=2, sort_keys=True)
+    os.replace(os.path.join(cache_dir, f'{CACHE_INDEX}.tmp'), os.path.join(cache_dir, CACHE_INDEX))
+    logger.info(f"🖼️ {len(index)} facility logos cached in {cache_dir} ({downloaded} downloaded, {failed} failed)")
+    return {fac_id: os.path.join(cache_dir, name) for fac_id, name in index.items()}
+
+
+def load_cached_facility_logos(data_dir=DATA_DIR):
+    """facility_id -> cached logo file from a previous cache_facility_logos() run ({} if there is none)"""
+    cache_dir = _cache_dir(data_dir)
+    try:
+        with open(os.path.join(cache_dir, CACHE_INDEX), encoding='utf-8') as f:
+            index = json.load(f)
+    except (OSError, ValueError):
+        return {}
+    return {fac_id: os.path.join(cache_dir, name) for fac_id, name in index.items()
+            if os.path.isfile(os.path.join(cache_dir, name))}
+
+
+def _thumbnail(data, tile_size):
+    """Image bytes -> RGBA tile_size x tile_size tile, aspect ratio kept and centred on transparent"""
+    from PIL import Image
+    with Image.open(io.BytesIO(data)) as image:
+        image = image.convert('RGBA')
+    image.thumbnail((tile_size, tile_size), Image.LANCZOS)
+    tile = Image.new('RGBA', (tile_size, tile_size), (0, 0, 0, 0))
+    tile.paste(image, ((tile_size - image.width) // 2, (tile_size - image.height) // 2))
+    return tile
+
+
+class LogoSprite:
+    """Square logo tiles on a grid; logos maps map logo paths and facilities maps facility_ids to tiles"""
+
+    def __init__(self, size=LOGO_SIZE, scale=SCALE):
+        self.size = size
+        self.scale = scale
+        self.tiles = []
+        self.logos = {}
+        self.facilities = {}
+        self.source_bytes = 0
+        self._by_digest = {}
+
+    def __len__(self):
+        return len(self.tiles)
+
+    def add(self, path):
+        """Tile for the image at path (None if it cannot be read as an image)"""
+        with open(path, 'rb') as f:
+            data = f.read()
+        digest = hashlib.sha256(data).hexdigest()
+        if digest not in self._by_digest:
+            try:
+                self.tiles.append(_thumbnail(data, self.size * self.scale))
+                self._by_digest[digest] = len(self.tiles) - 1
+                self.source_bytes += len(data)
+            except Exception as e:
+                logger.warning(f"⚠️ Skipping logo {path}: {e}")
+                self._by_digest[digest] = None
+        return self._by_digest[digest]
+
+    @property
+    def columns(self):
+        return max(1, math.ceil(math.sqrt(len(self.tiles))))
+
+    @property
+    def rows(self):
+        return max(1, math.ceil(len(self.tiles) / self.columns))
+
+    def position(self, tile):
+        """Top-left corner (x, y) of a tile in CSS px"""
+        return (tile % self.columns) * self.size, (tile // self.columns) * self.size
+
+    def to_png(self):
+        from PIL import Image
+        tile_size = self.size * self.scale
+        sheet = Image.new('RGBA', (self.columns * tile_size, self.rows * tile_size), (0, 0, 0, 0))
+        for tile, image in enumerate(self.tiles):
+            x, y = self.position(tile)
+            sheet.paste(image, (x * self.scale, y * self.scale))
+        buffer = io.BytesIO()
+        sheet.save(buffer, format='PNG', optimize=True)
+        return buffer.getvalue()
+
+    def css(self, image_url):
+        """.logo-sprite (sheet and size) plus one .logo-<tile> background-position rule per tile"""
+        rules = [f'        .logo-sprite {{ display: inline-block; width: {self.size}px; height: {self.size}px; '
+                 f'background: url("{image_url}") no-repeat; '
+                 f'background-size: {self.columns * self.size}px {self.rows * self.size}px; }}']
+        for tile in range(len(self.tiles)):
+            x, y = self.position(tile)
+            rules.append(f'        .logo-{tile} {{ background-position: {-x}px {-y}px; }}')
+        return '\n'.join(rules) + '\n'
+
+    def index(self):
+        """Coordinate index for the page: tile per logo path and facility_id, and each tile's (x, y) in CSS px"""
+        return {
+            'size': self.size,
+            'logos': self.logos,
+            'facilities': self.facilities,
+            'positions': [list(self.position(tile)) for tile in range(len(self.tiles))],
+        }
+
+
+def build_logo_sprite(public_dir=PUBLIC_DIR, facility_logos=None):
+    """Sprite of the group logos plus facility_logos (facility_id -> file); None without Pillow or logos"""
+    if not has_pillow():
+        logger.info("ℹ️ Pillow not installed, the map markers load the full-size logos")
+        return None
+    sprite = LogoSprite()
+    for logo, path in group_logo_sources(public_dir).items():
+        tile = sprite.add(path)
+        if tile is not None:
+            sprite.logos[logo] = tile
+    for fac_id, path in sorted((facility_logos or {}).items()):
+        tile = sprite.add(path)
+        if tile is not None:
+            sprite.facilities[fac_id] = tile
+    if not sprite.tiles:
+        return None
+    return sprite
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Cache the facility logos and report the map's logo sprite sheet")
+    parser.add_argument('--download', action='store_true', help="Download each facility's logo_url into data/logo_cache")
+    parser.add_argument('--refresh', action='store_true', help="With --download, download logos that are already cached again")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--public-dir', default=PUBLIC_DIR)
+    args = parser.parse_args(argv)
+
+    if args.download:
+        from repository import get_repository
+        raw_facilities = get_repository(args.data_dir).get('raw_facilities')
+        if raw_facilities is None:
+            logger.error(f"❌ No raw_facilities.csv found in {args.data_dir}")
+            return False
+        facility_logos = cache_facility_logos(raw_facilities, args.data_dir, refresh=args.refresh)
+    else:
+        facility_logos = load_cached_facility_logos(args.data_dir)
+
+    sprite = build_logo_sprite(args.public_dir, facility_logos)
+    if sprite is None:
+        # Sin Pillow no es un error: el mapa usa los logos originales
+        return not has_pillow()
+    png = sprite.to_png()
+    print(f"{len(sprite)} tiles ({len(sprite.logos)} group logos, {len(sprite.facilities)} facility logos), "
+          f"{sprite.columns}x{sprite.rows} grid of {sprite.size * sprite.scale}px")
+    print(f"Sprite sheet {len(png) / 1024:.1f} KB vs {sprite.source_bytes / 1024:.1f} KB of source images")
+    logger.info("✅ The next map build (map.py / assets.py) writes the sprite to public/assets")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -6,12 +6,21 @@ Processes facility data and generates an interactive HTML map showing healthcare
 import pandas as pd
 import numpy as np
 import os
+import io
 import logging
 import json
+import html
 import re
 from datetime import datetime
-import pytz
-from data import MetabaseDataFetcher
+from name_matching import FacilityNameIndex
+from coordinate_validation import describe_issue, region_bounding_boxes, validate_coordinates
+from repository import get_repository
+from metrics import track_stage, write_metrics
+from engine import get_engine
+from expiry import drop_started_shifts
+from shift_intervals import ShiftIntervalIndex
+from demand_cube import DemandCube
+from payload import DECODER_JS, FacilityPayload, write_json_columns
 
 # Configure logging
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
@@ -84,20 +93,17 @@ def apply_encoding_fix_to_dataframe(df):
     
     return df_fixed
 
-def update_coords(row, coords_map):
-    """Update coordinates from correction file"""
-    name = None
-    possible_name_cols = ['facility_name', 'name', 'Name', 'public_name']
-    
-    for col in possible_name_cols:
-        if col in row and pd.notna(row[col]):
-            name = row[col]
-            break
-    
-    if name and name in coords_map:
-        row['latitude'] = coords_map[name]['latitud_corregida']
-        row['longitude'] = coords_map[name]['longitud_corregida']
-    return row
+def resolve_correction_keys(facility, correction_names):
+    """Correction name for each facility row (first non-empty name column, fuzzy fallback on the normalized name), None if no match"""
+    name_cols = [c for c in ['facility_name', 'name', 'Name', 'public_name'] if c in facility.columns]
+    if not name_cols:
+        return pd.Series(None, index=facility.index, dtype=object)
+    names = facility[name_cols].bfill(axis=1).iloc[:, 0]
+    known = set(correction_names)
+    name_index = FacilityNameIndex(correction_names)
+    # Resolver cada nombre distinto una sola vez
+    resolved = {name: name if name in known else name_index.lookup(name) for name in names.dropna().unique()}
+    return names.map(resolved).astype(object).where(names.notna(), None)
 
 def standardize_dataframes(*dataframes):
     """Standardize column names for all dataframes"""
@@ -150,10 +156,11 @@ def process_facilities(facility_data, coordinate_corrections=None):
         logger.info("📍 Step 3: Applying coordinate corrections...")
         try:
             # After standardization, column names are lowercase
-            coords_map = coordinate_corrections.set_index('nombre_original')[
+            corrections = coordinate_corrections.drop_duplicates('nombre_original').set_index('nombre_original')[
                 ['latitud_corregida', 'longitud_corregida']
-            ].to_dict('index')
-            facility = facility.apply(lambda row: update_coords(row, coords_map), axis=1)
+            ]
+            facility = get_engine().apply_coordinate_corrections(
+                facility, resolve_correction_keys(facility, corrections.index), corrections)
             logger.info(f"✅ Coordinate corrections applied")
         except Exception as e:
             logger.warning(f"⚠️ Error applying coordinate corrections: {e}")
@@ -172,151 +179,80 @@ def process_facilities(facility_data, coordinate_corrections=None):
     facility = facility.dropna(subset=['latitude', 'longitude'])
     removed_no_coords = initial_count - len(facility)
     
-    # Filter to Spain bounds
-    facility = facility[
-        (facility['latitude'].between(35, 44)) &      # Spain latitude range
-        (facility['longitude'].between(-10, 5))       # Spain longitude range
-    ]
-    removed_outside_spain = len(facility.dropna(subset=['latitude', 'longitude'])) - len(facility)
+    # Filter to Spain regions (peninsula, Baleares, Canarias, Ceuta y Melilla)
+    city_col = 'address_city' if 'address_city' in facility.columns else 'city'
+    validation = validate_coordinates(facility, 'latitude', 'longitude', city_col, 'address')
+    before_region_filter = len(facility)
+    facility = facility[validation['region'] != '']
+    removed_outside_spain = before_region_filter - len(facility)
+    
+    # Flag (but keep) facilities that are far from their declared city / postal code
+    implausible = validation.loc[facility.index]
+    implausible = implausible[~implausible['plausible']]
     
     logger.info(f"📊 Processing results:")
     logger.info(f"   • Initial facilities: {initial_count}")
     logger.info(f"   • Removed (no coordinates): {removed_no_coords}")
     logger.info(f"   • Removed (outside Spain): {removed_outside_spain}")
     logger.info(f"   • Final facilities: {len(facility)}")
+    if not implausible.empty:
+        logger.warning(f"⚠️ {len(implausible)} facilities look far from their declared city/postal code:")
+        for idx, check in implausible.head(20).iterrows():
+            logger.warning(f"   • {facility.at[idx, 'facility_name'] if 'facility_name' in facility.columns else idx}: "
+                           f"{describe_issue(check)}")
+        if len(implausible) > 20:
+            logger.warning(f"   • ... and {len(implausible) - 20} more")
     
     return facility
 
-def format_datetime_madrid(utc_datetime_str):
-    """Convert UTC datetime to Madrid timezone and format user-friendly"""
-    try:
-        if pd.isna(utc_datetime_str):
-            return "N/A"
-        
-        # Parse UTC datetime
-        utc_dt = pd.to_datetime(utc_datetime_str, utc=True)
-        
-        # Convert to Madrid timezone
-        madrid_tz = pytz.timezone('Europe/Madrid')
-        madrid_dt = utc_dt.tz_convert(madrid_tz)
-        
-        # Format user-friendly
-        formatted = madrid_dt.strftime("%d %b %Y, %H:%M")
-        timezone_name = madrid_dt.strftime("%Z")
-        
-        return f"{formatted} ({timezone_name})"
-    except Exception as e:
-        return str(utc_datetime_str)
-
 def extract_skills(skills_str):
     """Extract skills from comma-separated string"""
     if pd.isna(skills_str):
         return []
     return [s.strip() for s in str(skills_str).split(",") if s.strip()]
 
-def clean_facility_id(val):
-    """Convierte el facility_id a string sin decimales sobrantes."""
-    try:
-        if pd.isna(val):
-            return ''
-        val_str = str(val)
-        if val_str.endswith('.0'):
-            return val_str[:-2]
-        return val_str
-    except Exception:
-        return str(val)
-
-def get_facility_logo(facility_name):
-    """
-    Determine which logo to use based on facility name.
-    Returns the path to the appropriate logo image.
-    """
-    if not facility_name:
-        return "logo.png"
-    
-    facility_name_lower = str(facility_name).lower()
-    
-    # Define the 7 largest healthcare groups and their keywords
-    group_logos = {
-        "quironsalud": "Grupo Quirónsalud.jpg",
-        "quirónsalud": "Grupo Quirónsalud.jpg",
-        "quiron": "Grupo Quirónsalud.jpg",
-        "quirón": "Grupo Quirónsalud.jpg",
-        
-        "hla": "Grupo HLA.png",
-        "grupo hla": "Grupo HLA.png",
-        
-        "fresenius": "Fresenius.png",
-        
-        "diaverum": "Diaverum.png",
-        
-        "colisee": "Colisee.png",
-        
-        "fundación hospitalarias": "FUNDACION HOSPITALARIAS.png",
-        "fundacion hospitalarias": "FUNDACION HOSPITALARIAS.png",
-        "hospitalarias": "FUNDACION HOSPITALARIAS.png",
-        
-        "grup mutuam": "Grup Mutuam.jpeg",
-        "mutuam": "Grup Mutuam.jpeg"
-    }
-    
-    # Check if any group keyword is in the facility name
-    for keyword, logo_path in group_logos.items():
-        if keyword in facility_name_lower:
-            return logo_path
-    
-    # Default logo for other facilities
-    return "logo.png"
-
 def load_data_from_files(data_dir='data'):
     """Load processed data from CSV files"""
     logger.info("=== 📂 LOADING DATA FROM FILES ===")
+    repository = get_repository(data_dir)
     
     # Load raw facility data
-    facility_file = os.path.join(data_dir, 'raw_facilities.csv')
-    if not os.path.exists(facility_file):
+    facility_data = repository.get('raw_facilities')
+    if facility_data is None:
+        facility_file = os.path.join(data_dir, 'raw_facilities.csv')
         logger.error(f"❌ Facility data file not found: {facility_file}")
         logger.error("Please run data.py first to fetch data from Metabase")
         return None, None
     
-    facility_data = pd.read_csv(facility_file)
     logger.info(f"✅ Loaded facility data: {len(facility_data)} rows")
     
     # Load coordinate corrections (optional)
-    corrections_file = os.path.join(data_dir, 'facilities_corrected_coords.csv')
     coordinate_corrections = None
-    if os.path.exists(corrections_file):
-        try:
-            coordinate_corrections = pd.read_csv(corrections_file, sep=';')
+    try:
+        coordinate_corrections = repository.get('corrections')
+        if coordinate_corrections is not None:
+            coordinate_corrections = coordinate_corrections.copy()
             logger.info(f"✅ Loaded coordinate corrections: {len(coordinate_corrections)} entries")
-        except Exception as e:
-            logger.warning(f"⚠️ Could not load coordinate corrections: {e}")
-    else:
-        logger.info("ℹ️ No coordinate corrections file found (optional)")
+        else:
+            logger.info("ℹ️ No coordinate corrections file found (optional)")
+    except Exception as e:
+        logger.warning(f"⚠️ Could not load coordinate corrections: {e}")
     
     return facility_data, coordinate_corrections
 
 def load_facilities_and_shifts(data_dir='data'):
     """Carga instalaciones corregidas, shifts disponibles y ofertas, y asocia todo por facility_id sin filtrar instalaciones."""
-    facilities_file = os.path.join(data_dir, 'all_corrected_facilities.csv')
-    shifts_file = os.path.join(data_dir, 'available_shifts.csv')
-    offers_file = os.path.join(data_dir, 'available_offers.csv')
-    if not os.path.exists(facilities_file):
-        logger.error(f"❌ Required file not found: {facilities_file}")
+    repository = get_repository(data_dir)
+    facilities = repository.get('corrected_facilities')
+    if facilities is None:
+        logger.error(f"❌ Required file not found: {os.path.join(data_dir, 'all_corrected_facilities.csv')}")
         return None, None, None
-    facilities = pd.read_csv(facilities_file, sep=';')
-    facilities.columns = facilities.columns.str.lower().str.replace(' ', '_')
-    facilities['facility_id'] = facilities['facility_id'].apply(clean_facility_id)
-    if os.path.exists(shifts_file):
-        shifts = pd.read_csv(shifts_file)
-        shifts.columns = shifts.columns.str.lower().str.replace(' ', '_')
-        shifts['facility_id'] = shifts['facility_id'].apply(clean_facility_id)
-    else:
+    logger.info(f"✅ Loaded {len(facilities)} facilities from {repository.path_for('corrected_facilities')}")
+    shifts = repository.get('shifts')
+    if shifts is None:
         shifts = pd.DataFrame()
-    if os.path.exists(offers_file):
-        offers = pd.read_csv(offers_file)
-        offers.columns = offers.columns.str.lower().str.replace(' ', '_')
-        offers['facility_id'] = offers['facility_id'].apply(clean_facility_id)
+    offers = repository.get('offers')
+    if offers is not None:
         # Filtrar solo ofertas PUBLISHED
         if 'status' in offers.columns:
             offers = offers[offers['status'] == 'PUBLISHED']
@@ -326,135 +262,56 @@ def load_facilities_and_shifts(data_dir='data'):
         logger.info("ℹ️ No offers file found")
     return facilities, shifts, offers
 
-def create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df=None):
-    """Crea el HTML del mapa mostrando instalaciones, shifts y ofertas si existen"""
-    logger.info("=== 🗺️ CREATING FACILITIES MAP WITH SHIFTS ===")
-    if facilities_df is None or facilities_df.empty:
-        logger.error("❌ No facilities to create map")
-        return None
-    # Agrupar shifts por facility_id si existen
-    shifts_by_fac = shifts_df.groupby('facility_id') if shifts_df is not None and not shifts_df.empty else {}
-    # Agrupar ofertas por facility_id si existen
-    offers_by_fac = offers_df.groupby('facility_id') if offers_df is not None and not offers_df.empty else {}
-    facilities_data = []
-    for _, row in facilities_df.iterrows():
-        fac_id = clean_facility_id(row.get('facility_id', row.get('nombre_original', '')))
-        fac_shifts = shifts_by_fac.get_group(fac_id) if fac_id in getattr(shifts_by_fac, 'groups', {}) else None
-        fac_offers = offers_by_fac.get_group(fac_id) if fac_id in getattr(offers_by_fac, 'groups', {}) else None
-        try:
-            # Calcular estadísticas de shifts
-            shift_stats = {'total': 0, 'enf': 0, 'tcae': 0, 'offers': 0}
-            shifts_list = []
-            offers_list = []
-            if fac_shifts is not None and not fac_shifts.empty:
-                shift_stats['total'] = len(fac_shifts)
-                shift_stats['enf'] = len(fac_shifts[fac_shifts['category'] == 'ENF'])
-                shift_stats['tcae'] = len(fac_shifts[fac_shifts['category'] == 'TCAE'])
-                shifts_list = [
-                    {
-                        'shift_id': str(s.get('id', '')),
-                        'start_time': format_datetime_madrid(s.get('start_time_utc', '')),
-                        'finish_time': format_datetime_madrid(s.get('finish_time_utc', '')),
-                        'specialization': s.get('specialization_display_text', s.get('specialization', '')),
-                        'category': s.get('category', ''),
-                        'capacity': s.get('capacity', ''),
-                    }
-                    for _, s in fac_shifts.iterrows()
-                ]
-            # Calcular estadísticas de ofertas
-            if fac_offers is not None and not fac_offers.empty:
-                shift_stats['offers'] = len(fac_offers)
-                offers_list = [
-                    {
-                        'offer_id': str(o.get('id', '')),
-                        'external_id': str(o.get('external_id', '')),
-                        'category': o.get('category', ''),
-                        'skill': o.get('skill', ''),
-                        'contract_type': o.get('contract_type', ''),
-                        'salary_min': o.get('salary_min', ''),
-                        'salary_max': o.get('salary_max', ''),
-                        'salary_period': o.get('salary_period', ''),
-                        'start_date': o.get('start_date', ''),
-                        'status': o.get('status', ''),
-                        'job_description': str(o.get('job_description', ''))[:100] + ('...' if len(str(o.get('job_description', ''))) > 100 else ''),
-                    }
-                    for _, o in fac_offers.iterrows()
-                ]
-            facility_name = str(row.get('nombre_correcto', row.get('facility_name', 'N/A')))
-            facility = {
-                'id': fac_id,
-                'name': facility_name,
-                'city': str(row.get('ciudad', row.get('city', 'N/A'))),
-                'address': str(row.get('direccion', row.get('address', 'N/A'))),
-                'latitude': float(row.get('latitud_corregida', row.get('latitude', 0))),
-                'longitude': float(row.get('longitud_corregida', row.get('longitude', 0))),
-                'logo_path': get_facility_logo(facility_name),
-                'shift_stats': shift_stats,
-                'shifts': shifts_list,
-                'offers': offers_list
-            }
-            facilities_data.append(facility)
-        except Exception as e:
-            logger.warning(f"⚠️ Error processing facility row: {e}")
-            continue
-    # Crear HTML
-    total_hospitals = len(facilities_data)
-    html_content = f'''
-<!DOCTYPE html>
-<html>
-<head>
-    <title>Mapa de Centros Sanitarios</title>
-    <meta charset="utf-8" />
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <link rel="stylesheet" href="https://unpkg.com/leaflet@1.7.1/dist/leaflet.css" />
-    <script src="https://unpkg.com/leaflet@1.7.1/dist/leaflet.js"></script>
-    <style>
-        body {{ margin: 0; padding: 0; font-family: Arial, sans-serif; }}
-        #map {{ height: 100vh; width: 100%; }}
-        .facility-marker {{ font-size: 24px; text-align: center; border-radius: 50%; background: white; border: 2px solid white; width: 32px; height: 32px; display: flex; align-items: center; justify-content: center; box-shadow: 0 2px 8px rgba(0,0,0,0.3); }}
-        .facility-popup {{ font-size: 14px; max-width: 400px; }}
-        .facility-header {{ margin: 0 0 10px 0; color: #2c3e50; text-align: center; font-size: 16px; font-weight: bold; }}
-        .shift-list {{ margin-top: 10px; max-height: 250px; overflow-y: auto; }}
-        .shift-item {{ background: #f9f9f9; border-left: 4px solid #007bff; border-radius: 4px; padding: 8px; margin-bottom: 8px; }}
-        .shift-title {{ font-weight: bold; }}
-        .offer-item {{ background: #f0f8ff; border-left: 4px solid #28a745; border-radius: 4px; padding: 8px; margin-bottom: 8px; }}
-        .offer-title {{ font-weight: bold; color: #28a745; }}
-        .shift-stats {{ background: #e9f4ff; border: 1px solid #007bff; border-radius: 8px; padding: 12px; margin: 10px 0; }}
-        .stat-row {{ display: flex; justify-content: space-between; margin: 4px 0; }}
-        .stat-label {{ font-weight: bold; color: #2c3e50; }}
-        .stat-value {{ color: #007bff; font-weight: bold; }}
-        .company-title {{ position: absolute; top: 20px; left: 20px; background: white; border-radius: 16px; box-shadow: 0 2px 8px rgba(0,0,0,0.15); padding: 16px 32px; font-size: 24px; font-weight: bold; color: #2c3e50; z-index: 1000; border: 2px solid #007bff; }}
-        .hospital-count {{ font-size: 16px; color: #007bff; margin-top: 8px; text-align: center; }}
-        .filters {{ position: absolute; top: 20px; right: 20px; background: white; border-radius: 16px; box-shadow: 0 2px 8px rgba(0,0,0,0.15); padding: 16px; z-index: 1000; border: 2px solid #007bff; min-width: 250px; }}
-        .filter-title {{ font-weight: bold; color: #2c3e50; margin-bottom: 10px; text-align: center; }}
-        .filter-group {{ margin-bottom: 12px; }}
-        .filter-label {{ font-weight: bold; color: #2c3e50; margin-bottom: 5px; display: block; }}
-        .filter-checkbox {{ margin: 3px 0; }}
-    </style>
-</head>
-<body>
-    <div class="company-title">🏥 Mapa de Centros Sanitarios
-        <div class="hospital-count">Mostrando <span id="visible-count">{total_hospitals}</span> centros</div>
-    </div>
-    <div class="filters">
-        <div class="filter-title">🔍 Filtros</div>
-        <div class="filter-group">
-            <label class="filter-label">Mostrar solo:</label>
-            <div class="filter-checkbox"><input type="checkbox" id="filter-with-shifts"> Centros con turnos</div>
-            <div class="filter-checkbox"><input type="checkbox" id="filter-with-offers"> Centros con ofertas</div>
-        </div>
-        <div class="filter-group">
-            <label class="filter-label">Categorías:</label>
-            <div class="filter-checkbox"><input type="checkbox" id="filter-enf" checked> ENF (Enfermería)</div>
-            <div class="filter-checkbox"><input type="checkbox" id="filter-tcae" checked> TCAE (Auxiliares)</div>
-        </div>
-    </div>
-    <div id="map"></div>
-    <script>
-        const facilitiesData = {json.dumps(facilities_data, ensure_ascii=False)}
+LEAFLET_VERSION = '1.7.1'
+MAP_TITLE = 'Mapa de Centros Sanitarios'
+LEAFLET_CDN = f'https://unpkg.com/leaflet@{LEAFLET_VERSION}/dist'
+
+# Estilos de la página (inline en el HTML autónomo, fichero con hash en public/assets)
+MAP_CSS = '''
+        body { margin: 0; padding: 0; font-family: Arial, sans-serif; }
+        #map { height: 100vh; width: 100%; }
+        .facility-marker { font-size: 24px; text-align: center; border-radius: 50%; background: white; border: 2px solid white; width: 32px; height: 32px; display: flex; align-items: center; justify-content: center; box-shadow: 0 2px 8px rgba(0,0,0,0.3); }
+        .facility-popup { font-size: 14px; max-width: 400px; }
+        .facility-header { margin: 0 0 10px 0; color: #2c3e50; text-align: center; font-size: 16px; font-weight: bold; }
+        .shift-list { margin-top: 10px; max-height: 250px; overflow-y: auto; }
+        .shift-item { background: #f9f9f9; border-left: 4px solid #007bff; border-radius: 4px; padding: 8px; margin-bottom: 8px; }
+        .shift-title { font-weight: bold; }
+        .offer-item { background: #f0f8ff; border-left: 4px solid #28a745; border-radius: 4px; padding: 8px; margin-bottom: 8px; }
+        .offer-title { font-weight: bold; color: #28a745; }
+        .virtual-spacer { position: relative; }
+        .virtual-row { position: absolute; left: 0; right: 0; box-sizing: border-box; padding-bottom: 8px; }
+        .virtual-row > div { height: 100%; box-sizing: border-box; margin-bottom: 0; overflow: hidden; }
+        .virtual-row > div > div { white-space: nowrap; overflow: hidden; text-overflow: ellipsis; }
+        .shift-stats { background: #e9f4ff; border: 1px solid #007bff; border-radius: 8px; padding: 12px; margin: 10px 0; }
+        .stat-row { display: flex; justify-content: space-between; margin: 4px 0; }
+        .stat-label { font-weight: bold; color: #2c3e50; }
+        .stat-value { color: #007bff; font-weight: bold; }
+        .company-title { position: absolute; top: 20px; left: 20px; background: white; border-radius: 16px; box-shadow: 0 2px 8px rgba(0,0,0,0.15); padding: 16px 32px; font-size: 24px; font-weight: bold; color: #2c3e50; z-index: 1000; border: 2px solid #007bff; }
+        .hospital-count { font-size: 16px; color: #007bff; margin-top: 8px; text-align: center; }
+        .filters { position: absolute; top: 20px; right: 20px; background: white; border-radius: 16px; box-shadow: 0 2px 8px rgba(0,0,0,0.15); padding: 16px; z-index: 1000; border: 2px solid #007bff; min-width: 250px; }
+        .filter-title { font-weight: bold; color: #2c3e50; margin-bottom: 10px; text-align: center; }
+        .filter-group { margin-bottom: 12px; }
+        .filter-label { font-weight: bold; color: #2c3e50; margin-bottom: 5px; display: block; }
+        .filter-checkbox { margin: 3px 0; }
+        .filter-date { display: flex; justify-content: space-between; align-items: center; margin: 3px 0; }
+        .filter-date input { margin-left: 8px; }
+'''
+
+def map_script(regions=None):
+    """JS de la página: decodificador + lógica del mapa; lee window.FACILITY_PAYLOAD y window.SHIFT_INDEX"""
+    return DECODER_JS + f'''
+        const facilitiesData = decodeFacilityPayload(window.FACILITY_PAYLOAD);
+        // Turnos ordenados por inicio (minutos desde shiftIndex.base) para búsqueda binaria
+        const shiftIndex = window.SHIFT_INDEX;
+        let activeRange = null;
         let map;
         let allMarkers = [];
         let visibleMarkers = [];
+        // Turnos que han empezado desde la build (prefijo de shiftIndex.start) y cuántos por facility
+        const EXPIRY_CHECK_MS = 60000;
+        let expiredUpTo = 0;
+        let expiredShifts = new Set();
+        let expiredStats = {{}};
         function getColorBySpecialization(especialidad) {{
             const colorMap = {{
                 'Consulta de enfermería': '#007bff',
@@ -467,17 +324,87 @@ def create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df=None):
             return colorMap[especialidad] || '#007bff';
         }}
         function initMap() {{
-            map = L.map('map').setView([40.4, -3.7], 6);
+            map = L.map('map');
+            // Mapas por shard: vista inicial sobre sus propios límites
+            if (window.MAP_BOUNDS) map.fitBounds(window.MAP_BOUNDS); else map.setView([40.4, -3.7], 6);
             L.tileLayer('https://{{s}}.tile.openstreetmap.org/{{z}}/{{x}}/{{y}}.png', {{ attribution: '© OpenStreetMap contributors' }}).addTo(map);
+            expireStartedShifts();
             loadAllFacilities();
             setupFilters();
+            setInterval(() => {{ if (expireStartedShifts()) updateDateRange(); }}, EXPIRY_CHECK_MS);
         }}
+        const spainBounds = {json.dumps(region_bounding_boxes(regions))};
         function isInSpain(lat, lon) {{
-            return lat >= 35 && lat <= 44 && lon >= -10 && lon <= 5;
+            return spainBounds.some(b => lat >= b[0] && lat <= b[2] && lon >= b[1] && lon <= b[3]);
         }}
         function updateVisibleCount() {{
             document.getElementById('visible-count').textContent = visibleMarkers.length;
         }}
+        function lowerBound(values, target) {{
+            let lo = 0, hi = values.length;
+            while (lo < hi) {{
+                const mid = (lo + hi) >> 1;
+                if (values[mid] < target) lo = mid + 1; else hi = mid;
+            }}
+            return lo;
+        }}
+        function dateInputMinutes(id, endOfDay) {{
+            const value = document.getElementById(id).value;
+            if (!value) return null;
+            return Math.floor(new Date(value + 'T00:00:00').getTime() / 60000) + (endOfDay ? 1440 : 0) - shiftIndex.base;
+        }}
+        function shiftsInRange(from, to) {{
+            // Todo turno que se solapa con [from, to) empieza en (from - max_duration, to)
+            const starts = shiftIndex.start;
+            const lo = Math.max(expiredUpTo, from === null ? 0 : lowerBound(starts, from - shiftIndex.max_duration + 1));
+            const hi = to === null ? starts.length : lowerBound(starts, to);
+            const enfCode = shiftIndex.categories.indexOf('ENF');
+            const tcaeCode = shiftIndex.categories.indexOf('TCAE');
+            const byFacility = {{}};
+            for (let i = lo; i < hi; i++) {{
+                if (from !== null && starts[i] < from && starts[i] + shiftIndex.duration[i] <= from) continue;
+                const facId = shiftIndex.facilities[shiftIndex.facility[i]];
+                const stats = byFacility[facId] || (byFacility[facId] = {{ total: 0, enf: 0, tcae: 0, ids: new Set() }});
+                stats.total++;
+                if (shiftIndex.category[i] === enfCode) stats.enf++;
+                if (shiftIndex.category[i] === tcaeCode) stats.tcae++;
+                stats.ids.add(shiftIndex.ids[i]);
+            }}
+            return byFacility;
+        }}
+        function expireStartedShifts() {{
+            // Solo se recorren los turnos empezados desde la última pasada: O(expirados)
+            const end = lowerBound(shiftIndex.start, Math.floor(Date.now() / 60000) - shiftIndex.base + 1);
+            if (end <= expiredUpTo) return false;
+            const enfCode = shiftIndex.categories.indexOf('ENF');
+            const tcaeCode = shiftIndex.categories.indexOf('TCAE');
+            for (let i = expiredUpTo; i < end; i++) {{
+                const facId = shiftIndex.facilities[shiftIndex.facility[i]];
+                const stats = expiredStats[facId] || (expiredStats[facId] = {{ total: 0, enf: 0, tcae: 0 }});
+                stats.total++;
+                if (shiftIndex.category[i] === enfCode) stats.enf++;
+                if (shiftIndex.category[i] === tcaeCode) stats.tcae++;
+                expiredShifts.add(shiftIndex.ids[i]);
+            }}
+            expiredUpTo = end;
+            return true;
+        }}
+        function updateDateRange() {{
+            const from = dateInputMinutes('filter-date-from', false);
+            const to = dateInputMinutes('filter-date-to', true);
+            activeRange = (from === null && to === null) ? null : shiftsInRange(from, to);
+            applyFilters();
+        }}
+        function facilityStats(fac) {{
+            if (activeRange === null) {{
+                const expired = expiredStats[fac.id];
+                if (!expired) return fac.shift_stats;
+                const s = fac.shift_stats;
+                return {{ total: s.total - expired.total, enf: s.enf - expired.enf, tcae: s.tcae - expired.tcae, offers: s.offers }};
+            }}
+            const stats = activeRange[fac.id] || {{ total: 0, enf: 0, tcae: 0, ids: new Set() }};
+            return Object.assign({{}}, stats, {{ offers: fac.shift_stats.offers }});
+        }}
         function applyFilters() {{
             const filterWithShifts = document.getElementById('filter-with-shifts').checked;
             const filterWithOffers = document.getElementById('filter-with-offers').checked;
@@ -486,12 +413,13 @@ def create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df=None):
             visibleMarkers = [];
             allMarkers.forEach(marker => {{
                 const fac = marker.facilityData;
+                const stats = facilityStats(fac);
                 let show = true;
-                if (filterWithShifts && fac.shift_stats.total === 0) show = false;
-                if (filterWithOffers && fac.shift_stats.offers === 0) show = false;
+                if ((filterWithShifts || activeRange !== null) && stats.total === 0) show = false;
+                if (filterWithOffers && stats.offers === 0) show = false;
                 if (!filterENF && !filterTCAE) show = false;
-                else if (!filterENF && fac.shift_stats.enf > 0 && fac.shift_stats.tcae === 0) show = false;
-                else if (!filterTCAE && fac.shift_stats.tcae > 0 && fac.shift_stats.enf === 0) show = false;
+                else if (!filterENF && stats.enf > 0 && stats.tcae === 0) show = false;
+                else if (!filterTCAE && stats.tcae > 0 && stats.enf === 0) show = false;
                 if (show) {{
                     if (!map.hasLayer(marker)) map.addLayer(marker);
                     visibleMarkers.push(marker);
@@ -506,61 +434,343 @@ def create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df=None):
             document.getElementById('filter-with-offers').addEventListener('change', applyFilters);
             document.getElementById('filter-enf').addEventListener('change', applyFilters);
             document.getElementById('filter-tcae').addEventListener('change', applyFilters);
+            document.getElementById('filter-date-from').addEventListener('change', updateDateRange);
+            document.getElementById('filter-date-to').addEventListener('change', updateDateRange);
+        }}
+        // Listas con ventana: alto de fila fijo y solo las filas visibles (± LIST_OVERSCAN) existen en el DOM
+        const ROW_HEIGHT = 64;
+        const LIST_HEIGHT = 250;
+        const LIST_OVERSCAN = 4;
+        function virtualList(className, items, renderItem) {{
+            const container = document.createElement('div');
+            container.className = className;
+            const spacer = document.createElement('div');
+            spacer.className = 'virtual-spacer';
+            spacer.style.height = (items.length * ROW_HEIGHT) + 'px';
+            container.appendChild(spacer);
+            let rendered = null;
+            let scheduled = false;
+            function render() {{
+                scheduled = false;
+                const top = container.scrollTop;
+                const first = Math.max(0, Math.floor(top / ROW_HEIGHT) - LIST_OVERSCAN);
+                const last = Math.min(items.length, Math.ceil((top + (container.clientHeight || LIST_HEIGHT)) / ROW_HEIGHT) + LIST_OVERSCAN);
+                if (rendered === first + ':' + last) return;
+                rendered = first + ':' + last;
+                let html = '';
+                for (let i = first; i < last; i++) {{
+                    html += '<div class="virtual-row" style="top:' + (i * ROW_HEIGHT) + 'px;height:' + ROW_HEIGHT + 'px">' + renderItem(items[i]) + '</div>';
+                }}
+                spacer.innerHTML = html;
+            }}
+            container.addEventListener('scroll', () => {{
+                if (!scheduled) {{
+                    scheduled = true;
+                    requestAnimationFrame(render);
+                }}
+            }});
+            render();
+            return container;
+        }}
+        function renderShift(s) {{
+            return '<div class="shift-item"><div class="shift-title">' + s.category + ' · ' + s.specialization + '</div>'
+                + '<div>' + formatMadrid(s.start) + ' → ' + formatMadrid(s.finish) + '</div></div>';
+        }}
+        function renderOffer(o) {{
+            const salary = [o.salary_min, o.salary_max].filter(v => v !== null).join(' - ');
+            const details = [o.contract_type, salary ? salary + ' €' : null, o.start_date ? 'desde ' + o.start_date : null].filter(v => v);
+            return '<div class="offer-item"><div class="offer-title">' + o.category + ' · ' + o.skill + '</div>'
+                + '<div>' + details.join(' · ') + '</div></div>';
+        }}
+        function buildPopupContent(fac) {{
+            const stats = facilityStats(fac);
+            let popupContent = '<h4 class="facility-header">' + fac.name + '</h4>';
+            // popupContent += '<div><strong>ID:</strong> ' + fac.id + '</div>'; // REMOVED ID FIELD
+            popupContent += '<div><strong>Ciudad:</strong> ' + fac.city + '</div>';
+            popupContent += '<div><strong>Dirección:</strong> ' + fac.address + '</div>';
+            popupContent += '<div class="shift-stats">';
+            popupContent += '<div class="stat-row"><span class="stat-label">Total turnos:</span><span class="stat-value">' + stats.total + '</span></div>';
+            popupContent += '<div class="stat-row"><span class="stat-label">ENF (Enfermería):</span><span class="stat-value">' + stats.enf + '</span></div>';
+            popupContent += '<div class="stat-row"><span class="stat-label">TCAE (Auxiliares):</span><span class="stat-value">' + stats.tcae + '</span></div>';
+            popupContent += '<div class="stat-row"><span class="stat-label">Ofertas:</span><span class="stat-value">' + stats.offers + '</span></div>';
+            popupContent += '</div>';
+            const popup = document.createElement('div');
+            popup.className = 'facility-popup';
+            popup.innerHTML = popupContent;
+            // Con rango de fechas activo, solo los turnos que se solapan con él
+            const shifts = activeRange !== null ? fac.shifts.filter(s => stats.ids.has(s.shift_id))
+                : expiredShifts.size > 0 ? fac.shifts.filter(s => !expiredShifts.has(s.shift_id)) : fac.shifts;
+            if (shifts.length > 0) popup.appendChild(virtualList('shift-list', shifts, renderShift));
+            if (fac.offers.length > 0) popup.appendChild(virtualList('shift-list', fac.offers, renderOffer));
+            return popup;
+        }}
+        function logoHtml(fac) {{
+            // Tile del sprite de logos (logo propio de la facility o el de su grupo); si no hay sprite, la imagen original
+            const sprite = window.LOGO_SPRITE;
+            const tile = !sprite ? undefined : (fac.id in sprite.facilities ? sprite.facilities[fac.id] : sprite.logos[fac.logo_path]);
+            if (tile !== undefined) return '<span class="logo-sprite logo-' + tile + '" role="img" aria-label="Logo"></span>';
+            return '<img src="' + (window.ASSET_BASE || '') + fac.logo_path + '" style="width:22px;height:22px;" alt="Logo"/>';
+        }}
+        function facilityIcon(fac) {{
+            return L.divIcon({{ className: 'facility-marker', html: logoHtml(fac), iconSize: [32, 32], iconAnchor: [16, 16], popupAnchor: [0, -20] }});
+        }}
+        function createMarker(fac) {{
+            // Popup perezoso: Leaflet llama a la función en cada apertura (el contenido depende del rango de fechas activo)
+            const marker = L.marker([fac.latitude, fac.longitude], {{ icon: facilityIcon(fac) }}).bindPopup(() => buildPopupContent(fac));
+            marker.facilityData = fac;
+            marker.addTo(map);
+            allMarkers.push(marker);
+            visibleMarkers.push(marker);
+            return marker;
         }}
         function loadAllFacilities() {{
             let spainMarkers = [];
             facilitiesData.forEach(fac => {{
-                const lat = fac.latitude;
-                const lon = fac.longitude;
-                const hospitalIcon = L.divIcon({{ className: 'facility-marker', html: '<img src="' + fac.logo_path + '" style="width:22px;height:22px;" alt="Logo"/>', iconSize: [32, 32], iconAnchor: [16, 16], popupAnchor: [0, -20] }});
-                let popupContent = '<div class="facility-popup">';
-                popupContent += '<h4 class="facility-header">' + fac.name + '</h4>';
-                // popupContent += '<div><strong>ID:</strong> ' + fac.id + '</div>'; // REMOVED ID FIELD
-                popupContent += '<div><strong>Ciudad:</strong> ' + fac.city + '</div>';
-                popupContent += '<div><strong>Dirección:</strong> ' + fac.address + '</div>';
-                popupContent += '<div class="shift-stats">';
-                popupContent += '<div class="stat-row"><span class="stat-label">Total turnos:</span><span class="stat-value">' + fac.shift_stats.total + '</span></div>';
-                popupContent += '<div class="stat-row"><span class="stat-label">ENF (Enfermería):</span><span class="stat-value">' + fac.shift_stats.enf + '</span></div>';
-                popupContent += '<div class="stat-row"><span class="stat-label">TCAE (Auxiliares):</span><span class="stat-value">' + fac.shift_stats.tcae + '</span></div>';
-                popupContent += '<div class="stat-row"><span class="stat-label">Ofertas:</span><span class="stat-value">' + fac.shift_stats.offers + '</span></div>';
-                popupContent += '</div>';
-                popupContent += '</div>';
-                const marker = L.marker([lat, lon], {{ icon: hospitalIcon }}).bindPopup(popupContent);
-                marker.facilityData = fac;
-                marker.addTo(map);
-                allMarkers.push(marker);
-                visibleMarkers.push(marker);
-                if (isInSpain(lat, lon)) {{
+                const marker = createMarker(fac);
+                if (isInSpain(fac.latitude, fac.longitude)) {{
                     spainMarkers.push(marker);
                 }}
             }});
             updateVisibleCount();
-            if (spainMarkers.length > 0) {{
+            if (!window.MAP_BOUNDS && spainMarkers.length > 0) {{
                 const group = new L.featureGroup(spainMarkers);
                 map.fitBounds(group.getBounds().pad(0.1));
             }}
+            if (window.FEED_VERSION && location.protocol !== 'file:') setInterval(pollFeed, FEED_POLL_MS);
+        }}
+        // Feed de cambios (change_feed.py): parches entre builds consecutivas aplicados sin recargar la página
+        const FEED_POLL_MS = 60000;
+        let feedVersion = window.FEED_VERSION;
+        let feedBusy = false;
+        function patchRecords(table, rows) {{
+            return rows.map(row => {{
+                const record = {{}};
+                table.columns.forEach((column, i) => {{ record[column] = row[i]; }});
+                return record;
+            }});
+        }}
+        function facilitiesById() {{
+            const byId = {{}};
+            facilitiesData.forEach(fac => {{ (byId[fac.id] = byId[fac.id] || []).push(fac); }});
+            return byId;
+        }}
+        function patchFacilities(table) {{
+            // Las facilities van por su clave única (id, o nombre_original si no tienen id): dos centros sin id no se mezclan
+            const removed = new Set(table.removed);
+            for (let i = allMarkers.length - 1; i >= 0; i--) {{
+                if (!removed.has(allMarkers[i].facilityData.key)) continue;
+                if (map.hasLayer(allMarkers[i])) map.removeLayer(allMarkers[i]);
+                allMarkers.splice(i, 1);
+            }}
+            for (let i = facilitiesData.length - 1; i >= 0; i--) {{
+                if (removed.has(facilitiesData[i].key)) facilitiesData.splice(i, 1);
+            }}
+            const markers = {{}};
+            allMarkers.forEach(marker => {{ markers[marker.facilityData.key] = markers[marker.facilityData.key] || marker; }});
+            patchRecords(table, table.updated).forEach(r => {{
+                const marker = markers[r.key];
+                if (!marker) return;
+                Object.assign(marker.facilityData, {{ name: r.name, city: r.city, address: r.address, latitude: r.latitude, longitude: r.longitude, logo_path: r.logo_path }});
+                marker.facilityData.shift_stats = {{ total: r.total, enf: r.enf, tcae: r.tcae, offers: r.offers }};
+                marker.setLatLng([r.latitude, r.longitude]);
+                marker.setIcon(facilityIcon(marker.facilityData));
+            }});
+            patchRecords(table, table.added).forEach(r => {{
+                const fac = {{ id: r.id, key: r.key, name: r.name, city: r.city, address: r.address, latitude: r.latitude, longitude: r.longitude,
+                              logo_path: r.logo_path, shift_stats: {{ total: r.total, enf: r.enf, tcae: r.tcae, offers: r.offers }}, shifts: [], offers: [] }};
+                facilitiesData.push(fac);
+                createMarker(fac);
+            }});
+        }}
+        function patchLists(key, idKey, table, byId) {{
+            // Las listas de las facilities afectadas se decodifican (si no lo estaban) y se editan en sitio
+            const gone = {{}};
+            const drop = (facId, id) => {{ (gone[facId] = gone[facId] || new Set()).add(id); }};
+            table.removed.forEach(pair => drop(pair[1], pair[0]));
+            const updated = patchRecords(table, table.updated);
+            updated.forEach(r => drop(r.facility_id, r[idKey]));
+            Object.keys(gone).forEach(facId => (byId[facId] || []).forEach(fac => {{
+                const list = fac[key];
+                let kept = 0;
+                for (let i = 0; i < list.length; i++) {{
+                    if (!gone[facId].has(list[i][idKey])) list[kept++] = list[i];
+                }}
+                list.length = kept;
+            }}));
+            updated.concat(patchRecords(table, table.added)).forEach(r => {{
+                (byId[r.facility_id] || []).forEach(fac => fac[key].push(r));
+            }});
+        }}
+        function patchShiftIndex(table) {{
+            const gone = new Set(table.removed.map(pair => pair[0]));
+            const changed = patchRecords(table, table.updated).concat(patchRecords(table, table.added));
+            changed.forEach(r => gone.add(r.shift_id));
+            const entries = [];
+            for (let i = 0; i < shiftIndex.start.length; i++) {{
+                if (gone.has(shiftIndex.ids[i])) continue;
+                entries.push([shiftIndex.start[i], shiftIndex.duration[i], shiftIndex.facility[i], shiftIndex.category[i], shiftIndex.ids[i]]);
+            }}
+            const code = (values, value) => {{
+                if (value === null) return -1;
+                let i = values.indexOf(value);
+                if (i < 0) {{ values.push(value); i = values.length - 1; }}
+                return i;
+            }};
+            changed.forEach(r => {{
+                if (r.start === null) return;
+                const duration = r.finish === null || r.finish < r.start ? 0 : r.finish - r.start;
+                entries.push([r.start - shiftIndex.base, duration, code(shiftIndex.facilities, r.facility_id), code(shiftIndex.categories, r.category), r.shift_id]);
+                shiftIndex.max_duration = Math.max(shiftIndex.max_duration, duration);
+            }});
+            // Mismo orden que ShiftIntervalIndex: inicio y después id
+            entries.sort((a, b) => a[0] - b[0] || (a[4] < b[4] ? -1 : a[4] > b[4] ? 1 : 0));
+            ['start', 'duration', 'facility', 'category', 'ids'].forEach((name, j) => {{ shiftIndex[name] = entries.map(e => e[j]); }});
+        }}
+        function applyPatch(patch) {{
+            patchFacilities(patch.facilities);
+            const byId = facilitiesById();
+            patchLists('shifts', 'shift_id', patch.shifts, byId);
+            patchLists('offers', 'offer_id', patch.offers, byId);
+            patchShiftIndex(patch.shifts);
+            // El índice se ha reconstruido: la expiración local se recalcula sobre los datos del parche
+            expiredUpTo = 0;
+            expiredShifts = new Set();
+            expiredStats = {{}};
+            expireStartedShifts();
+            feedVersion = patch.to;
+            updateDateRange();
+        }}
+        function pollFeed() {{
+            if (feedBusy) return;
+            feedBusy = true;
+            fetch('feed/index.json', {{ cache: 'no-cache' }})
+                .then(response => response.ok ? response.json() : null)
+                .then(index => {{
+                    if (!index || index.version <= feedVersion) return;
+                    const steps = index.patches.filter(p => p.from >= feedVersion);
+                    // Versión demasiado antigua (o feed reiniciado): no hay cadena de parches, se recarga la página
+                    if (steps.length === 0 || steps[0].from !== feedVersion) {{ location.reload(); return; }}
+                    return steps.reduce((done, step) => done
+                        .then(() => fetch('feed/' + step.file).then(response => response.json()))
+                        .then(applyPatch), Promise.resolve());
+                }})
+                .catch(error => console.warn('Change feed:', error))
+                .then(() => {{ feedBusy = false; }});
         }}
         document.addEventListener('DOMContentLoaded', function() {{ initMap(); }});
-    </script>
-</body>
+'''
+
+def page_start(total_hospitals, head_tags, title=MAP_TITLE):
+    """HTML hasta el contenedor del mapa; head_tags son los <link>/<style>/<script> de Leaflet y estilos"""
+    title = html.escape(title)
+    return f'''
+<!DOCTYPE html>
+<html>
+<head>
+    <title>{title}</title>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+{head_tags}
+</head>
+<body>
+    <div class="company-title">🏥 {title}
+        <div class="hospital-count">Mostrando <span id="visible-count">{total_hospitals}</span> centros</div>
+    </div>
+    <div class="filters">
+        <div class="filter-title">🔍 Filtros</div>
+        <div class="filter-group">
+            <label class="filter-label">Mostrar solo:</label>
+            <div class="filter-checkbox"><input type="checkbox" id="filter-with-shifts"> Centros con turnos</div>
+            <div class="filter-checkbox"><input type="checkbox" id="filter-with-offers"> Centros con ofertas</div>
+        </div>
+        <div class="filter-group">
+            <label class="filter-label">Categorías:</label>
+            <div class="filter-checkbox"><input type="checkbox" id="filter-enf" checked> ENF (Enfermería)</div>
+            <div class="filter-checkbox"><input type="checkbox" id="filter-tcae" checked> TCAE (Auxiliares)</div>
+        </div>
+        <div class="filter-group">
+            <label class="filter-label">Turnos entre:</label>
+            <div class="filter-date">Desde <input type="date" id="filter-date-from"></div>
+            <div class="filter-date">Hasta <input type="date" id="filter-date-to"></div>
+        </div>
+    </div>
+    <div id="map"></div>
+'''
+
+PAGE_END = '''</body>
 </html>
-    '''
-    return html_content
+'''
+
+def prepare_map_data(facilities_df, shifts_df, offers_df=None):
+    """(FacilityPayload, payload del índice de turnos) para la página, o None si no hay instalaciones"""
+    logger.info("=== 🗺️ CREATING FACILITIES MAP WITH SHIFTS ===")
+    if facilities_df is None or facilities_df.empty:
+        logger.error("❌ No facilities to create map")
+        return None
+    if shifts_df is not None and not shifts_df.empty and 'start_time_utc' in shifts_df.columns:
+        # Turnos empezados desde la descarga (los que expiry.py ya quitó del feed): fuera, como en process_available_shifts
+        shifts_df, started = drop_started_shifts(shifts_df)
+        if not started.empty:
+            logger.info(f"⌛ {len(started)} shifts already started, left out of the map")
+    # Estadísticas por facility_id leídas del cubo de demanda (una sola pasada sobre los shifts)
+    stats = DemandCube.from_frames(shifts_df, offers_df).facility_stats()
+    # Datos embebidos en formato columnar (arrays paralelos + diccionarios), decodificados en la página
+    payload = FacilityPayload(facilities_df, shifts_df, offers_df, stats)
+    # Índice de intervalos para filtrar turnos por fechas en la página
+    shift_index = ShiftIntervalIndex(shifts_df).to_payload(set(payload.facility_ids))
+    return payload, shift_index
+
+def write_facilities_map(out, facilities_df, shifts_df, offers_df=None, title=MAP_TITLE, bounds=None, asset_base=''):
+    """Escribe el HTML autónomo del mapa (todo inline) en out por partes; devuelve el nº de centros o None
+    bounds = [[sur, oeste], [norte, este]] fija la vista inicial (mapas por shard)
+    asset_base = ruta de public/ vista desde la página ('../' en public/shards), para los logos"""
+    prepared = prepare_map_data(facilities_df, shifts_df, offers_df)
+    if prepared is None:
+        return None
+    payload, shift_index = prepared
+    head_tags = (f'    <link rel="stylesheet" href="{LEAFLET_CDN}/leaflet.css" />\n'
+                 f'    <script src="{LEAFLET_CDN}/leaflet.js"></script>\n'
+                 f'    <style>{MAP_CSS}    </style>')
+    out.write(page_start(len(payload), head_tags, title))
+    # Los datos se serializan directamente al fichero, sin construir el JSON ni el HTML completos
+    out.write('    <script type="application/json" id="facilities-payload">')
+    payload.write(out)
+    out.write('</script>\n    <script type="application/json" id="shift-index">')
+    write_json_columns(out, ((None, key, values) for key, values in shift_index.items()))
+    out.write('</script>\n    <script>\n'
+              "        window.FACILITY_PAYLOAD = JSON.parse(document.getElementById('facilities-payload').textContent);\n"
+              "        window.SHIFT_INDEX = JSON.parse(document.getElementById('shift-index').textContent);\n"
+              + (f'        window.MAP_BOUNDS = {json.dumps(bounds)};\n' if bounds else '')
+              + (f'        window.ASSET_BASE = {json.dumps(asset_base)};\n' if asset_base else '') +
+              f'{map_script()}    </script>\n')
+    out.write(PAGE_END)
+    return len(payload)
+
+def create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df=None):
+    """Crea el HTML del mapa como string (map.main lo escribe por partes directamente al fichero)"""
+    buffer = io.StringIO()
+    if write_facilities_map(buffer, facilities_df, shifts_df, offers_df) is None:
+        return None
+    return buffer.getvalue()
 
 def main():
     try:
-        facilities_df, shifts_df, offers_df = load_facilities_and_shifts()
+        with track_stage('load_map_data') as stage:
+            facilities_df, shifts_df, offers_df = load_facilities_and_shifts()
+            stage.rows_out = 0 if facilities_df is None else len(facilities_df)
         if facilities_df is None or shifts_df is None:
             logger.error("❌ No valid facilities or shifts after processing")
             return False
         logger.info("🗺️ Generating HTML map with available shifts...")
-        html_content = create_facilities_map_with_shifts(facilities_df, shifts_df, offers_df)
-        if html_content is None:
+        from assets import build_map_assets
+        map_filename = 'public/index.html'
+        with track_stage('render_map', rows_in=len(facilities_df) + len(shifts_df)) as stage:
+            # index.html + CSS/JS/datos con hash de contenido y sus .gz/.br en public/assets
+            manifest = build_map_assets(facilities_df, shifts_df, offers_df, os.path.dirname(map_filename))
+            stage.rows_out = 0 if manifest is None else len(facilities_df)
+        if manifest is None:
             logger.error("❌ Failed to generate HTML map")
             return False
-        map_filename = 'public/index.html'
-        with open(map_filename, 'w', encoding='utf-8') as f:
-            f.write(html_content)
         logger.info(f"✅ Facilities map saved as: {map_filename}")
         logger.info(f"📊 Final map contains {len(facilities_df)} facilities with available shifts")
         return True
@@ -572,10 +782,12 @@ if __name__ == "__main__":
     logger.info("🚀 Starting Healthcare Facilities Map Generator")
     logger.info("=" * 50)
     success = main()
+    write_metrics()
     if success:
         logger.info("🎉 Map generation completed successfully!")
         logger.info("📂 Generated files:")
         logger.info("   • public/index.html - Interactive map")
+        logger.info("   • public/assets/ - Hashed CSS, JS and data files (+ .gz/.br) and manifest.json")
         logger.info("🌐 Open public/index.html in your browser to view the map")
     else:
         logger.error("💥 Map generation failed!")
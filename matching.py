@@ -0,0 +1,266 @@
+#!/usr/bin/env python3
+"""
+Professional-to-Shift Matching
+Batch matching of professionals to nearby open shifts by category, specialization
+and availability window. Professionals are bucketed in the same lat/lon grid as the
+spatial index so each bucket computes distances to its candidate facilities in one
+vectorized step. Shifts are sorted by (category/specialization group, facility,
+start time) so each professional-facility pair finds its shifts in the time window
+with two searchsorted lookups; only the first k shifts of a pair can rank, and pairs
+farther than the point where nearer facilities already guarantee k shifts are
+dropped before expanding. Candidates are ranked by distance, then start time, and
+the best k are kept per professional.
+
+Professionals CSV columns: professional_id, latitude, longitude, category and,
+optionally, specialization (empty = any), available_from, available_to (UTC) and
+max_distance_km.
+"""
+
+import argparse
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from coordinate_validation import haversine_km
+from spatial_index import DEFAULT_CELL_DEG, KM_PER_DEG_LAT
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+DEFAULT_MAX_DISTANCE_KM = 25.0
+DEFAULT_TOP_K = 5
+# Los minutos desde el inicio más temprano caben en los 32 bits bajos de la clave
+TIME_BITS = 32
+
+
+def _epoch_ns(times):
+    """UTC datetimes as int64 nanoseconds (NaT -> minimum int64)"""
+    return pd.DatetimeIndex(times).tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]').view('int64')
+
+
+def _concat_ranges(starts, ends):
+    """Concatenate the integer ranges [start, end) of each pair; also return the owning pair of each element"""
+    lengths = ends - starts
+    total = int(lengths.sum())
+    owners = np.repeat(np.arange(len(starts)), lengths)
+    if total == 0:
+        return np.empty(0, dtype=np.int64), owners
+    offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+    return offsets + np.arange(total), owners
+
+
+class ShiftMatcher:
+    """Index of open shifts (with facility coordinates) for batch matching"""
+
+    def __init__(self, shifts, facility_index, cell_deg=DEFAULT_CELL_DEG):
+        self.facility_index = facility_index
+        self.cell_deg = cell_deg
+        fac_positions = pd.Series(np.arange(len(facility_index)), index=facility_index.ids)
+        fac_positions = fac_positions[~fac_positions.index.duplicated()]
+
+        shifts = shifts.reset_index(drop=True)
+        fac_pos = shifts['facility_id'].astype(str).map(fac_positions)
+        start = pd.to_datetime(shifts['start_time_utc'], utc=True, errors='coerce')
+        finish = pd.to_datetime(shifts.get('finish_time_utc'), utc=True, errors='coerce', format='mixed')
+        valid = fac_pos.notna() & start.notna()
+        dropped = int((~valid).sum())
+        if dropped:
+            logger.info(f"ℹ️ {dropped} shifts without facility coordinates or start time are not matchable")
+
+        self.shifts = shifts[valid].reset_index(drop=True)
+        fac_pos = fac_pos[valid].astype(np.int64).to_numpy()
+        start = start[valid].reset_index(drop=True)
+        finish = finish[valid].reset_index(drop=True)
+        category = self.shifts['category'].astype(str)
+        specialization = self.shifts['specialization'].astype(str) if 'specialization' in self.shifts else ''
+        group_codes, self.groups = pd.factorize(category + '|' + specialization)
+        category_codes, self.categories = pd.factorize(category)
+
+        # La ventana de tiempo usa minutos relativos al inicio más temprano
+        self.epoch_ns = start.min().value if len(start) else 0
+        minutes = (_epoch_ns(start) - self.epoch_ns) // 60_000_000_000
+        finish_minutes = (_epoch_ns(finish) - self.epoch_ns) // 60_000_000_000
+        finish_minutes = np.where(finish.isna().to_numpy(), minutes, finish_minutes)
+        self.max_duration = int(max((finish_minutes - minutes).max(), 0)) if len(minutes) else 0
+
+        # Cada shift aparece dos veces: bajo su grupo categoría|especialización (códigos 0..G-1)
+        # y bajo su categoría (códigos G..G+C-1) para profesionales sin especialización
+        codes = np.concatenate([group_codes, category_codes + len(self.groups)])
+        rows = np.tile(np.arange(len(minutes)), 2)
+        keys = self._pair_codes(codes, fac_pos[rows]) << TIME_BITS | minutes[rows]
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.order = rows[order]
+        self.start_minutes = minutes[self.order]
+        self.finish_minutes = finish_minutes[self.order]
+        self.facility_positions = fac_pos[self.order]
+
+    def _pair_codes(self, codes, fac_pos):
+        return np.asarray(codes, dtype=np.int64) * len(self.facility_index) + np.asarray(fac_pos, dtype=np.int64)
+
+    def _to_minutes(self, values, default):
+        times = pd.to_datetime(values, utc=True, errors='coerce')
+        minutes = (_epoch_ns(times) - self.epoch_ns) // 60_000_000_000
+        return np.where(pd.isna(times), default, minutes).astype(np.int64)
+
+    def _professional_codes(self, pros):
+        """Index code of each professional: its category|specialization group, or its category when empty"""
+        category = pros['category'].astype(str)
+        specialization = (pros['specialization'].fillna('').astype(str) if 'specialization' in pros
+                          else pd.Series('', index=pros.index))
+        any_spec = (specialization == '').to_numpy()
+        group_codes = pd.Index(self.groups).get_indexer(category + '|' + specialization)
+        category_codes = pd.Index(self.categories).get_indexer(category)
+        return np.where(any_spec, np.where(category_codes >= 0, category_codes + len(self.groups), -1), group_codes)
+
+    def _nearby_facilities(self, lat, lon, max_km):
+        """(professional, facility position, distance) for every facility within each professional's radius"""
+        index = self.facility_index
+        cells = (np.floor((lat + 90.0) / self.cell_deg).astype(np.int64) * 100_000 +
+                 np.floor((lon + 180.0) / self.cell_deg).astype(np.int64))
+        order = np.argsort(cells, kind='stable')
+        boundaries = np.flatnonzero(np.diff(cells[order])) + 1
+        prof_parts, fac_parts, dist_parts = [], [], []
+        for members in np.split(order, boundaries):
+            # Una consulta al índice por celda, con el radio máximo de sus profesionales
+            radius = max_km[members].max()
+            if radius < 0:
+                continue
+            d_lat = radius / KM_PER_DEG_LAT
+            cos_lat = np.cos(np.radians(min(np.abs(lat[members]).max() + d_lat, 89.9)))
+            d_lon = min(radius / (KM_PER_DEG_LAT * cos_lat), 180.0)
+            candidates = index.bbox(lon[members].min() - d_lon, lat[members].min() - d_lat,
+                                    lon[members].max() + d_lon, lat[members].max() + d_lat)
+            if len(candidates) == 0:
+                continue
+            # Por bloques para acotar la matriz de distancias en celdas muy pobladas
+            for block in np.array_split(members, max(1, len(members) * len(candidates) // 2_000_000)):
+                distances = haversine_km(lat[block][:, None], lon[block][:, None],
+                                         index.lat[candidates][None, :], index.lon[candidates][None, :])
+                rows, cols = np.nonzero(distances <= max_km[block][:, None])
+                prof_parts.append(block[rows])
+                fac_parts.append(candidates[cols])
+                dist_parts.append(distances[rows, cols])
+        if not prof_parts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64), np.empty(0)
+        return np.concatenate(prof_parts), np.concatenate(fac_parts), np.concatenate(dist_parts)
+
+    def match(self, professionals, top_k=DEFAULT_TOP_K, default_max_km=DEFAULT_MAX_DISTANCE_KM):
+        """Return the top_k ranked shifts per professional as a DataFrame"""
+        pros = professionals.reset_index(drop=True)
+        n = len(pros)
+        if n == 0 or len(self.keys) == 0 or top_k <= 0:
+            return self._empty_result()
+        lat = pd.to_numeric(pros['latitude'], errors='coerce').to_numpy(dtype=float)
+        lon = pd.to_numeric(pros['longitude'], errors='coerce').to_numpy(dtype=float)
+        max_km = (pd.to_numeric(pros['max_distance_km'], errors='coerce').fillna(default_max_km).to_numpy(dtype=float)
+                  if 'max_distance_km' in pros else np.full(n, default_max_km))
+        now_minutes = (pd.Timestamp.now(tz='UTC').value - self.epoch_ns) // 60_000_000_000
+        window_from = self._to_minutes(pros.get('available_from', pd.Series([None] * n)), now_minutes)
+        window_to = self._to_minutes(pros.get('available_to', pd.Series([None] * n)), (1 << TIME_BITS) - 1)
+        window_from = np.clip(window_from, 0, (1 << TIME_BITS) - 1)
+        window_to = np.clip(window_to, 0, (1 << TIME_BITS) - 1)
+
+        codes = self._professional_codes(pros)
+        valid = np.isfinite(lat) & np.isfinite(lon) & (codes >= 0)
+        p, fac, dist = self._nearby_facilities(np.where(valid, lat, 0.0), np.where(valid, lon, 0.0),
+                                               np.where(valid, max_km, -1.0))
+        if len(p) == 0:
+            return self._empty_result()
+
+        # Rango de shifts de cada (profesional, centro) cuyo inicio cae en la ventana
+        base = self._pair_codes(codes[p], fac) << TIME_BITS
+        starts = np.searchsorted(self.keys, base | window_from[p], side='left')
+        ends = np.searchsorted(self.keys, base | window_to[p], side='right')
+        # Los que empiezan antes de window_to - max_duration terminan seguro dentro de la ventana
+        safe_to = np.maximum(window_to[p] - self.max_duration, window_from[p] - 1)
+        safe = np.maximum(np.searchsorted(self.keys, base | np.maximum(safe_to, 0), side='right') - starts, 0)
+        safe = np.where(safe_to < 0, 0, safe)
+        # Con k shifts seguros en el par bastan los k primeros; si no, se revisa el rango completo
+        ends = np.where(safe >= top_k, starts + top_k, ends)
+
+        # Poda por distancia: en cuanto los pares más cercanos garantizan k shifts, los más lejanos sobran
+        by_distance = np.lexsort((dist, p))
+        p, dist, starts, ends = p[by_distance], dist[by_distance], starts[by_distance], ends[by_distance]
+        sure = np.minimum(safe[by_distance], top_k)
+        first = np.r_[0, np.flatnonzero(np.diff(p)) + 1]
+        lengths = np.diff(np.r_[first, len(p)])
+        cumulative = np.cumsum(sure)
+        guaranteed = cumulative - np.repeat(cumulative[first] - sure[first], lengths)
+        reached = np.where(guaranteed >= top_k, np.arange(len(p)), len(p))
+        threshold = np.append(dist, np.inf)[np.minimum.reduceat(reached, first)]
+        keep = dist <= np.repeat(threshold, lengths)
+        p, dist, starts, ends = p[keep], dist[keep], starts[keep], ends[keep]
+
+        positions, owners = _concat_ranges(starts, ends)
+        cand_prof = p[owners]
+        fits = self.finish_minutes[positions] <= window_to[cand_prof]
+        positions, owners, cand_prof = positions[fits], owners[fits], cand_prof[fits]
+        if len(positions) == 0:
+            return self._empty_result()
+
+        # Ranking: distancia, luego inicio más temprano; top_k por profesional
+        cand_dist = dist[owners]
+        ranking = np.lexsort((self.start_minutes[positions], cand_dist, cand_prof))
+        cand_prof, positions, cand_dist = cand_prof[ranking], positions[ranking], cand_dist[ranking]
+        first = np.r_[0, np.flatnonzero(np.diff(cand_prof)) + 1]
+        rank = np.arange(len(cand_prof)) - np.repeat(first, np.diff(np.r_[first, len(cand_prof)]))
+        keep = rank < top_k
+
+        shift_rows = self.shifts.iloc[self.order[positions[keep]]]
+        result = pd.DataFrame({
+            'professional_id': pros['professional_id'].to_numpy()[cand_prof[keep]],
+            'rank': rank[keep] + 1,
+            'shift_id': shift_rows['id'].to_numpy(),
+            'facility_id': shift_rows['facility_id'].astype(str).to_numpy(),
+            'facility_name': self.facility_index.names[self.facility_positions[positions[keep]]],
+            'distance_km': np.round(cand_dist[keep], 2),
+            'start_time_utc': pd.to_datetime(shift_rows['start_time_utc'], utc=True).to_numpy(),
+            'category': shift_rows['category'].astype(str).to_numpy(),
+            'specialization': shift_rows['specialization'].astype(str).to_numpy(),
+        })
+        return result
+
+    @staticmethod
+    def _empty_result():
+        return pd.DataFrame(columns=['professional_id', 'rank', 'shift_id', 'facility_id', 'facility_name',
+                                     'distance_km', 'start_time_utc', 'category', 'specialization'])
+
+
+def load_matcher(data_dir=DATA_DIR):
+    """Matcher over available_shifts.csv and the persisted facility spatial index"""
+    from repository import get_repository
+    from spatial_index import load_or_build
+    shifts = get_repository(data_dir).get('shifts', required=True)
+    return ShiftMatcher(shifts, load_or_build(data_dir))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Match professionals to nearby open shifts")
+    parser.add_argument('professionals', help="CSV with professional_id, latitude, longitude, category, ...")
+    parser.add_argument('--output', default=os.path.join(DATA_DIR, 'shift_matches.csv'))
+    parser.add_argument('--top-k', type=int, default=DEFAULT_TOP_K, help="Shifts to keep per professional")
+    parser.add_argument('--max-distance-km', type=float, default=DEFAULT_MAX_DISTANCE_KM,
+                        help="Radius used when the CSV has no max_distance_km")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    try:
+        matcher = load_matcher(args.data_dir)
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}")
+        return False
+    professionals = pd.read_csv(args.professionals)
+    matches = matcher.match(professionals, args.top_k, args.max_distance_km)
+    matches.to_csv(args.output, index=False, encoding='utf-8')
+    matched = matches['professional_id'].nunique()
+    logger.info(f"✅ {len(matches)} matches for {matched}/{len(professionals)} professionals saved to {args.output}")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,273 @@
+"""
+Run Metrics
+Lightweight instrumentation for the pipeline stages: wall time, peak RSS sampled
+in a background thread, and row counts in/out. Each run can be exported as a JSON
+file and as a Prometheus textfile-collector file. Setting FACILITY_MAP_PROFILE
+(a comma-separated list of stages, or "all") also profiles those stages with
+cProfile, or pyinstrument when FACILITY_MAP_PROFILER=pyinstrument.
+"""
+
+import functools
+import json
+import logging
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+logger = logging.getLogger(__name__)
+
+METRICS_DIR = os.getenv('FACILITY_MAP_METRICS_DIR', os.path.join('data', 'metrics'))
+PROMETHEUS_PREFIX = 'facility_map'
+
+
+def current_rss_bytes():
+    """Resident set size of this process (Linux /proc, psutil, or ru_maxrss as a fallback)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        pass
+    try:
+        import psutil
+        return psutil.Process().memory_info().rss
+    except ImportError:
+        pass
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    except ImportError:
+        return 0
+
+
+class _PeakSampler(threading.Thread):
+    """Samples RSS every interval seconds and keeps the maximum"""
+
+    def __init__(self, interval=0.05):
+        super().__init__(daemon=True)
+        self.interval = interval
+        self.peak = current_rss_bytes()
+        self._stop_event = threading.Event()
+
+    def run(self):
+        while not self._stop_event.wait(self.interval):
+            self.peak = max(self.peak, current_rss_bytes())
+
+    def stop(self):
+        self._stop_event.set()
+        self.join()
+        self.peak = max(self.peak, current_rss_bytes())
+        return self.peak
+
+
+class StageRecord:
+    """Measurements of one stage execution; set rows_in / rows_out from inside the stage"""
+
+    def __init__(self, name, rows_in=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.status = 'ok'
+        self.seconds = 0.0
+        self.peak_rss_bytes = 0
+        self.started_at = datetime.now(timezone.utc).isoformat()
+
+    def to_dict(self):
+        return {
+            'stage': self.name,
+            'status': self.status,
+            'seconds': round(self.seconds, 4),
+            'peak_rss_mb': round(self.peak_rss_bytes / (1024 * 1024), 2),
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'started_at': self.started_at,
+        }
+
+
+def _profiled_stages():
+    value = os.getenv('FACILITY_MAP_PROFILE', '')
+    return {s.strip() for s in value.split(',') if s.strip()}
+
+
+@contextmanager
+def _maybe_profile(name, output_dir):
+    """Profile the block with cProfile / pyinstrument when the stage is listed in FACILITY_MAP_PROFILE"""
+    stages = _profiled_stages()
+    if not stages or ('all' not in stages and name not in stages):
+        yield
+        return
+
+    profile_dir = os.path.join(output_dir, 'profiles')
+    os.makedirs(profile_dir, exist_ok=True)
+    if os.getenv('FACILITY_MAP_PROFILER', 'cprofile') == 'pyinstrument':
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            logger.warning("⚠️ pyinstrument not installed, falling back to cProfile")
+        else:
+            profiler = Profiler()
+            profiler.start()
+            try:
+                yield
+            finally:
+                profiler.stop()
+                path = os.path.join(profile_dir, f'{name}.html')
+                with open(path, 'w', encoding='utf-8') as f:
+                    f.write(profiler.output_html())
+                logger.info(f"🔬 Profile for {name} written to {path}")
+            return
+
+    import cProfile
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        path = os.path.join(profile_dir, f'{name}.prof')
+        profiler.dump_stats(path)
+        logger.info(f"🔬 Profile for {name} written to {path} (view with: python -m pstats {path})")
+
+
+class MetricsCollector:
+    """Collects StageRecords for one run and exports them"""
+
+    def __init__(self, run_name='facility_map', output_dir=METRICS_DIR):
+        self.run_name = run_name
+        self.output_dir = output_dir
+        self.records = []
+        self.started_at = datetime.now(timezone.utc)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def stage(self, name, rows_in=None):
+        """Time a block: `with collector.stage('geocode', rows_in=n) as rec: ...; rec.rows_out = m`"""
+        record = StageRecord(name, rows_in)
+        sampler = _PeakSampler()
+        sampler.start()
+        start = time.perf_counter()
+        try:
+            with _maybe_profile(name, self.output_dir):
+                yield record
+        except BaseException:
+            record.status = 'error'
+            raise
+        finally:
+            record.seconds = time.perf_counter() - start
+            record.peak_rss_bytes = sampler.stop()
+            with self._lock:
+                self.records.append(record)
+            logger.debug(f"⏱️ {name}: {record.seconds:.3f}s, peak RSS {record.peak_rss_bytes / 1e6:.1f} MB")
+
+    def instrument(self, name, rows_in_arg=None):
+        """Decorator version of stage(); rows_out is taken from len(result) when possible"""
+        def decorator(func):
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                rows_in = None
+                if rows_in_arg is not None and len(args) > rows_in_arg:
+                    rows_in = _count_rows(args[rows_in_arg])
+                with self.stage(name, rows_in) as record:
+                    result = func(*args, **kwargs)
+                    record.rows_out = _count_rows(result)
+                    if result is False:
+                        record.status = 'failed'
+                    return result
+            return wrapper
+        return decorator
+
+    def to_dict(self):
+        with self._lock:
+            stages = [r.to_dict() for r in self.records]
+        return {
+            'run': self.run_name,
+            'started_at': self.started_at.isoformat(),
+            'written_at': datetime.now(timezone.utc).isoformat(),
+            'stages': stages,
+        }
+
+    def to_prometheus(self):
+        """Render the latest record of each stage in Prometheus text exposition format"""
+        latest = {}
+        with self._lock:
+            for record in self.records:
+                latest[record.name] = record
+        metrics = [
+            ('stage_duration_seconds', 'Wall time of the last run of each stage', lambda r: r.seconds),
+            ('stage_peak_rss_bytes', 'Peak resident memory sampled during the stage', lambda r: r.peak_rss_bytes),
+            ('stage_rows_in', 'Rows consumed by the stage', lambda r: r.rows_in),
+            ('stage_rows_out', 'Rows produced by the stage', lambda r: r.rows_out),
+            ('stage_success', '1 if the stage finished without error', lambda r: 1 if r.status == 'ok' else 0),
+        ]
+        lines = []
+        for suffix, help_text, getter in metrics:
+            name = f'{PROMETHEUS_PREFIX}_{suffix}'
+            lines.append(f'# HELP {name} {help_text}')
+            lines.append(f'# TYPE {name} gauge')
+            for record in latest.values():
+                value = getter(record)
+                if value is not None:
+                    lines.append(f'{name}{{run="{self.run_name}",stage="{record.name}"}} {value}')
+        name = f'{PROMETHEUS_PREFIX}_last_run_timestamp_seconds'
+        lines.append(f'# HELP {name} Unix time when the metrics were written')
+        lines.append(f'# TYPE {name} gauge')
+        lines.append(f'{name}{{run="{self.run_name}"}} {time.time():.0f}')
+        return '\n'.join(lines) + '\n'
+
+    def write(self, output_dir=None):
+        """Write <run>_metrics.json and <run>.prom atomically; returns the two paths"""
+        output_dir = output_dir or self.output_dir
+        os.makedirs(output_dir, exist_ok=True)
+        json_path = os.path.join(output_dir, f'{self.run_name}_metrics.json')
+        prom_path = os.path.join(output_dir, f'{self.run_name}.prom')
+        _atomic_write(json_path, json.dumps(self.to_dict(), indent=2))
+        _atomic_write(prom_path, self.to_prometheus())
+        logger.info(f"📈 Metrics written to {json_path} and {prom_path}")
+        return json_path, prom_path
+
+
+def _count_rows(value):
+    if value is None or isinstance(value, (bool, str, bytes)):
+        return None
+    try:
+        return len(value)
+    except TypeError:
+        return None
+
+
+def _atomic_write(path, content):
+    # The textfile collector may read at any time: write to a temp file and rename
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        f.write(content)
+    os.replace(tmp_path, path)
+
+
+_default_collector = MetricsCollector()
+
+
+def get_collector():
+    """Process-wide collector shared by all scripts"""
+    return _default_collector
+
+
+def track_stage(name, rows_in=None):
+    """Context manager on the process-wide collector"""
+    return _default_collector.stage(name, rows_in)
+
+
+def instrumented(name, rows_in_arg=None):
+    """Decorator on the process-wide collector"""
+    return _default_collector.instrument(name, rows_in_arg)
+
+
+def write_metrics(output_dir=None):
+    """Export the process-wide collector (skipped when nothing was recorded)"""
+    if not _default_collector.records:
+        return None
+    try:
+        return _default_collector.write(output_dir)
+    except OSError as e:
+        logger.warning(f"⚠️ Could not write metrics: {e}")
+        return None
@@ -0,0 +1,176 @@
+"""
+Facility Name Matching
+Normalizes facility names (accents, abbreviations, punctuation) and matches them
+against a reference list using a trigram inverted index for candidate generation.
+"""
+
+import re
+import unicodedata
+from collections import defaultdict
+
+# Abreviaturas habituales en los nombres de centros sanitarios
+ABBREVIATIONS = {
+    'h': 'hospital',
+    'hosp': 'hospital',
+    'hu': 'hospital universitario',
+    'u': 'universitario',
+    'univ': 'universitario',
+    'clin': 'clinica',
+    'cl': 'clinica',
+    'fund': 'fundacion',
+    'fundacio': 'fundacion',
+    'gral': 'general',
+    'sta': 'santa',
+    'sto': 'santo',
+    'ntra': 'nuestra',
+    'sra': 'senora',
+    'dr': 'doctor',
+    'resid': 'residencia',
+    'hospitalaries': 'hospitalarias',
+    'cs': 'centro salud',
+}
+
+# Palabras sin valor discriminante (castellano y catalán)
+STOPWORDS = {'de', 'del', 'la', 'el', 'los', 'las', 'y', 'i', 'd', 'l', 'en'}
+
+# Numerales romanos (I..XXXIX): "Residencia Santa Maria I" != "Residencia Santa Maria II"
+ROMAN_NUMERAL = re.compile(r'^(?=[ivx])x{0,3}(ix|iv|v?i{0,3})$')
+ROMAN_VALUES = {'i': 1, 'v': 5, 'x': 10}
+
+# Sufijos societarios que no forman parte del nombre del centro
+LEGAL_SUFFIXES = {'sl', 'slp', 'slu', 'sa', 'sau', 'scp'}
+
+
+def normalize_facility_name(name):
+    """Normalize a facility name for matching: lowercase, no accents, no punctuation, expanded abbreviations"""
+    if name is None:
+        return ''
+    text = str(name)
+    if text.lower() == 'nan':
+        return ''
+
+    # Quitar acentos y diacríticos (é -> e, ñ -> n, l·l -> ll)
+    text = unicodedata.normalize('NFKD', text.lower())
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    text = text.replace('·', '')
+
+    # "S.L.P." / "S,L." -> "slp" / "sl" antes de eliminar la puntuación
+    text = re.sub(r'\b([a-z])[.,](?=[a-z][.,]?\b)', r'\1', text)
+
+    tokens = [token for token in re.split(r'[^a-z0-9]+', text) if token]
+    normalized = []
+    for position, token in enumerate(tokens):
+        # "i" es la conjunción catalana salvo como último token, donde es un numeral ("... Maria I")
+        if token in STOPWORDS and not (position == len(tokens) - 1 and position > 0 and ROMAN_NUMERAL.match(token)):
+            continue
+        if token in LEGAL_SUFFIXES:
+            continue
+        normalized.extend(ABBREVIATIONS.get(token, token).split())
+    return ' '.join(normalized)
+
+
+def name_trigrams(normalized_name):
+    """Return the set of character trigrams of an already normalized name"""
+    padded = f"  {normalized_name} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def roman_to_int(token):
+    """Value of a lowercase roman numeral token ("iv" -> 4)"""
+    values = [ROMAN_VALUES[ch] for ch in token]
+    return sum(-value if value < following else value for value, following in zip(values, values[1:] + [0]))
+
+
+def name_numbers(normalized_name):
+    """Return the numeric tokens of a normalized name, roman numerals as digits ("CAP Nova Lloreda 8" != "CAP Nova Lloreda 10")"""
+    return frozenset(str(roman_to_int(token)) if ROMAN_NUMERAL.match(token) else token
+                     for token in normalized_name.split() if token.isdigit() or ROMAN_NUMERAL.match(token))
+
+
+class FacilityNameIndex:
+    """Inverted trigram index to match facility names against a reference list"""
+
+    def __init__(self, names=None, keys=None, min_score=0.9, max_candidates=20, max_posting_ratio=0.1):
+        self.min_score = min_score
+        self.max_candidates = max_candidates
+        self.max_posting_ratio = max_posting_ratio
+
+        self.keys = []
+        self.normalized = []
+        self.trigrams = []
+        self.numbers = []
+        self.exact = {}
+        self.postings = defaultdict(list)
+
+        if names is not None:
+            names = list(names)
+            keys = list(keys) if keys is not None else names
+            for name, key in zip(names, keys):
+                self.add(name, key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, name):
+        return self.lookup(name) is not None
+
+    def add(self, name, key=None):
+        """Add a reference name; the first entry wins when two names normalize to the same text"""
+        normalized = normalize_facility_name(name)
+        if not normalized or normalized in self.exact:
+            return
+        position = len(self.keys)
+        grams = name_trigrams(normalized)
+        self.keys.append(name if key is None else key)
+        self.normalized.append(normalized)
+        self.trigrams.append(grams)
+        self.numbers.append(name_numbers(normalized))
+        self.exact[normalized] = position
+        for gram in grams:
+            self.postings[gram].append(position)
+
+    def _candidates(self, grams):
+        """Count shared trigrams per reference name, skipping overly common trigrams when possible"""
+        max_posting = max(50, int(len(self.keys) * self.max_posting_ratio))
+        selective = [g for g in grams if g in self.postings and len(self.postings[g]) <= max_posting]
+        if not selective:
+            selective = [g for g in grams if g in self.postings]
+
+        counts = defaultdict(int)
+        for gram in selective:
+            for position in self.postings[gram]:
+                counts[position] += 1
+        return sorted(counts, key=counts.get, reverse=True)[:self.max_candidates]
+
+    def match(self, name):
+        """Return (key, score) of the best reference match; key is None when the score is below min_score"""
+        normalized = normalize_facility_name(name)
+        if not normalized:
+            return None, 0.0
+
+        position = self.exact.get(normalized)
+        if position is not None:
+            return self.keys[position], 1.0
+
+        grams = name_trigrams(normalized)
+        numbers = name_numbers(normalized)
+        best_position, best_score = None, 0.0
+        for position in self._candidates(grams):
+            if self.numbers[position] != numbers:
+                continue
+            candidate = self.trigrams[position]
+            score = 2.0 * len(grams & candidate) / (len(grams) + len(candidate))
+            if score > best_score:
+                best_position, best_score = position, score
+
+        if best_position is None or best_score < self.min_score:
+            return None, best_score
+        return self.keys[best_position], best_score
+
+    def lookup(self, name):
+        """Return the key of the best reference match or None"""
+        return self.match(name)[0]
+
+    def match_many(self, names):
+        """Match a sequence of names, returning a list of (key, score) tuples"""
+        return [self.match(name) for name in names]
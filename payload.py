@@ -0,0 +1,504 @@
+#!/usr/bin/env python3
+"""
+Facility Map Payload
+Columnar format for the data embedded in the map. Instead of a list of facility
+dicts (every key and every formatted date repeated per facility and per shift) the
+payload holds parallel arrays per table (facilities, shifts, offers), categorical
+strings (city, logo, category, specialization, ...) as integer codes into shared
+dictionaries, and shift times as epoch minutes relative to 'base' that the page
+formats in Europe/Madrid itself. DECODER_JS rebuilds the facility objects the map
+uses. The payload is strict JSON (no NaN), so the page reads it with JSON.parse.
+"""
+
+import argparse
+import gzip
+import itertools
+import json
+import logging
+import time
+
+import numpy as np
+import pandas as pd
+
+from repository import clean_facility_id, factorize_facility_ids, format_datetime_madrid, get_facility_logo
+from shift_intervals import to_epoch_minutes
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+PAYLOAD_VERSION = 1
+JOB_DESCRIPTION_CHARS = 100
+# Valores por trozo al escribir cada array (acota la memoria de serialización)
+CHUNK_ROWS = 50_000
+
+# Decodificador del lado del cliente: payload columnar -> objetos de facility como los del formato por filas
+DECODER_JS = '''
+        const MONTHS = ['Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun', 'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec'];
+        const madridParts = new Intl.DateTimeFormat('en-US', { timeZone: 'Europe/Madrid', year: 'numeric', month: 'numeric', day: 'numeric', hour: 'numeric', minute: 'numeric', hourCycle: 'h23' });
+        function pad2(value) {
+            return String(value).padStart(2, '0');
+        }
+        // Minutos epoch -> "17 Jul 2025, 15:00 (CEST)", igual que format_datetime_madrid
+        function formatMadrid(minutes) {
+            if (minutes === null || minutes === undefined) return 'N/A';
+            const ms = minutes * 60000;
+            const p = {};
+            madridParts.formatToParts(new Date(ms)).forEach(part => { p[part.type] = part.value; });
+            const offset = (Date.UTC(+p.year, p.month - 1, +p.day, +p.hour, +p.minute) - ms) / 60000;
+            return pad2(p.day) + ' ' + MONTHS[p.month - 1] + ' ' + p.year + ', ' + pad2(p.hour) + ':' + pad2(p.minute) + ' (' + (offset === 120 ? 'CEST' : 'CET') + ')';
+        }
+        function decodeFacilityPayload(payload) {
+            const dict = payload.dictionaries;
+            const lookup = (values, code) => code < 0 ? null : values[code];
+            const minutes = value => value === null ? null : payload.base + value;
+            const f = payload.facilities;
+            const facilities = f.id.map((id, i) => ({
+                id: id, key: f.key[i] === null ? id : f.key[i], name: f.name[i], city: lookup(dict.city, f.city[i]), address: f.address[i],
+                latitude: f.latitude[i], longitude: f.longitude[i], logo_path: lookup(dict.logo, f.logo[i]),
+                shift_stats: { total: f.total[i], enf: f.enf[i], tcae: f.tcae[i], offers: f.offers[i] }
+            }));
+            // Turnos y ofertas apuntan a la primera fila de su facility_id y vienen ordenados por esa fila:
+            // cada facility es un rango contiguo que se decodifica al primer acceso (p. ej. al abrir su popup)
+            const ranges = rows => {
+                const first = {}, end = {};
+                for (let i = 0; i < rows.length; i++) {
+                    if (!(rows[i] in first)) first[rows[i]] = i;
+                    end[rows[i]] = i + 1;
+                }
+                return { first: first, end: end };
+            };
+            const lazyList = (fac, key, owner, range, build) => {
+                let items = null;
+                Object.defineProperty(fac, key, { enumerable: true, get: () => {
+                    if (items === null) {
+                        items = [];
+                        for (let i = range.first[owner]; i < range.end[owner]; i++) items.push(build(i));
+                    }
+                    return items;
+                } });
+            };
+            const s = payload.shifts;
+            const o = payload.offers;
+            const shiftRanges = ranges(s.facility);
+            const offerRanges = ranges(o.facility);
+            const firstRow = {};
+            facilities.forEach((fac, i) => {
+                if (!(fac.id in firstRow)) firstRow[fac.id] = i;
+                lazyList(fac, 'shifts', firstRow[fac.id], shiftRanges, i => ({
+                    shift_id: s.id[i], start: minutes(s.start[i]), finish: minutes(s.finish[i]),
+                    specialization: lookup(dict.specialization, s.specialization[i]),
+                    category: lookup(dict.category, s.category[i]), capacity: s.capacity[i]
+                }));
+                lazyList(fac, 'offers', firstRow[fac.id], offerRanges, i => ({
+                    offer_id: o.id[i], external_id: o.external_id[i], category: lookup(dict.category, o.category[i]),
+                    skill: lookup(dict.skill, o.skill[i]), contract_type: lookup(dict.contract_type, o.contract_type[i]),
+                    salary_min: o.salary_min[i], salary_max: o.salary_max[i],
+                    salary_period: lookup(dict.salary_period, o.salary_period[i]), start_date: o.start_date[i],
+                    status: lookup(dict.status, o.status[i]), job_description: o.job_description[i]
+                }));
+            });
+            return facilities;
+        }
+'''
+
+
+def _column(df, names, default=''):
+    """First existing column of names (like row.get(a, row.get(b, default)) on every row)"""
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def _values(series):
+    """Column values with NaN/NaT -> None (keeps the JSON strict); an array when nothing is missing"""
+    missing = series.isna().to_numpy()
+    if not missing.any():
+        return series.to_numpy()
+    return [None if m else value for value, m in zip(series.tolist(), missing)]
+
+
+def _strings(series):
+    """str(value) on every row, NaN -> 'nan' like the row format"""
+    return series.astype(object).fillna('nan').astype(str)
+
+
+def _job_descriptions(values):
+    descriptions = _strings(values)
+    return (descriptions.str.slice(0, JOB_DESCRIPTION_CHARS)
+            + np.where(descriptions.str.len() > JOB_DESCRIPTION_CHARS, '...', '')).to_numpy()
+
+
+def _datetimes(series):
+    """UTC datetimes of a start/finish column, parsed only if the loader did not already"""
+    if isinstance(series.dtype, pd.DatetimeTZDtype):
+        return series
+    return pd.Series(pd.to_datetime(series, utc=True, errors='coerce', format='mixed'), index=series.index)
+
+
+def _relative_minutes(minutes, base):
+    if (minutes >= 0).all():
+        return minutes - base
+    return [None if m < 0 else m - base for m in minutes.tolist()]
+
+
+class _Dictionaries:
+    """Shared string dictionaries: each encoded column becomes integer codes (-1 = missing)"""
+
+    def __init__(self):
+        self.values = {}
+        self._positions = {}
+
+    def encode(self, name, series):
+        values = self.values.setdefault(name, [])
+        positions = self._positions.setdefault(name, {})
+        codes, uniques = pd.factorize(pd.Series(series, dtype=object))
+        mapping = np.empty(len(uniques), dtype=np.int64)
+        for i, value in enumerate(uniques):
+            if value not in positions:
+                positions[value] = len(values)
+                values.append(value)
+            mapping[i] = positions[value]
+        if not len(mapping):
+            return np.full(len(codes), -1, dtype=np.int64)
+        return np.where(codes < 0, -1, mapping[codes])
+
+
+def _facility_rows(frame, facility_ids):
+    """Row of the first facility with each frame row's facility_id (-1 if the facility is not on the map)"""
+    first_row = {}
+    for row, facility_id in enumerate(facility_ids):
+        first_row.setdefault(facility_id, row)
+    codes, labels = factorize_facility_ids(frame['facility_id'])
+    rows = np.array([first_row.get(label, -1) for label in labels], dtype=np.int64)
+    return rows[codes] if len(codes) else np.empty(0, dtype=np.int64)
+
+
+def _rows_in_facility_order(frame, facility_ids):
+    """(frame, positions of its rows on the map sorted by facility row, their facility rows); stable within a facility"""
+    frame = frame if frame is not None and not frame.empty else pd.DataFrame(columns=['facility_id'])
+    rows = _facility_rows(frame, facility_ids)
+    order = np.flatnonzero(rows >= 0)
+    order = order[np.argsort(rows[order], kind='stable')]
+    return frame, order, rows[order]
+
+
+class FacilityPayload:
+    """Columnar map payload produced column by column (and shifts/offers in row chunks) so it is never held whole"""
+
+    def __init__(self, facilities_df, shifts_df, offers_df=None, stats=None, chunk_rows=None):
+        self.chunk_rows = chunk_rows or CHUNK_ROWS
+        facilities = facilities_df.reset_index(drop=True)
+        if 'facility_id' in facilities.columns:
+            codes, labels = factorize_facility_ids(facilities['facility_id'])
+            ids = labels.to_numpy()[codes]
+        else:
+            ids = np.array([clean_facility_id(v) for v in _column(facilities, ['nombre_original'])], dtype=object)
+        latitude = _column(facilities, ['latitud_corregida', 'latitude'], 0)
+        longitude = _column(facilities, ['longitud_corregida', 'longitude'], 0)
+        self._latitude = pd.to_numeric(latitude, errors='coerce')
+        self._longitude = pd.to_numeric(longitude, errors='coerce')
+        # Como float() en el formato por filas: coordenadas no numéricas descartan la fila
+        valid = ~((self._latitude.isna() & latitude.notna()) | (self._longitude.isna() & longitude.notna())).to_numpy()
+        if not valid.all():
+            logger.warning(f"⚠️ {int((~valid).sum())} facility rows with non-numeric coordinates skipped")
+        self._facilities = facilities[valid].reset_index(drop=True)
+        self._latitude = self._latitude[valid].reset_index(drop=True)
+        self._longitude = self._longitude[valid].reset_index(drop=True)
+        self.facility_ids = ids[valid]
+        # Clave única de cada fila: el id limpio o, sin id, nombre_original (como fac_id en server.MapModel)
+        names = _strings(_column(self._facilities, ['nombre_original'])).to_numpy()
+        self.facility_keys = np.where(self.facility_ids == '', names, self.facility_ids)
+        self._shifts, self._offers, self._stats = shifts_df, offers_df, stats
+
+    def __len__(self):
+        return len(self.facility_ids)
+
+    def _chunks(self, series, order, convert):
+        """convert(values) for consecutive chunks of the ordered rows: a column never exists whole in memory"""
+        for i in range(0, len(order), self.chunk_rows):
+            yield convert(series.iloc[order[i:i + self.chunk_rows]])
+
+    def columns(self, dictionaries=None):
+        """Yield (table, column, values) in output order; values are arrays/lists or generators of chunks, table None = top-level key"""
+        dictionaries = dictionaries or _Dictionaries()
+        facilities, ids = self._facilities, self.facility_ids
+        yield None, 'version', PAYLOAD_VERSION
+
+        names = _strings(_column(facilities, ['nombre_correcto', 'facility_name'], 'N/A'))
+        name_codes, unique_names = pd.factorize(names)
+        logos = np.array([get_facility_logo(name) for name in unique_names], dtype=object)
+        stats = self._stats if self._stats is not None else pd.DataFrame(columns=['total', 'enf', 'tcae', 'offers'])
+        stats = stats.reindex(pd.Index(ids, dtype=object)).fillna(0).astype(np.int64)
+        yield 'facilities', 'id', ids
+        # Solo las filas sin id llevan clave propia (null = la clave es el id)
+        yield 'facilities', 'key', [None if key == fac_id else key for key, fac_id in zip(self.facility_keys, ids)]
+        yield 'facilities', 'name', names.to_numpy()
+        yield 'facilities', 'city', dictionaries.encode('city', _strings(_column(facilities, ['ciudad', 'city'], 'N/A')))
+        yield 'facilities', 'address', _strings(_column(facilities, ['direccion', 'address'], 'N/A')).to_numpy()
+        yield 'facilities', 'latitude', _values(self._latitude)
+        yield 'facilities', 'longitude', _values(self._longitude)
+        yield 'facilities', 'logo', dictionaries.encode('logo', logos[name_codes] if len(name_codes) else [])
+        for stat in ('total', 'enf', 'tcae', 'offers'):
+            yield 'facilities', stat, stats[stat].to_numpy()
+
+        # Turnos ordenados por fila de facility (estable: conserva el orden original dentro de cada una)
+        shifts, order, rows = _rows_in_facility_order(self._shifts, ids)
+        starts = _datetimes(_column(shifts, ['start_time_utc'], None))
+        finishes = _datetimes(_column(shifts, ['finish_time_utc'], None))
+        # 'base' va antes que los turnos: el mínimo se toma sobre las fechas, que solo se convierten a minutos una vez
+        earliest = [part.min() for column in (starts, finishes) for part in self._chunks(column, order, lambda part: part)]
+        earliest = [value for value in earliest if not pd.isna(value)]
+        base = int(to_epoch_minutes([min(earliest)])[0]) if earliest else 0
+        relative = lambda values: _relative_minutes(to_epoch_minutes(values), base)
+        yield None, 'base', base
+        yield 'shifts', 'facility', rows
+        yield 'shifts', 'id', self._chunks(_column(shifts, ['id']), order, lambda part: _strings(part).to_numpy())
+        yield 'shifts', 'start', self._chunks(starts, order, relative)
+        yield 'shifts', 'finish', self._chunks(finishes, order, relative)
+        yield 'shifts', 'specialization', self._chunks(_column(shifts, ['specialization_display_text', 'specialization']),
+                                                       order, lambda part: dictionaries.encode('specialization', part))
+        yield 'shifts', 'category', self._chunks(_column(shifts, ['category']), order,
+                                                 lambda part: dictionaries.encode('category', part))
+        yield 'shifts', 'capacity', self._chunks(_column(shifts, ['capacity']), order, _values)
+
+        offers, order, rows = _rows_in_facility_order(self._offers, ids)
+        yield 'offers', 'facility', rows
+        for name in ('id', 'external_id'):
+            yield 'offers', name, self._chunks(_column(offers, [name]), order, lambda part: _strings(part).to_numpy())
+        for name in ('category', 'skill', 'contract_type', 'salary_period', 'status'):
+            yield 'offers', name, self._chunks(_column(offers, [name]), order,
+                                               lambda part, name=name: dictionaries.encode(name, part))
+        for name in ('salary_min', 'salary_max', 'start_date'):
+            yield 'offers', name, self._chunks(_column(offers, [name]), order, _values)
+        yield 'offers', 'job_description', self._chunks(_column(offers, ['job_description']), order, _job_descriptions)
+        # Los diccionarios se completan al codificar las columnas: van al final
+        yield None, 'dictionaries', dictionaries.values
+
+    def to_dict(self):
+        payload = {}
+        for table, name, values in self.columns():
+            if isinstance(values, (list, np.ndarray)):
+                values = _as_list(values)
+            elif not isinstance(values, (dict, int, float, str)):
+                values = [value for chunk in values for value in _as_list(chunk)]
+            if table is None:
+                payload[name] = values
+            else:
+                payload.setdefault(table, {})[name] = values
+        return payload
+
+    def write(self, f, chunk_rows=None):
+        write_json_columns(f, self.columns(), chunk_rows or self.chunk_rows)
+
+    def decoded_chunks(self):
+        """Yield (table, {column: values}) chunks of facilities, shifts and offers decoded like DECODER_JS
+        (strings instead of codes, epoch minutes, resolved keys); shifts and offers keep their facility row"""
+        dictionaries = _Dictionaries()
+        base, table, pending = 0, None, []
+        for name_table, name, values in itertools.chain(self.columns(dictionaries), [(None, None, None)]):
+            if table is not None and name_table != table:
+                yield from self._decode_table(table, pending, dictionaries, base)
+                pending = []
+            table = name_table
+            if name_table is None:
+                base = values if name == 'base' else base
+            else:
+                pending.append((name, values))
+
+    def _decode_table(self, table, columns, dictionaries, base):
+        # Las columnas enteras se trocean igual que los generadores de _chunks, así los trozos quedan alineados
+        chunked = [_slices(values, self.chunk_rows) if isinstance(values, (list, np.ndarray)) else values
+                   for _, values in columns]
+        for parts in zip(*chunked):
+            chunk = {}
+            for (name, _), part in zip(columns, parts):
+                part = _as_list(part)
+                if name in dictionaries.values:
+                    part = _decode(dictionaries.values[name], part)
+                elif name in ('start', 'finish'):
+                    part = [None if value is None else base + value for value in part]
+                chunk[name] = part
+            if table == 'facilities':
+                chunk['key'] = [fac_id if key is None else key for fac_id, key in zip(chunk['id'], chunk['key'])]
+            yield table, chunk
+
+
+def build_facility_payload(facilities_df, shifts_df, offers_df=None, stats=None):
+    """Columnar payload for the map as a dict; stats is a facility_stats() frame indexed by facility_id"""
+    return FacilityPayload(facilities_df, shifts_df, offers_df, stats).to_dict()
+
+
+def build_facility_records(facilities_df, shifts_df, offers_df=None, stats=None):
+    """Row format: one dict per facility with nested shift and offer dicts (the map's format before the columnar payload)"""
+    stats_by_fac = {} if stats is None else stats.to_dict('index')
+    shifts_by_fac = shifts_df.groupby('facility_id') if shifts_df is not None and not shifts_df.empty else {}
+    offers_by_fac = offers_df.groupby('facility_id') if offers_df is not None and not offers_df.empty else {}
+    facilities_data = []
+    for _, row in facilities_df.iterrows():
+        fac_id = clean_facility_id(row.get('facility_id', row.get('nombre_original', '')))
+        fac_shifts = shifts_by_fac.get_group(fac_id) if fac_id in getattr(shifts_by_fac, 'groups', {}) else None
+        fac_offers = offers_by_fac.get_group(fac_id) if fac_id in getattr(offers_by_fac, 'groups', {}) else None
+        try:
+            shift_stats = {'total': 0, 'enf': 0, 'tcae': 0, 'offers': 0}
+            shift_stats.update(stats_by_fac.get(fac_id, {}))
+            shifts_list = []
+            offers_list = []
+            if fac_shifts is not None and not fac_shifts.empty:
+                shifts_list = [
+                    {
+                        'shift_id': str(s.get('id', '')),
+                        'start_time': format_datetime_madrid(s.get('start_time_utc', '')),
+                        'finish_time': format_datetime_madrid(s.get('finish_time_utc', '')),
+                        'specialization': s.get('specialization_display_text', s.get('specialization', '')),
+                        'category': s.get('category', ''),
+                        'capacity': s.get('capacity', ''),
+                    }
+                    for _, s in fac_shifts.iterrows()
+                ]
+            if fac_offers is not None and not fac_offers.empty:
+                offers_list = [
+                    {
+                        'offer_id': str(o.get('id', '')),
+                        'external_id': str(o.get('external_id', '')),
+                        'category': o.get('category', ''),
+                        'skill': o.get('skill', ''),
+                        'contract_type': o.get('contract_type', ''),
+                        'salary_min': o.get('salary_min', ''),
+                        'salary_max': o.get('salary_max', ''),
+                        'salary_period': o.get('salary_period', ''),
+                        'start_date': o.get('start_date', ''),
+                        'status': o.get('status', ''),
+                        'job_description': str(o.get('job_description', ''))[:100] + ('...' if len(str(o.get('job_description', ''))) > 100 else ''),
+                    }
+                    for _, o in fac_offers.iterrows()
+                ]
+            facility_name = str(row.get('nombre_correcto', row.get('facility_name', 'N/A')))
+            facilities_data.append({
+                'id': fac_id,
+                'name': facility_name,
+                'city': str(row.get('ciudad', row.get('city', 'N/A'))),
+                'address': str(row.get('direccion', row.get('address', 'N/A'))),
+                'latitude': float(row.get('latitud_corregida', row.get('latitude', 0))),
+                'longitude': float(row.get('longitud_corregida', row.get('longitude', 0))),
+                'logo_path': get_facility_logo(facility_name),
+                'shift_stats': shift_stats,
+                'shifts': shifts_list,
+                'offers': offers_list
+            })
+        except Exception as e:
+            logger.warning(f"⚠️ Error processing facility row: {e}")
+            continue
+    return facilities_data
+
+
+def to_json(payload):
+    """Compact strict JSON, safe to embed inside a <script> element"""
+    return json.dumps(payload, ensure_ascii=False, separators=(',', ':'), allow_nan=False).replace('</', '<\\/')
+
+
+def _slices(values, chunk_rows):
+    return (values[i:i + chunk_rows] for i in range(0, len(values), chunk_rows))
+
+
+def _decode(values, codes):
+    """Dictionary codes -> values, -1 -> None"""
+    return [None if code < 0 else values[code] for code in codes]
+
+
+def _as_list(values):
+    return values.tolist() if isinstance(values, np.ndarray) else list(values)
+
+
+def _write_array(f, chunks):
+    f.write('[')
+    first = True
+    for chunk in chunks:
+        if len(chunk):
+            f.write(('' if first else ',') + to_json(_as_list(chunk))[1:-1])
+            first = False
+    f.write(']')
+
+
+def write_json_columns(f, columns, chunk_rows=None):
+    """Write (table, column, values) items as one JSON object; arrays go out chunk_rows values at a time, generators chunk by chunk"""
+    chunk_rows = chunk_rows or CHUNK_ROWS
+    f.write('{')
+    open_table, wrote_key, wrote_column = None, False, False
+    for table, name, values in columns:
+        if open_table is not None and table != open_table:
+            f.write('}')
+            open_table = None
+        if table is not None and open_table is None:
+            f.write((',' if wrote_key else '') + to_json(table) + ':{')
+            open_table, wrote_key, wrote_column = table, True, False
+        if table is None:
+            f.write((',' if wrote_key else '') + to_json(name) + ':')
+            wrote_key = True
+        else:
+            f.write((',' if wrote_column else '') + to_json(name) + ':')
+            wrote_column = True
+        if isinstance(values, (list, np.ndarray)):
+            _write_array(f, _slices(values, chunk_rows))
+        elif isinstance(values, (dict, int, float, str)):
+            f.write(to_json(values))
+        else:
+            _write_array(f, values)
+    if open_table is not None:
+        f.write('}')
+    f.write('}')
+
+
+def compare_formats(records, payload, repeats=3):
+    """Size (raw and gzip) and json.loads time of the row format vs the columnar payload"""
+    texts = {'rows': json.dumps(records, ensure_ascii=False), 'columnar': to_json(payload)}
+    result = {}
+    for name, text in texts.items():
+        data = text.encode('utf-8')
+        best = float('inf')
+        for _ in range(repeats):
+            start = time.perf_counter()
+            json.loads(text)
+            best = min(best, time.perf_counter() - start)
+        result[name] = {'bytes': len(data), 'gzip_bytes': len(gzip.compress(data, 6)), 'parse_seconds': best}
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Compare the row and columnar map payloads on the current data")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--output', help="Also write the columnar payload JSON to this file")
+    args = parser.parse_args(argv)
+
+    from demand_cube import DemandCube
+    from map import load_facilities_and_shifts
+    facilities_df, shifts_df, offers_df = load_facilities_and_shifts(args.data_dir)
+    if facilities_df is None:
+        return False
+    stats = DemandCube.from_frames(shifts_df, offers_df).facility_stats()
+    start = time.perf_counter()
+    records = build_facility_records(facilities_df, shifts_df, offers_df, stats)
+    rows_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    payload = build_facility_payload(facilities_df, shifts_df, offers_df, stats)
+    columnar_seconds = time.perf_counter() - start
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(to_json(payload))
+        logger.info(f"💾 Columnar payload saved to {args.output}")
+
+    comparison = compare_formats(records, payload)
+    comparison['rows']['build_seconds'] = rows_seconds
+    comparison['columnar']['build_seconds'] = columnar_seconds
+    for name, result in comparison.items():
+        print(f"{name:<9} {result['bytes'] / 1024:>9.1f} KB  gzip {result['gzip_bytes'] / 1024:>8.1f} KB  "
+              f"build {result['build_seconds'] * 1000:>8.1f} ms  json.loads {result['parse_seconds'] * 1000:>7.2f} ms")
+    ratio = comparison['columnar']['bytes'] / max(comparison['rows']['bytes'], 1)
+    logger.info(f"📦 Columnar payload is {ratio:.0%} of the row format")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
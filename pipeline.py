@@ -0,0 +1,300 @@
+#!/usr/bin/env python3
+"""
+Facility Map Pipeline
+Runs fetch -> process shifts / process offers / geocode -> build map as a DAG of
+stages with declared inputs and outputs. Independent stages run concurrently and
+stages whose inputs did not change since their last successful run are skipped.
+"""
+
+import argparse
+import hashlib
+import json
+import logging
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+STATE_FILE = os.path.join(DATA_DIR, '.pipeline_state.json')
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+class Stage:
+    """A pipeline step: a callable plus the files it reads and writes"""
+
+    def __init__(self, name, func, inputs=(), outputs=(), always_run=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.always_run = always_run
+
+
+# ---------------------------------------------------------------------------
+# Stage implementations (heavy modules are imported only when a stage runs)
+# ---------------------------------------------------------------------------
+
+def run_fetch():
+    import data
+    return data.main(process=False)
+
+
+def run_process_shifts():
+    from data import process_available_shifts
+    from repository import get_repository
+    raw_shifts = get_repository(DATA_DIR).get('raw_shifts')
+    if raw_shifts is None:
+        logger.warning("⚠️ No raw_shifts.csv found - keeping existing available_shifts.csv")
+        return True
+    return process_available_shifts(raw_shifts, DATA_DIR)
+
+
+def run_process_offers():
+    from data import process_available_offers
+    from repository import get_repository
+    raw_offers = get_repository(DATA_DIR).get('raw_offers')
+    if raw_offers is None:
+        logger.warning("⚠️ No raw_offers.csv found - keeping existing available_offers.csv")
+        return True
+    return process_available_offers(raw_offers, DATA_DIR)
+
+
+def run_geocode():
+    from coordinate_checker import CoordinateChecker
+    return CoordinateChecker().run_full_check()
+
+
+def run_spatial_index():
+    from spatial_index import load_or_build
+    return load_or_build(DATA_DIR, rebuild=True) is not None
+
+
+def run_demand_cube():
+    from demand_cube import build_cube
+    return build_cube(DATA_DIR) is not None
+
+
+def run_build_map():
+    import map as map_builder
+    return map_builder.main()
+
+
+def default_stages(fetch=False):
+    """The standard data.py -> coordinate_checker.py -> map.py workflow"""
+    d = lambda name: os.path.join(DATA_DIR, name)
+    code = lambda name: os.path.join(CODE_DIR, name)
+    return [
+        Stage('fetch', run_fetch,
+              inputs=[code('data.py')],
+              outputs=[d('raw_facilities.csv'), d('raw_shifts.csv'), d('raw_offers.csv')],
+              always_run=fetch),
+        Stage('process_shifts', run_process_shifts,
+              inputs=[code('data.py'), d('raw_shifts.csv')],
+              outputs=[d('available_shifts.csv')]),
+        Stage('process_offers', run_process_offers,
+              inputs=[code('data.py'), d('raw_offers.csv')],
+              outputs=[d('available_offers.csv')]),
+        Stage('geocode', run_geocode,
+              inputs=[code('coordinate_checker.py'), d('raw_facilities.csv'), d('facilities_corrected_coords.csv')],
+              outputs=[d('facility_master.db'), d('all_corrected_facilities.csv')]),
+        Stage('spatial_index', run_spatial_index,
+              inputs=[code('spatial_index.py'), d('facility_master.db'), d('all_corrected_facilities.csv')],
+              outputs=[d('spatial_index.npz')]),
+        Stage('demand_cube', run_demand_cube,
+              inputs=[code('demand_cube.py'), d('available_shifts.csv'), d('available_offers.csv')],
+              outputs=[d('demand_cube.npz')]),
+        Stage('build_map', run_build_map,
+              inputs=[code('map.py'), code('payload.py'), code('assets.py'), code('logo_sprites.py'),
+                      code('change_feed.py'), code('shift_intervals.py'), code('demand_cube.py'),
+                      code('engine.py'), code('repository.py'), code('expiry.py'),
+                      d('facility_master.db'), d('all_corrected_facilities.csv'),
+                      d('available_shifts.csv'), d('available_offers.csv')],
+              outputs=[os.path.join('public', 'index.html')]),
+    ]
+
+
+class Pipeline:
+    """Dependency-ordered, cached and concurrent execution of stages"""
+
+    def __init__(self, stages, state_file=STATE_FILE, max_workers=4, force=False):
+        self.stages = {stage.name: stage for stage in stages}
+        self.state_file = state_file
+        self.max_workers = max_workers
+        self.force = force
+        self.state = self._load_state()
+        self.hash_cache = self.state.get('_files', {})
+        self.dependencies = self._build_dependencies()
+
+    def _load_state(self):
+        if os.path.exists(self.state_file):
+            try:
+                with open(self.state_file, encoding='utf-8') as f:
+                    return json.load(f)
+            except Exception as e:
+                logger.warning(f"⚠️ Could not read pipeline state, running everything: {e}")
+        return {}
+
+    def _save_state(self):
+        self.state['_files'] = self.hash_cache
+        os.makedirs(os.path.dirname(self.state_file) or '.', exist_ok=True)
+        tmp_path = f"{self.state_file}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f, indent=2, sort_keys=True)
+        os.replace(tmp_path, self.state_file)
+
+    def _build_dependencies(self):
+        """A stage depends on every stage that writes one of its inputs"""
+        producers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                producers[output] = stage.name
+        dependencies = {}
+        for stage in self.stages.values():
+            dependencies[stage.name] = {producers[i] for i in stage.inputs
+                                        if i in producers and producers[i] != stage.name}
+        return dependencies
+
+    def file_hash(self, path):
+        """Content hash of a file, reusing the cached hash when size and mtime are unchanged"""
+        if not os.path.exists(path):
+            return None
+        stat = os.stat(path)
+        cached = self.hash_cache.get(path)
+        if cached and cached['size'] == stat.st_size and cached['mtime_ns'] == stat.st_mtime_ns:
+            return cached['sha1']
+        digest = hashlib.sha1()
+        with open(path, 'rb') as f:
+            for chunk in iter(lambda: f.read(1 << 20), b''):
+                digest.update(chunk)
+        self.hash_cache[path] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': digest.hexdigest()}
+        return digest.hexdigest()
+
+    def input_signature(self, stage):
+        return {path: self.file_hash(path) for path in stage.inputs}
+
+    def is_up_to_date(self, stage, signature):
+        if self.force or stage.always_run:
+            return False
+        previous = self.state.get(stage.name)
+        if not previous or previous.get('inputs') != signature:
+            return False
+        return all(os.path.exists(path) for path in previous.get('outputs', []))
+
+    def _execute(self, stage):
+        from metrics import track_stage
+        start = time.perf_counter()
+        try:
+            with track_stage(f'pipeline_{stage.name}') as record:
+                ok = bool(stage.func())
+                if not ok:
+                    record.status = 'failed'
+        except Exception as e:
+            logger.error(f"❌ Stage {stage.name} raised: {e}")
+            ok = False
+        return ok, time.perf_counter() - start
+
+    def run(self, only=None):
+        """Run the pipeline and return a dict stage -> {'status', 'seconds'}"""
+        selected = set(only) if only else set(self.stages)
+        report = {}
+        pending = {name for name in self.stages if name in selected}
+        done = set(self.stages) - pending
+        failed = set()
+        running = {}
+        run_start = time.perf_counter()
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            while pending or running:
+                # Lanzar (o saltar) todas las etapas cuyas dependencias ya terminaron;
+                # repetir mientras haya progreso, ya que saltar una etapa puede desbloquear otras
+                progress = True
+                while progress:
+                    progress = False
+                    for name in sorted(pending):
+                        deps = self.dependencies[name]
+                        if deps & failed:
+                            pending.discard(name)
+                            failed.add(name)
+                            progress = True
+                            report[name] = {'status': 'blocked', 'seconds': 0.0}
+                            logger.warning(f"⛔ {name}: blocked by failed upstream stage")
+                            continue
+                        if not deps <= done:
+                            continue
+                        pending.discard(name)
+                        progress = True
+                        stage = self.stages[name]
+                        signature = self.input_signature(stage)
+                        if self.is_up_to_date(stage, signature):
+                            done.add(name)
+                            report[name] = {'status': 'skipped', 'seconds': 0.0}
+                            logger.info(f"⏭️ {name}: inputs unchanged, skipping")
+                            continue
+                        logger.info(f"▶️ {name}: starting")
+                        running[executor.submit(self._execute, stage)] = (name, signature)
+
+                if not running:
+                    if pending:
+                        logger.error(f"❌ Unresolvable stage dependencies: {sorted(pending)}")
+                        for name in pending:
+                            report[name] = {'status': 'blocked', 'seconds': 0.0}
+                        pending.clear()
+                    continue
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    name, signature = running.pop(future)
+                    ok, seconds = future.result()
+                    stage = self.stages[name]
+                    if ok:
+                        done.add(name)
+                        self.state[name] = {
+                            'inputs': signature,
+                            'outputs': [p for p in stage.outputs if os.path.exists(p)],
+                            'seconds': round(seconds, 3),
+                            'finished_at': time.strftime('%Y-%m-%dT%H:%M:%S'),
+                        }
+                        self._save_state()
+                        report[name] = {'status': 'ran', 'seconds': seconds}
+                        logger.info(f"✅ {name}: finished in {seconds:.2f}s")
+                    else:
+                        failed.add(name)
+                        report[name] = {'status': 'failed', 'seconds': seconds}
+                        logger.error(f"❌ {name}: failed after {seconds:.2f}s")
+
+        total = time.perf_counter() - run_start
+        logger.info("📊 PIPELINE SUMMARY:")
+        for name in self.stages:
+            if name in report:
+                logger.info(f"   • {name:<15} {report[name]['status']:<8} {report[name]['seconds']:.2f}s")
+        logger.info(f"   • {'total':<15} {'':<8} {total:.2f}s")
+        self._save_state()
+        return report
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the facility map pipeline")
+    parser.add_argument('--fetch', action='store_true', help="Fetch fresh data from Metabase first")
+    parser.add_argument('--force', action='store_true', help="Run every stage even if its inputs are unchanged")
+    parser.add_argument('--only', help="Comma-separated list of stages to run")
+    parser.add_argument('--workers', type=int, default=4, help="Maximum number of concurrent stages")
+    args = parser.parse_args(argv)
+
+    pipeline = Pipeline(default_stages(fetch=args.fetch), max_workers=args.workers, force=args.force)
+    only = [s.strip() for s in args.only.split(',')] if args.only else None
+    if not args.fetch and not only:
+        # Sin --fetch, la etapa fetch sólo se ejecuta si faltan los datos en bruto
+        only = [name for name in pipeline.stages
+                if name != 'fetch' or not os.path.exists(os.path.join(DATA_DIR, 'raw_facilities.csv'))]
+    report = pipeline.run(only)
+    return all(r['status'] in ('ran', 'skipped') for r in report.values())
+
+
+if __name__ == "__main__":
+    success = main()
+    from metrics import write_metrics
+    write_metrics()
+    raise SystemExit(0 if success else 1)
@@ -0,0 +1,314 @@
+"""
+Facility Repository
+Shared in-memory access layer over the CSV / SQLite datasets in data/. Each dataset
+is parsed once with typed columns, indexed by id, normalized name and city, and
+reloaded automatically when its file changes on disk. Also holds the facility id,
+logo and date helpers shared by the map, payload and index modules.
+"""
+
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+from name_matching import normalize_facility_name
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_facility_ids(series):
+    """Vectorized clean_facility_id: string ids without trailing '.0', '' for missing values"""
+    cleaned = series.astype(object).where(series.notna(), '')
+    return cleaned.astype(str).str.strip().str.replace(r'\.0$', '', regex=True)
+
+
+def clean_facility_id(val):
+    """Convierte el facility_id a string sin decimales sobrantes."""
+    try:
+        if pd.isna(val):
+            return ''
+        val_str = str(val)
+        if val_str.endswith('.0'):
+            return val_str[:-2]
+        return val_str
+    except Exception:
+        return str(val)
+
+
+def factorize_facility_ids(values):
+    """(codes, labels) de facility_id limpios, aplicando clean_facility_id solo a los valores únicos"""
+    codes, uniques = pd.factorize(pd.Series(values), use_na_sentinel=False)
+    cleaned_codes, labels = pd.factorize(np.array([clean_facility_id(v) for v in uniques], dtype=object))
+    return cleaned_codes[codes], pd.Index(labels, dtype=object)
+
+
+# Define the 7 largest healthcare groups and their keywords
+GROUP_LOGOS = {
+    "quironsalud": "Grupo Quirónsalud.jpg",
+    "quirónsalud": "Grupo Quirónsalud.jpg",
+    "quiron": "Grupo Quirónsalud.jpg",
+    "quirón": "Grupo Quirónsalud.jpg",
+    
+    "hla": "Grupo HLA.png",
+    "grupo hla": "Grupo HLA.png",
+    
+    "fresenius": "Fresenius.png",
+    
+    "diaverum": "Diaverum.png",
+    
+    "colisee": "Colisee.png",
+    
+    "fundación hospitalarias": "FUNDACION HOSPITALARIAS.png",
+    "fundacion hospitalarias": "FUNDACION HOSPITALARIAS.png",
+    "hospitalarias": "FUNDACION HOSPITALARIAS.png",
+    
+    "grup mutuam": "Grup Mutuam.jpeg",
+    "mutuam": "Grup Mutuam.jpeg"
+}
+DEFAULT_LOGO = "logo.png"
+
+
+def get_facility_logo(facility_name):
+    """
+    Determine which logo to use based on facility name.
+    Returns the path to the appropriate logo image.
+    """
+    if not facility_name:
+        return DEFAULT_LOGO
+    
+    facility_name_lower = str(facility_name).lower()
+    
+    # Check if any group keyword is in the facility name
+    for keyword, logo_path in GROUP_LOGOS.items():
+        if keyword in facility_name_lower:
+            return logo_path
+    
+    # Default logo for other facilities
+    return DEFAULT_LOGO
+
+
+def format_datetime_madrid(utc_datetime_str):
+    """Convert UTC datetime to Madrid timezone and format user-friendly"""
+    try:
+        if pd.isna(utc_datetime_str):
+            return "N/A"
+        
+        # Parse UTC datetime
+        utc_dt = pd.to_datetime(utc_datetime_str, utc=True)
+        
+        # Convert to Madrid timezone
+        madrid_dt = utc_dt.tz_convert('Europe/Madrid')
+        
+        # Format user-friendly
+        formatted = madrid_dt.strftime("%d %b %Y, %H:%M")
+        timezone_name = madrid_dt.strftime("%Z")
+        
+        return f"{formatted} ({timezone_name})"
+    except Exception as e:
+        return str(utc_datetime_str)
+
+
+def standardize_columns(df):
+    """Lowercase column names and replace spaces with underscores"""
+    df.columns = df.columns.str.lower().str.replace(' ', '_')
+    return df
+
+
+def _load_raw_facilities(path):
+    df = pd.read_csv(path)
+    for col in ('address_latitude', 'address_longitude'):
+        if col in df.columns:
+            df[col] = pd.to_numeric(df[col], errors='coerce')
+    return df
+
+
+def _load_corrections(path):
+    df = pd.read_csv(path, sep=';')
+    df.columns = [c.strip() for c in df.columns]
+    return df
+
+
+def _load_corrected_facilities(path):
+    if path.endswith('.db'):
+        from facility_store import FacilityStore
+        store = FacilityStore(path)
+        try:
+            df = store.to_dataframe().drop(columns=['source'])
+        finally:
+            store.close()
+    else:
+        df = pd.read_csv(path, sep=';')
+    df = standardize_columns(df)
+    df['facility_id'] = normalize_facility_ids(df['facility_id'])
+    return df
+
+
+def _load_shifts(path):
+    df = standardize_columns(pd.read_csv(path))
+    df['facility_id'] = normalize_facility_ids(df['facility_id'])
+    for col in ('start_time_utc', 'finish_time_utc'):
+        if col in df.columns:
+            df[col] = pd.to_datetime(df[col], utc=True, errors='coerce', format='mixed')
+    for col in ('category', 'specialization', 'specialization_display_text'):
+        if col in df.columns:
+            df[col] = df[col].astype('category')
+    return df
+
+
+def _load_offers(path):
+    df = standardize_columns(pd.read_csv(path))
+    df['facility_id'] = normalize_facility_ids(df['facility_id'])
+    return df
+
+
+# Dataset name -> (candidate files in order of preference, loader)
+DATASETS = {
+    'raw_facilities': (['raw_facilities.csv'], _load_raw_facilities),
+    'corrections': (['facilities_corrected_coords.csv'], _load_corrections),
+    'corrected_facilities': (['facility_master.db', 'all_corrected_facilities.csv'], _load_corrected_facilities),
+    'shifts': (['available_shifts.csv'], _load_shifts),
+    'offers': (['available_offers.csv'], _load_offers),
+    'raw_shifts': (['raw_shifts.csv'], lambda path: pd.read_csv(path)),
+    'raw_offers': (['raw_offers.csv'], lambda path: pd.read_csv(path)),
+}
+
+# Columnas usadas para los índices por nombre y ciudad de cada dataset
+NAME_COLUMNS = {
+    'raw_facilities': 'name',
+    'corrections': 'Nombre_Original',
+    'corrected_facilities': 'nombre_original',
+}
+CITY_COLUMNS = {
+    'raw_facilities': 'address_city',
+    'corrections': 'Ciudad',
+    'corrected_facilities': 'ciudad',
+}
+ID_COLUMNS = {
+    'raw_facilities': 'id',
+    'corrected_facilities': 'facility_id',
+    'shifts': 'facility_id',
+    'offers': 'facility_id',
+}
+
+
+class FacilityRepository:
+    """Loads each dataset once and serves indexed queries over it"""
+
+    def __init__(self, data_dir='data'):
+        self.data_dir = data_dir
+        self._frames = {}
+        self._signatures = {}
+        self._indexes = {}
+
+    def path_for(self, name):
+        """Return the first existing file for a dataset, or None"""
+        files, _ = DATASETS[name]
+        for filename in files:
+            path = os.path.join(self.data_dir, filename)
+            if os.path.exists(path):
+                return path
+        return None
+
+    @staticmethod
+    def _signature(path):
+        if path is None:
+            return None
+        stat = os.stat(path)
+        return (path, stat.st_mtime_ns, stat.st_size)
+
+    def get(self, name, required=False):
+        """
+        Return the dataset as a DataFrame (shared, treat as read-only), or None when its file
+        does not exist. The file is re-parsed only if it changed since the last load.
+        """
+        path = self.path_for(name)
+        signature = self._signature(path)
+        if name in self._frames and self._signatures.get(name) == signature:
+            return self._frames[name]
+
+        self.invalidate(name)
+        if path is None:
+            if required:
+                raise FileNotFoundError(f"No file found for dataset '{name}' in {self.data_dir}")
+            return None
+
+        _, loader = DATASETS[name]
+        df = loader(path)
+        self._frames[name] = df
+        self._signatures[name] = signature
+        logger.info(f"📂 Repository loaded {name}: {len(df)} rows from {path}")
+        return df
+
+    def put(self, name, df):
+        """Register an in-memory DataFrame (e.g. just fetched and saved) so it is not re-read from disk"""
+        self.invalidate(name)
+        self._frames[name] = df
+        self._signatures[name] = self._signature(self.path_for(name))
+
+    def invalidate(self, name=None):
+        """Drop a cached dataset and its indexes (all datasets when name is None)"""
+        names = list(self._frames) if name is None else [name]
+        for dataset in names:
+            self._frames.pop(dataset, None)
+            self._signatures.pop(dataset, None)
+            for key in [k for k in self._indexes if k[0] == dataset]:
+                del self._indexes[key]
+
+    def index(self, name, kind):
+        """Return a dict mapping key -> row positions for kind in ('id', 'name', 'city')"""
+        df = self.get(name)
+        cache_key = (name, kind)
+        if cache_key in self._indexes:
+            return self._indexes[cache_key]
+        if df is None or df.empty:
+            return {}
+
+        if kind == 'id':
+            keys = normalize_facility_ids(df[ID_COLUMNS[name]])
+        elif kind == 'name':
+            keys = df[NAME_COLUMNS[name]].map(normalize_facility_name)
+        elif kind == 'city':
+            keys = df[CITY_COLUMNS[name]].fillna('').astype(str).str.strip().str.lower()
+        else:
+            raise ValueError(f"Unknown index kind: {kind}")
+
+        index = pd.Series(range(len(df))).groupby(keys.to_numpy(), sort=False).indices
+        self._indexes[cache_key] = index
+        return index
+
+    def _rows(self, name, kind, key):
+        positions = self.index(name, kind).get(key)
+        df = self.get(name)
+        if positions is None or df is None:
+            return df.iloc[0:0] if df is not None else pd.DataFrame()
+        return df.iloc[positions]
+
+    def by_id(self, name, facility_id):
+        """Rows of a dataset for one facility id"""
+        return self._rows(name, 'id', normalize_facility_ids(pd.Series([facility_id])).iloc[0])
+
+    def by_name(self, name, facility_name):
+        """Rows of a dataset whose normalized name matches"""
+        return self._rows(name, 'name', normalize_facility_name(facility_name))
+
+    def by_city(self, name, city):
+        """Rows of a dataset for one city (case-insensitive)"""
+        return self._rows(name, 'city', str(city).strip().lower())
+
+    def shifts_for_facility(self, facility_id):
+        return self.by_id('shifts', facility_id)
+
+    def offers_for_facility(self, facility_id):
+        return self.by_id('offers', facility_id)
+
+
+_repositories = {}
+
+
+def get_repository(data_dir='data'):
+    """Return the process-wide repository for a data directory"""
+    key = os.path.abspath(data_dir)
+    if key not in _repositories:
+        _repositories[key] = FacilityRepository(data_dir)
+    return _repositories[key]
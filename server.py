@@ -0,0 +1,446 @@
+#!/usr/bin/env python3
+"""
+Local Map Server
+Serves the public/ assets and a JSON query API answered from an in-memory model
+of facilities, shifts and offers (reloaded when the data files change and, once a
+minute at most, when one of its shifts starts):
+
+    GET /api/facilities?bbox=west,south,east,north&category=ENF&with_shifts=1&with_offers=1
+    GET /api/facilities/<facility_id>/shifts
+    GET /api/facilities/<facility_id>/offers
+    GET /api/counts?bbox=...&category=...&specialization=...&from=YYYY-MM-DD&to=YYYY-MM-DD
+    GET /api/health
+
+Responses carry an ETag (304 on If-None-Match), are gzip-compressed when the client
+accepts it, and JSON responses are kept in an LRU cache per model version. Static
+files with precompressed .br/.gz siblings (see assets.py) are sent as is, and
+content-hashed or vendored files are marked immutable.
+"""
+
+import argparse
+import gzip
+import hashlib
+import json
+import logging
+import mimetypes
+import os
+import threading
+import time
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, unquote, urlparse
+
+import numpy as np
+import pandas as pd
+
+from assets import HASHED_NAME, VENDOR_DIR
+from expiry import drop_started_shifts
+from repository import clean_facility_id, get_facility_logo, get_repository
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+PUBLIC_DIR = 'public'
+GZIP_MIN_BYTES = 1024
+IMMUTABLE_CACHE = 'public, max-age=31536000, immutable'
+SHIFT_COLUMNS = ['id', 'start_time_utc', 'finish_time_utc', 'specialization',
+                 'specialization_display_text', 'category', 'capacity']
+OFFER_COLUMNS = ['id', 'external_id', 'category', 'skill', 'contract_type', 'salary_min', 'salary_max',
+                 'salary_period', 'start_date', 'status', 'job_description']
+
+
+class MapModel:
+    """Facilities, per-facility shifts/offers and stats held in memory with array indexes"""
+
+    def __init__(self, data_dir=DATA_DIR):
+        from demand_cube import DemandCube
+        from map import load_facilities_and_shifts
+
+        self.repository = get_repository(data_dir)
+        self.signature = self.current_signature()
+        facilities, shifts, offers = load_facilities_and_shifts(data_dir)
+        if facilities is None:
+            raise FileNotFoundError(f"No corrected facilities found in {data_dir}")
+        # Como en los mapas: fuera los turnos ya empezados; el servidor recarga cuando empieza el siguiente
+        self.loaded_at = pd.Timestamp.now(tz='UTC')
+        self.next_start = None
+        if shifts is not None and not shifts.empty and 'start_time_utc' in shifts.columns:
+            shifts, _ = drop_started_shifts(shifts, self.loaded_at)
+            self.next_start = shifts['start_time_utc'].min() if not shifts.empty else None
+        self.shifts = shifts
+        self.offers = offers
+        self.cube = DemandCube.from_frames(shifts, offers)
+        # Las especialidades se guardan tal como vienen en el CSV: la consulta no distingue mayúsculas
+        self.specialization_labels = {str(label).casefold(): label for label in self.cube.specializations}
+        stats = self.cube.facility_stats().to_dict('index')
+
+        lat = facilities['latitud_corregida'].astype(float)
+        lon = facilities['longitud_corregida'].astype(float)
+        facilities = facilities[lat.notna() & lon.notna()]
+        self.records = []
+        for row in facilities.itertuples(index=False):
+            fac_id = clean_facility_id(row.facility_id) or str(row.nombre_original)
+            name = str(row.nombre_correcto)
+            shift_stats = {'total': 0, 'enf': 0, 'tcae': 0, 'offers': 0}
+            shift_stats.update(stats.get(fac_id, {}))
+            self.records.append({
+                'id': fac_id,
+                'name': name,
+                'city': str(row.ciudad),
+                'address': str(row.direccion),
+                'latitude': float(row.latitud_corregida),
+                'longitude': float(row.longitud_corregida),
+                'logo_path': get_facility_logo(name),
+                'shift_stats': shift_stats,
+            })
+        self.lat = np.array([r['latitude'] for r in self.records])
+        self.lon = np.array([r['longitude'] for r in self.records])
+        self.stat_matrix = np.array([[r['shift_stats'][k] for k in ('total', 'enf', 'tcae', 'offers')]
+                                     for r in self.records], dtype=np.int64).reshape(-1, 4)
+        self.cube_rows = self.cube.facility_positions([r['id'] for r in self.records])
+        self.shift_index = self._group_positions(shifts)
+        self.offer_index = self._group_positions(offers)
+        self.version = hashlib.sha1(repr((self.signature, self.loaded_at.isoformat())).encode('utf-8')).hexdigest()[:12]
+        logger.info(f"🧠 Model loaded: {len(self.records)} facilities, {len(shifts)} shifts, {len(offers)} offers")
+
+    def current_signature(self):
+        return tuple(self.repository._signature(self.repository.path_for(name))
+                     for name in ('corrected_facilities', 'shifts', 'offers'))
+
+    def has_started_shifts(self):
+        """Whether a shift in the model has started since it was loaded"""
+        return self.next_start is not None and not pd.isna(self.next_start) and pd.Timestamp.now(tz='UTC') >= self.next_start
+
+    @staticmethod
+    def _group_positions(df):
+        if df is None or df.empty or 'facility_id' not in df.columns:
+            return {}
+        return df.groupby('facility_id', sort=False).indices
+
+    def stats_for(self, specialization=None, start=None, end=None):
+        """total / ENF / TCAE / offers per facility record, sliced from the demand cube"""
+        if specialization is None and start is None and end is None:
+            return self.stat_matrix
+        if specialization is not None:
+            specialization = self.specialization_labels.get(specialization.casefold(), specialization)
+        columns = [self.cube.totals(category, specialization, start, end) for category in (None, 'ENF', 'TCAE')]
+        # Las filas sin entrada en el cubo (-1) se quedan a cero
+        sliced = np.append(np.column_stack(columns), np.zeros((1, 3), dtype=np.int64), axis=0)[self.cube_rows]
+        return np.column_stack([sliced, self.stat_matrix[:, 3]])
+
+    def select(self, bbox=None, category=None, with_shifts=False, with_offers=False,
+               specialization=None, start=None, end=None):
+        """Positions of facilities matching the filters (and their stats)"""
+        stats = self.stats_for(specialization, start, end)
+        mask = np.ones(len(self.records), dtype=bool)
+        if bbox is not None:
+            west, south, east, north = bbox
+            mask &= (self.lon >= west) & (self.lon <= east) & (self.lat >= south) & (self.lat <= north)
+        if category == 'ENF':
+            mask &= stats[:, 1] > 0
+        elif category == 'TCAE':
+            mask &= stats[:, 2] > 0
+        if with_shifts or specialization is not None or start is not None or end is not None:
+            mask &= stats[:, 0] > 0
+        if with_offers:
+            mask &= stats[:, 3] > 0
+        return np.flatnonzero(mask), stats
+
+    def facilities(self, **filters):
+        return [self.records[i] for i in self.select(**filters)[0]]
+
+    def counts(self, **filters):
+        positions, stats = self.select(**filters)
+        totals = stats[positions].sum(axis=0) if len(positions) else np.zeros(4, dtype=np.int64)
+        return {
+            'facilities': int(len(positions)),
+            'shifts': int(totals[0]),
+            'enf': int(totals[1]),
+            'tcae': int(totals[2]),
+            'offers': int(totals[3]),
+        }
+
+    def rows_json(self, kind, facility_id):
+        """JSON array of the shifts or offers of one facility"""
+        df, index, columns = ((self.shifts, self.shift_index, SHIFT_COLUMNS) if kind == 'shifts'
+                              else (self.offers, self.offer_index, OFFER_COLUMNS))
+        positions = index.get(facility_id)
+        if positions is None:
+            return '[]'
+        rows = df.iloc[positions][[c for c in columns if c in df.columns]]
+        return rows.to_json(orient='records', date_format='iso', force_ascii=False)
+
+
+class ResponseCache:
+    """Thread-safe LRU cache of encoded responses"""
+
+    def __init__(self, max_entries=512):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self.entries.move_to_end(key)
+            self.hits += 1
+            return entry
+
+    def put(self, key, entry):
+        with self._lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self.entries.clear()
+
+
+class Response:
+    """Encoded body plus its ETag; the gzip variant is precompressed or computed once on first use"""
+
+    def __init__(self, body, content_type, encoded=None, immutable=False):
+        self.body = body
+        self.content_type = content_type
+        self.etag = '"' + hashlib.sha1(body).hexdigest()[:20] + '"'
+        self.encoded = encoded or {}
+        self.immutable = immutable
+        self._gzipped = self.encoded.get('gzip')
+
+    def gzipped(self):
+        if self._gzipped is None:
+            self._gzipped = gzip.compress(self.body, compresslevel=6)
+        return self._gzipped
+
+
+class MapServer(ThreadingHTTPServer):
+    """HTTP server holding the model and the response cache"""
+
+    daemon_threads = True
+
+    def __init__(self, address, data_dir=DATA_DIR, public_dir=PUBLIC_DIR, cache_size=512, reload_interval=2.0,
+                 expiry_interval=60.0):
+        super().__init__(address, MapRequestHandler)
+        self.data_dir = data_dir
+        self.public_dir = os.path.abspath(public_dir)
+        self.cache = ResponseCache(cache_size)
+        self.reload_interval = reload_interval
+        self.expiry_interval = expiry_interval
+        self.model = MapModel(data_dir)
+        self._last_check = self._last_load = time.monotonic()
+        self._reload_lock = threading.Lock()
+
+    def get_model(self):
+        """Return the model, rebuilding it when the data files changed (checked every reload_interval) or,
+        at most every expiry_interval, when one of its shifts has started"""
+        if time.monotonic() - self._last_check < self.reload_interval:
+            return self.model
+        with self._reload_lock:
+            if time.monotonic() - self._last_check >= self.reload_interval:
+                self._last_check = time.monotonic()
+                if self.model.current_signature() != self.model.signature:
+                    logger.info("🔄 Data files changed, reloading model")
+                elif (time.monotonic() - self._last_load >= self.expiry_interval
+                      and self.model.has_started_shifts()):
+                    logger.info("⌛ Shifts started, reloading model")
+                else:
+                    return self.model
+                self.model = MapModel(self.data_dir)
+                self._last_load = time.monotonic()
+                self.cache.clear()
+        return self.model
+
+
+def _flag(params, name):
+    return params.get(name, ['0'])[0].lower() in ('1', 'true', 'yes')
+
+
+def _accepted_encodings(header):
+    """{encoding: q} from an Accept-Encoding header (q defaults to 1; q=0 refuses it)"""
+    qualities = {}
+    for token in header.split(','):
+        name, _, params = token.partition(';')
+        name = name.strip().lower()
+        if not name:
+            continue
+        q = 1.0
+        for param in params.split(';'):
+            key, _, value = param.partition('=')
+            if key.strip().lower() == 'q':
+                try:
+                    q = float(value)
+                except ValueError:
+                    q = 0.0
+        qualities[name] = q
+    return qualities
+
+
+def _accepts(qualities, encoding):
+    return qualities.get(encoding, qualities.get('*', 0.0)) > 0
+
+
+def _parse_filters(params):
+    filters = {
+        'category': (params.get('category', [''])[0].upper() or None),
+        'with_shifts': _flag(params, 'with_shifts'),
+        'with_offers': _flag(params, 'with_offers'),
+        'specialization': params.get('specialization', [''])[0].strip() or None,
+        'start': params.get('from', [''])[0] or None,
+        'end': params.get('to', [''])[0] or None,
+        'bbox': None,
+    }
+    for name in ('start', 'end'):
+        if filters[name] is not None:
+            try:
+                pd.Timestamp(filters[name])
+            except ValueError:
+                raise ValueError(f"{'from' if name == 'start' else 'to'} must be a date (YYYY-MM-DD)")
+    if 'bbox' in params:
+        values = [float(v) for v in params['bbox'][0].split(',')]
+        if len(values) != 4:
+            raise ValueError("bbox must be west,south,east,north")
+        filters['bbox'] = values
+    return filters
+
+
+class MapRequestHandler(BaseHTTPRequestHandler):
+    """Routes /api/* to the model and everything else to public/"""
+
+    server_version = 'FacilityMap/1.0'
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+    def do_GET(self):
+        parsed = urlparse(self.path)
+        try:
+            if parsed.path.startswith('/api/'):
+                response = self._api(parsed)
+            else:
+                response = self._static(parsed.path)
+        except ValueError as e:
+            response = Response(json.dumps({'error': str(e)}).encode('utf-8'), 'application/json')
+            return self._send(response, status=400)
+        if response is None:
+            return self._send(Response(b'{"error": "not found"}', 'application/json'), status=404)
+        self._send(response)
+
+    def _api(self, parsed):
+        model = self.server.get_model()
+        key = (model.version, parsed.path, parsed.query)
+        cached = self.server.cache.get(key)
+        if cached is not None:
+            return cached
+
+        params = parse_qs(parsed.query)
+        parts = [unquote(p) for p in parsed.path.strip('/').split('/')]
+        if parts == ['api', 'facilities']:
+            body = json.dumps(model.facilities(**_parse_filters(params)), ensure_ascii=False)
+        elif len(parts) == 4 and parts[:2] == ['api', 'facilities'] and parts[3] in ('shifts', 'offers'):
+            body = (f'{{"facility_id": {json.dumps(parts[2])}, '
+                    f'"{parts[3]}": {model.rows_json(parts[3], parts[2])}}}')
+        elif parts == ['api', 'counts']:
+            body = json.dumps(model.counts(**_parse_filters(params)))
+        elif parts == ['api', 'health']:
+            body = json.dumps({'status': 'ok', 'model_version': model.version,
+                               'facilities': len(model.records),
+                               'cache': {'entries': len(self.server.cache.entries),
+                                         'hits': self.server.cache.hits, 'misses': self.server.cache.misses}})
+            return Response(body.encode('utf-8'), 'application/json')
+        else:
+            return None
+
+        response = Response(body.encode('utf-8'), 'application/json; charset=utf-8')
+        self.server.cache.put(key, response)
+        return response
+
+    def _static(self, path):
+        relative = unquote(path).lstrip('/') or 'index.html'
+        full_path = os.path.abspath(os.path.join(self.server.public_dir, relative))
+        # Evitar salir de public/ con rutas del tipo ../
+        if not full_path.startswith(self.server.public_dir + os.sep) or not os.path.isfile(full_path):
+            return None
+        stat = os.stat(full_path)
+        key = ('static', full_path, stat.st_mtime_ns, stat.st_size)
+        cached = self.server.cache.get(key)
+        if cached is not None:
+            return cached
+        with open(full_path, 'rb') as f:
+            body = f.read()
+        # Variantes precomprimidas escritas por assets.py junto al fichero
+        encoded = {}
+        for encoding, suffix in (('br', '.br'), ('gzip', '.gz')):
+            if os.path.isfile(full_path + suffix):
+                with open(full_path + suffix, 'rb') as f:
+                    encoded[encoding] = f.read()
+        content_type = mimetypes.guess_type(full_path)[0] or 'application/octet-stream'
+        if content_type.startswith('text/') or content_type.endswith('javascript'):
+            content_type += '; charset=utf-8'
+        immutable = bool(HASHED_NAME.search(relative)) or relative.startswith(VENDOR_DIR + '/')
+        response = Response(body, content_type, encoded, immutable)
+        self.server.cache.put(key, response)
+        return response
+
+    def _send(self, response, status=200):
+        if status == 200 and self.headers.get('If-None-Match') == response.etag:
+            self.send_response(304)
+            self.send_header('ETag', response.etag)
+            self.end_headers()
+            return
+        body = response.body
+        accepted = _accepted_encodings(self.headers.get('Accept-Encoding', ''))
+        encoding = None
+        if _accepts(accepted, 'br') and 'br' in response.encoded:
+            body, encoding = response.encoded['br'], 'br'
+        elif (_accepts(accepted, 'gzip') and len(body) >= GZIP_MIN_BYTES
+              and not response.content_type.startswith('image/')):
+            body, encoding = response.gzipped(), 'gzip'
+        self.send_response(status)
+        self.send_header('Content-Type', response.content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.send_header('ETag', response.etag)
+        self.send_header('Cache-Control', IMMUTABLE_CACHE if response.immutable else 'no-cache')
+        self.send_header('Vary', 'Accept-Encoding')
+        if encoding:
+            self.send_header('Content-Encoding', encoding)
+        self.end_headers()
+        self.wfile.write(body)
+
+
+def create_server(host='127.0.0.1', port=8000, data_dir=DATA_DIR, public_dir=PUBLIC_DIR, cache_size=512):
+    return MapServer((host, port), data_dir=data_dir, public_dir=public_dir, cache_size=cache_size)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve the facility map and its JSON query API")
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--cache-size', type=int, default=512, help="Maximum cached responses")
+    args = parser.parse_args(argv)
+
+    try:
+        server = create_server(args.host, args.port, cache_size=args.cache_size)
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}. Run coordinate_checker.py first")
+        return False
+    logger.info(f"🌐 Serving http://{args.host}:{server.server_port}/ (API under /api/)")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        logger.info("👋 Server stopped")
+    finally:
+        server.server_close()
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+"""
+Sharded Map Builds
+Splits the facilities (and their shifts and offers) by city or by healthcare
+group and renders one self-contained map per shard in a process pool, so the
+regional maps cost about as much wall time as the national one. The data is
+loaded and partitioned once in the parent; every shard page opens on its own
+bounds, and public/shards/index.html links them all. refresh_shards re-renders
+only the shards that hold given facilities (e.g. after an expiry pass).
+"""
+
+import argparse
+import html
+import json
+import logging
+import os
+import re
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import numpy as np
+import pandas as pd
+
+from repository import DEFAULT_LOGO, get_facility_logo
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+SHARDS_DIR = os.path.join('public', 'shards')
+SHARD_KEYS = ('city', 'group')
+MISSING_LABELS = {'city': 'Sin ciudad', 'group': 'Otros centros'}
+INDEX_FILE = 'index.html'
+MANIFEST_FILE = 'shards.json'
+
+
+def _first_column(df, names, default=''):
+    for name in names:
+        if name in df.columns:
+            return df[name]
+    return pd.Series(default, index=df.index, dtype=object)
+
+
+def slugify(label):
+    from coordinate_validation import normalize_place_name
+    return re.sub(r'[^a-z0-9]+', '-', normalize_place_name(label)).strip('-')
+
+
+def shard_labels(facilities, by):
+    """Shard label of every facility row: its city (ciudad) or the group behind its logo (get_facility_logo)"""
+    from coordinate_validation import CITY_ALIASES, normalize_place_name
+    if by == 'city':
+        cities = _first_column(facilities, ['ciudad', 'city'])
+        labels = cities.astype(object).where(cities.notna(), '').astype(str).str.strip()
+        # Códigos y comarcas ("BCN", "Maresme") se resuelven a su ciudad como en city_centroid
+        aliases = {normalize_place_name(code): city.title() for code, city in CITY_ALIASES.items()}
+        labels = labels.map(lambda city: aliases.get(normalize_place_name(city), city))
+        # "Barcelona" y "barcelona " van al mismo shard, con la forma más frecuente como nombre
+        slugs = labels.map(slugify)
+        named = slugs != ''
+        canonical = labels[named].groupby(slugs[named]).agg(lambda values: values.value_counts().index[0])
+        return slugs.map(canonical).fillna(MISSING_LABELS[by])
+    if by == 'group':
+        names = _first_column(facilities, ['nombre_correcto', 'facility_name'])
+        codes, unique_names = pd.factorize(names.astype(object).fillna('').astype(str))
+        groups = np.array([MISSING_LABELS[by] if logo == DEFAULT_LOGO else os.path.splitext(logo)[0]
+                           for logo in (get_facility_logo(name) for name in unique_names)], dtype=object)
+        return pd.Series(groups[codes] if len(codes) else [], index=facilities.index, dtype=object)
+    raise ValueError(f"Unknown shard key {by!r}, expected one of {SHARD_KEYS}")
+
+
+def shard_bounds(facilities):
+    """[[south, west], [north, east]] of the facilities inside Spain (of all valid coordinates if none is), or None"""
+    from coordinate_validation import region_bounding_boxes
+    lat = pd.to_numeric(_first_column(facilities, ['latitud_corregida', 'latitude'], np.nan), errors='coerce').to_numpy(dtype=float)
+    lon = pd.to_numeric(_first_column(facilities, ['longitud_corregida', 'longitude'], np.nan), errors='coerce').to_numpy(dtype=float)
+    valid = ~(np.isnan(lat) | np.isnan(lon))
+    # Mismo criterio que isInSpain en la página
+    boxes = np.asarray(region_bounding_boxes(), dtype=float)
+    inside = ((lat[:, None] >= boxes[:, 0]) & (lat[:, None] <= boxes[:, 2]) &
+              (lon[:, None] >= boxes[:, 1]) & (lon[:, None] <= boxes[:, 3])).any(axis=1)
+    keep = inside if inside.any() else valid
+    if not keep.any():
+        return None
+    return [[float(lat[keep].min()), float(lon[keep].min())], [float(lat[keep].max()), float(lon[keep].max())]]
+
+
+def _rows_by_shard(frame, shard_of):
+    """Shard code -> positions of the frame's rows (rows of unknown facilities belong to no shard)"""
+    if frame is None or frame.empty or 'facility_id' not in frame.columns:
+        return {}
+    codes = frame['facility_id'].astype(str).map(shard_of).to_numpy(dtype=float)
+    known = np.flatnonzero(~np.isnan(codes))
+    groups = pd.Series(known).groupby(codes[known].astype(np.int64), sort=False).indices
+    return {code: known[positions] for code, positions in groups.items()}
+
+
+def _take(frame, rows):
+    if frame is None or frame.empty:
+        return frame
+    return frame.iloc[rows]
+
+
+def partition(facilities_df, shifts_df, offers_df, by='city', min_facilities=1):
+    """Yield one dict per shard (slug, label, facilities, shifts, offers, bounds), largest first"""
+    labels = shard_labels(facilities_df, by)
+    codes, names = pd.factorize(labels.to_numpy())
+    # Turnos y ofertas siguen al shard de la primera fila de su facility_id
+    ids = _first_column(facilities_df, ['facility_id']).astype(str).to_numpy()
+    shard_of = pd.Series(codes, index=ids)
+    shard_of = shard_of[~shard_of.index.duplicated()]
+    shift_rows = _rows_by_shard(shifts_df, shard_of)
+    offer_rows = _rows_by_shard(offers_df, shard_of)
+    facility_rows = pd.Series(codes).groupby(codes, sort=False).indices
+
+    empty = np.empty(0, dtype=np.int64)
+    slugs = set()
+    for code in sorted(facility_rows, key=lambda code: (-len(facility_rows[code]), names[code])):
+        rows = facility_rows[code]
+        if len(rows) < min_facilities:
+            continue
+        slug = slugify(names[code]) or 'shard'
+        # Dos etiquetas con el mismo slug no pueden pisarse el fichero
+        while slug in slugs:
+            slug += '-2'
+        slugs.add(slug)
+        facilities = facilities_df.iloc[rows]
+        yield {
+            'slug': slug,
+            'label': names[code],
+            'facilities': facilities,
+            'shifts': _take(shifts_df, shift_rows.get(code, empty)),
+            'offers': _take(offers_df, offer_rows.get(code, empty)),
+            'bounds': shard_bounds(facilities),
+        }
+
+
+def _quiet_worker():
+    # Los logs INFO de cada página (50 shards x varias líneas) no aportan nada: solo avisos y errores
+    logging.getLogger().setLevel(logging.WARNING)
+
+
+def render_shard(shard, out_dir):
+    """Write out_dir/<slug>.html (+ .gz) for one shard; returns its manifest entry"""
+    from assets import precompress
+    from map import MAP_TITLE, write_facilities_map
+    started = time.perf_counter()
+    path = os.path.join(out_dir, f"{shard['slug']}.html")
+    with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+        written = write_facilities_map(f, shard['facilities'], shard['shifts'], shard['offers'],
+                                       title=f"{MAP_TITLE} · {shard['label']}", bounds=shard['bounds'],
+                                       asset_base='../')
+    if written is None:
+        os.remove(f'{path}.tmp')
+        return None
+    os.replace(f'{path}.tmp', path)
+    precompress(path)
+    return {
+        'slug': shard['slug'],
+        'label': shard['label'],
+        'file': os.path.basename(path),
+        'facilities': written,
+        'shifts': 0 if shard['shifts'] is None else len(shard['shifts']),
+        'offers': 0 if shard['offers'] is None else len(shard['offers']),
+        'bounds': shard['bounds'],
+        'bytes': os.path.getsize(path),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+
+def write_index(entries, out_dir, by):
+    """out_dir/index.html linking every shard map, and shards.json with the same entries"""
+    title = 'Mapas por ciudad' if by == 'city' else 'Mapas por grupo sanitario'
+    rows = ''.join(
+        f'        <tr><td><a href="{html.escape(entry["file"])}">{html.escape(entry["label"])}</a></td>'
+        f'<td>{entry["facilities"]}</td><td>{entry["shifts"]}</td><td>{entry["offers"]}</td></tr>\n'
+        for entry in entries)
+    page = f'''<!DOCTYPE html>
+<html>
+<head>
+    <title>{title}</title>
+    <meta charset="utf-8" />
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <style>
+        body {{ font-family: Arial, sans-serif; margin: 24px; color: #2c3e50; }}
+        table {{ border-collapse: collapse; }}
+        th, td {{ padding: 6px 16px; border-bottom: 1px solid #e0e0e0; text-align: right; }}
+        th:first-child, td:first-child {{ text-align: left; }}
+        a {{ color: #007bff; text-decoration: none; }}
+    </style>
+</head>
+<body>
+    <h2>{title}</h2>
+    <p><a href="../index.html">Mapa nacional</a></p>
+    <table>
+        <tr><th>Mapa</th><th>Centros</th><th>Turnos</th><th>Ofertas</th></tr>
+{rows}    </table>
+</body>
+</html>
+'''
+    for name, content in ((INDEX_FILE, page), (MANIFEST_FILE, json.dumps({'by': by, 'shards': entries}, ensure_ascii=False, indent=2))):
+        path = os.path.join(out_dir, name)
+        with open(f'{path}.tmp', 'w', encoding='utf-8') as f:
+            f.write(content)
+        os.replace(f'{path}.tmp', path)
+
+
+def build_shards(facilities_df, shifts_df, offers_df, by='city', out_dir=SHARDS_DIR, workers=None, min_facilities=1):
+    """Render every shard map in a process pool plus the index page; returns the manifest entries"""
+    os.makedirs(out_dir, exist_ok=True)
+    entries = []
+    with ProcessPoolExecutor(max_workers=workers, initializer=_quiet_worker) as executor:
+        futures = [executor.submit(render_shard, shard, out_dir)
+                   for shard in partition(facilities_df, shifts_df, offers_df, by, min_facilities)]
+        for future in as_completed(futures):
+            entry = future.result()
+            if entry is not None:
+                entries.append(entry)
+    entries.sort(key=lambda entry: (-entry['facilities'], entry['label']))
+
+    # Mapas de shards que ya no existen (otra clave, ciudades que desaparecen)
+    current = {entry['file'] for entry in entries}
+    for name in os.listdir(out_dir):
+        if re.sub(r'\.gz$', '', name).endswith('.html') and re.sub(r'\.gz$', '', name) not in current | {INDEX_FILE}:
+            os.remove(os.path.join(out_dir, name))
+    write_index(entries, out_dir, by)
+    return entries
+
+
+def refresh_shards(facilities_df, shifts_df, offers_df, facility_ids, out_dir=SHARDS_DIR, workers=None):
+    """Re-render only the existing shard maps holding any of facility_ids (same key as shards.json); returns the refreshed entries"""
+    try:
+        with open(os.path.join(out_dir, MANIFEST_FILE), encoding='utf-8') as f:
+            manifest = json.load(f)
+    except (OSError, ValueError):
+        return []
+    facility_ids = set(facility_ids)
+    shards = [shard for shard in partition(facilities_df, shifts_df, offers_df, manifest['by'])
+              if not facility_ids.isdisjoint(_first_column(shard['facilities'], ['facility_id']).astype(str))]
+    if not shards:
+        return []
+    with ProcessPoolExecutor(max_workers=min(workers or os.cpu_count() or 1, len(shards)), initializer=_quiet_worker) as executor:
+        refreshed = [entry for entry in executor.map(render_shard, shards, [out_dir] * len(shards)) if entry is not None]
+    by_slug = {entry['slug']: entry for entry in manifest['shards']}
+    by_slug.update({entry['slug']: entry for entry in refreshed})
+    entries = sorted(by_slug.values(), key=lambda entry: (-entry['facilities'], entry['label']))
+    write_index(entries, out_dir, manifest['by'])
+    logger.info(f"🧩 {len(refreshed)} of {len(entries)} shard maps re-rendered")
+    return refreshed
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Build one map per city or healthcare group in parallel")
+    parser.add_argument('--by', choices=SHARD_KEYS, default='city', help="Shard key (default city)")
+    parser.add_argument('--workers', type=int, default=None, help="Worker processes (default: one per CPU)")
+    parser.add_argument('--min-facilities', type=int, default=1, help="Skip shards with fewer facilities")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--out-dir', default=SHARDS_DIR)
+    args = parser.parse_args(argv)
+
+    from map import load_facilities_and_shifts
+    facilities_df, shifts_df, offers_df = load_facilities_and_shifts(args.data_dir)
+    if facilities_df is None:
+        return False
+    started = time.perf_counter()
+    entries = build_shards(facilities_df, shifts_df, offers_df, args.by, args.out_dir, args.workers, args.min_facilities)
+    elapsed = time.perf_counter() - started
+    for entry in entries[:10]:
+        print(f"{entry['label']:<30} {entry['facilities']:>5} centros {entry['shifts']:>7} turnos "
+              f"{entry['bytes'] / 1024:>8.1f} KB  {entry['seconds']:.2f}s")
+    logger.info(f"✅ {len(entries)} shard maps by {args.by} in {elapsed:.2f}s "
+                f"(longest {max((e['seconds'] for e in entries), default=0):.2f}s), index: {os.path.join(args.out_dir, INDEX_FILE)}")
+    return bool(entries)
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
@@ -0,0 +1,122 @@
+#!/usr/bin/env python3
+"""
+Shift Interval Index
+Time-range queries over shifts. Shifts are sorted by start minute and the longest
+shift duration is kept, so every shift overlapping [from, to) starts in
+(from - max_duration, to): one searchsorted pair finds that slice and only its
+finish times are checked, O(log n + k). The same sorted arrays are embedded in the
+generated map so the page can re-filter a date range with a binary search.
+"""
+
+import argparse
+import logging
+
+import numpy as np
+import pandas as pd
+
+from repository import factorize_facility_ids
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+NS_PER_MINUTE = 60_000_000_000
+
+
+def to_epoch_minutes(values):
+    """Datetimes / ISO strings -> int64 minutes since 1970-01-01 UTC (NaT -> -1)"""
+    times = pd.DatetimeIndex(pd.to_datetime(values, utc=True, errors='coerce', format='mixed'))
+    minutes = times.tz_convert('UTC').tz_localize(None).to_numpy(dtype='datetime64[ns]').view('int64') // NS_PER_MINUTE
+    return np.where(times.isna(), -1, minutes).astype(np.int64)
+
+
+class ShiftIntervalIndex:
+    """Shifts sorted by start minute with facility and category codes"""
+
+    def __init__(self, shifts):
+        if shifts is None or shifts.empty:
+            shifts = pd.DataFrame(columns=['id', 'facility_id', 'start_time_utc', 'finish_time_utc', 'category'])
+        start = to_epoch_minutes(shifts['start_time_utc'])
+        finish = (to_epoch_minutes(shifts['finish_time_utc']) if 'finish_time_utc' in shifts
+                  else np.full(len(start), -1, dtype=np.int64))
+        # Sin hora de fin el turno ocupa solo su minuto de inicio
+        finish = np.where(finish < start, start, finish)
+        valid = start >= 0
+        shifts = shifts[valid]
+        fac_codes, self.facilities = factorize_facility_ids(shifts['facility_id'])
+        cat_codes, self.categories = pd.factorize(shifts['category'].astype(str).to_numpy())
+        ids = shifts['id'].astype(str).to_numpy()
+
+        order = np.lexsort((ids, start[valid]))
+        self.start = start[valid][order]
+        self.finish = finish[valid][order]
+        self.ids = ids[order]
+        self.facility_codes = fac_codes[order]
+        self.category_codes = cat_codes[order]
+        self.max_duration = int((self.finish - self.start).max()) if len(self.start) else 0
+
+    def __len__(self):
+        return len(self.start)
+
+    def query(self, start=None, end=None):
+        """Positions of shifts overlapping [start, end); None leaves that side open"""
+        lo_minute = None if start is None else int(to_epoch_minutes([start])[0])
+        hi_minute = None if end is None else int(to_epoch_minutes([end])[0])
+        lo = 0 if lo_minute is None else np.searchsorted(self.start, lo_minute - self.max_duration, side='right')
+        hi = len(self.start) if hi_minute is None else np.searchsorted(self.start, hi_minute, side='left')
+        positions = np.arange(lo, max(lo, hi))
+        if lo_minute is not None:
+            # Dentro del margen de max_duration solo cuentan los que aún no han terminado
+            positions = positions[(self.finish[positions] > lo_minute) | (self.start[positions] >= lo_minute)]
+        return positions
+
+    def shift_ids_by_facility(self, start=None, end=None):
+        """{facility_id: [shift ids]} for shifts overlapping the window, in start order"""
+        positions = self.query(start, end)
+        result = {}
+        for code, shift_id in zip(self.facility_codes[positions], self.ids[positions]):
+            result.setdefault(self.facilities[code], []).append(shift_id)
+        return result
+
+    def to_payload(self, facility_ids=None):
+        """Sorted numpy arrays for the page (written with payload.write_json_columns): minutes relative to 'base', codes into 'facilities'/'categories'"""
+        keep = np.ones(len(self), dtype=bool)
+        if facility_ids is not None:
+            keep = np.isin(self.facilities, list(facility_ids))[self.facility_codes] if len(self) else keep
+        base = int(self.start[keep][0]) if keep.any() else 0
+        start = self.start[keep]
+        return {
+            'base': base,
+            'start': start - base,
+            'duration': self.finish[keep] - start,
+            'facility': self.facility_codes[keep],
+            'category': self.category_codes[keep],
+            'ids': self.ids[keep],
+            'facilities': list(self.facilities),
+            'categories': list(self.categories),
+            'max_duration': int((self.finish[keep] - start).max()) if keep.any() else 0,
+        }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Shifts per facility overlapping a date/time window")
+    parser.add_argument('--from', dest='start', help="Window start (UTC, e.g. 2025-08-01 or 2025-08-01T08:00)")
+    parser.add_argument('--to', dest='end', help="Window end (UTC, exclusive)")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    args = parser.parse_args(argv)
+
+    from repository import get_repository
+    shifts = get_repository(args.data_dir).get('shifts')
+    if shifts is None:
+        logger.error(f"❌ No available shifts found in {args.data_dir}")
+        return False
+    by_facility = ShiftIntervalIndex(shifts).shift_ids_by_facility(args.start, args.end)
+    for facility_id, ids in sorted(by_facility.items(), key=lambda item: -len(item[1])):
+        print(f"{facility_id:>8}  {len(ids):>5} shifts  {', '.join(ids[:5])}{' ...' if len(ids) > 5 else ''}")
+    logger.info(f"🕒 {sum(map(len, by_facility.values()))} shifts in {len(by_facility)} facilities")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
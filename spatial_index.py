@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+"""
+Facility Spatial Index
+Grid-bucket index over facility coordinates for k-nearest, within-radius and
+bounding-box queries with haversine distances. Points are sorted by grid cell so
+each row of cells in a query window is one contiguous slice found with
+searchsorted. The index is saved as data/spatial_index.npz together with a
+fingerprint of the facility file it was built from and is only rebuilt when that
+file changes.
+"""
+
+import argparse
+import hashlib
+import logging
+import os
+
+import numpy as np
+
+from coordinate_validation import EARTH_RADIUS_KM, haversine_km
+from repository import clean_facility_id
+
+# Configure logging
+logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+logger = logging.getLogger(__name__)
+
+DATA_DIR = 'data'
+INDEX_FILE = os.path.join(DATA_DIR, 'spatial_index.npz')
+DEFAULT_CELL_DEG = 0.25
+KM_PER_DEG_LAT = np.pi * EARTH_RADIUS_KM / 180.0
+
+
+def file_fingerprint(path):
+    """sha1 of a file's content (None when it does not exist)"""
+    if path is None or not os.path.exists(path):
+        return None
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+class SpatialIndex:
+    """Points bucketed in a regular lat/lon grid, sorted by cell key"""
+
+    def __init__(self, lat, lon, ids, names=None, cell_deg=DEFAULT_CELL_DEG, fingerprint=None):
+        lat = np.asarray(lat, dtype=float)
+        lon = np.asarray(lon, dtype=float)
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        self.cell_deg = float(cell_deg)
+        self.n_cols = int(np.ceil(360.0 / self.cell_deg))
+        self.fingerprint = fingerprint
+
+        keys = self._cell_keys(lat[valid], lon[valid])
+        order = np.argsort(keys, kind='stable')
+        self.keys = keys[order]
+        self.lat = lat[valid][order]
+        self.lon = lon[valid][order]
+        self.ids = np.asarray(ids).astype(str)[valid][order]
+        self.names = (np.asarray(names).astype(str)[valid][order] if names is not None
+                      else np.full(len(self.ids), '', dtype='<U1'))
+
+    def __len__(self):
+        return len(self.ids)
+
+    @classmethod
+    def from_facilities(cls, facilities, cell_deg=DEFAULT_CELL_DEG, fingerprint=None):
+        """Build from corrected facilities (latitud_corregida / longitud_corregida / facility_id columns)"""
+        ids = [clean_facility_id(fid) or name
+               for fid, name in zip(facilities['facility_id'], facilities['nombre_original'])]
+        names = facilities['nombre_correcto'].fillna(facilities['nombre_original']).astype(str)
+        return cls(facilities['latitud_corregida'].astype(float), facilities['longitud_corregida'].astype(float),
+                   ids, names, cell_deg, fingerprint)
+
+    def _rows_cols(self, lat, lon):
+        rows = np.floor((np.asarray(lat, dtype=float) + 90.0) / self.cell_deg).astype(np.int64)
+        cols = np.floor((np.asarray(lon, dtype=float) + 180.0) / self.cell_deg).astype(np.int64)
+        return rows, np.clip(cols, 0, self.n_cols - 1)
+
+    def _cell_keys(self, lat, lon):
+        rows, cols = self._rows_cols(lat, lon)
+        return rows * self.n_cols + cols
+
+    def _candidates(self, west, south, east, north):
+        """Positions of points in the grid cells overlapping the box"""
+        (row0, row1), (col0, col1) = self._rows_cols([south, north], [west, east])
+        rows = np.arange(row0, row1 + 1, dtype=np.int64)
+        starts = np.searchsorted(self.keys, rows * self.n_cols + col0, side='left')
+        ends = np.searchsorted(self.keys, rows * self.n_cols + col1, side='right')
+        if len(rows) == 1:
+            return np.arange(starts[0], ends[0])
+        lengths = ends - starts
+        if lengths.sum() == 0:
+            return np.empty(0, dtype=np.int64)
+        # Concatenar los rangos [start, end) de cada fila sin bucle en Python
+        offsets = np.repeat(starts - np.cumsum(lengths) + lengths, lengths)
+        return offsets + np.arange(lengths.sum())
+
+    def bbox(self, west, south, east, north):
+        """Positions (into ids/lat/lon) of points inside the box"""
+        candidates = self._candidates(west, south, east, north)
+        lat, lon = self.lat[candidates], self.lon[candidates]
+        inside = (lat >= south) & (lat <= north) & (lon >= west) & (lon <= east)
+        return candidates[inside]
+
+    def _radius_box(self, lat, lon, radius_km):
+        d_lat = radius_km / KM_PER_DEG_LAT
+        cos_lat = np.cos(np.radians(min(abs(lat) + d_lat, 89.9)))
+        d_lon = min(radius_km / (KM_PER_DEG_LAT * cos_lat), 180.0)
+        return lon - d_lon, max(lat - d_lat, -90.0), lon + d_lon, min(lat + d_lat, 90.0)
+
+    def within_radius(self, lat, lon, radius_km):
+        """(positions, distances_km) of points within radius_km, nearest first"""
+        candidates = self._candidates(*self._radius_box(lat, lon, radius_km))
+        distances = haversine_km(lat, lon, self.lat[candidates], self.lon[candidates])
+        keep = distances <= radius_km
+        candidates, distances = candidates[keep], distances[keep]
+        order = np.argsort(distances, kind='stable')
+        return candidates[order], distances[order]
+
+    def knn(self, lat, lon, k=5):
+        """(positions, distances_km) of the k nearest points, nearest first"""
+        k = min(k, len(self))
+        if k == 0:
+            return np.empty(0, dtype=np.int64), np.empty(0)
+        radius = self.cell_deg * KM_PER_DEG_LAT
+        # Ampliar el radio hasta que contenga k puntos; cualquier punto más cercano está dentro
+        while radius < np.pi * EARTH_RADIUS_KM:
+            positions, distances = self.within_radius(lat, lon, radius)
+            if len(positions) >= k:
+                return positions[:k], distances[:k]
+            radius *= 2
+        distances = haversine_km(lat, lon, self.lat, self.lon)
+        order = np.argsort(distances, kind='stable')[:k]
+        return order, distances[order]
+
+    def records(self, positions, distances=None):
+        """Positions -> list of dicts for display / JSON"""
+        result = []
+        for i, pos in enumerate(positions):
+            record = {'id': str(self.ids[pos]), 'name': str(self.names[pos]),
+                      'latitude': float(self.lat[pos]), 'longitude': float(self.lon[pos])}
+            if distances is not None:
+                record['distance_km'] = round(float(distances[i]), 3)
+            result.append(record)
+        return result
+
+    def save(self, path=INDEX_FILE):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        tmp_path = f"{path}.tmp.npz"
+        np.savez(tmp_path, lat=self.lat, lon=self.lon, ids=self.ids, names=self.names,
+                 cell_deg=self.cell_deg, fingerprint=np.array(self.fingerprint or ''))
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path=INDEX_FILE):
+        with np.load(path, allow_pickle=False) as data:
+            # Los puntos ya están ordenados por celda; reconstruir las claves es O(n)
+            return cls(data['lat'], data['lon'], data['ids'], data['names'],
+                       float(data['cell_deg']), str(data['fingerprint']) or None)
+
+
+def load_or_build(data_dir=DATA_DIR, path=None, cell_deg=DEFAULT_CELL_DEG, rebuild=False):
+    """Load the persisted index, rebuilding it when the facility file changed"""
+    from repository import get_repository
+    repository = get_repository(data_dir)
+    path = path or os.path.join(data_dir, 'spatial_index.npz')
+    fingerprint = file_fingerprint(repository.path_for('corrected_facilities'))
+    if fingerprint is None:
+        raise FileNotFoundError(f"No corrected facilities found in {data_dir}")
+
+    if not rebuild and os.path.exists(path):
+        try:
+            index = SpatialIndex.load(path)
+            if index.fingerprint == fingerprint and index.cell_deg == cell_deg:
+                return index
+            logger.info("🔄 Facility data changed, rebuilding spatial index")
+        except Exception as e:
+            logger.warning(f"⚠️ Could not load spatial index, rebuilding: {e}")
+
+    index = SpatialIndex.from_facilities(repository.get('corrected_facilities'), cell_deg, fingerprint)
+    index.save(path)
+    logger.info(f"🗂️ Spatial index built: {len(index)} facilities -> {path}")
+    return index
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Nearest-facility, radius and bbox queries")
+    parser.add_argument('--data-dir', default=DATA_DIR)
+    parser.add_argument('--cell-deg', type=float, default=DEFAULT_CELL_DEG, help="Grid cell size in degrees")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+    subparsers.add_parser('build', help="(Re)build and save the index")
+    knn = subparsers.add_parser('knn', help="k nearest facilities to a point")
+    knn.add_argument('lat', type=float)
+    knn.add_argument('lon', type=float)
+    knn.add_argument('-k', type=int, default=5)
+    radius = subparsers.add_parser('radius', help="Facilities within a radius (km) of a point")
+    radius.add_argument('lat', type=float)
+    radius.add_argument('lon', type=float)
+    radius.add_argument('km', type=float)
+    bbox = subparsers.add_parser('bbox', help="Facilities inside west south east north")
+    for name in ('west', 'south', 'east', 'north'):
+        bbox.add_argument(name, type=float)
+    args = parser.parse_args(argv)
+
+    try:
+        index = load_or_build(args.data_dir, cell_deg=args.cell_deg, rebuild=args.command == 'build')
+    except FileNotFoundError as e:
+        logger.error(f"❌ {e}")
+        return False
+
+    if args.command == 'knn':
+        records = index.records(*index.knn(args.lat, args.lon, args.k))
+    elif args.command == 'radius':
+        records = index.records(*index.within_radius(args.lat, args.lon, args.km))
+    elif args.command == 'bbox':
+        records = index.records(index.bbox(args.west, args.south, args.east, args.north))
+    else:
+        return True
+    for record in records:
+        distance = f"{record['distance_km']:>8.2f} km  " if 'distance_km' in record else ''
+        print(f"{distance}{record['id']:>8}  {record['name']}  ({record['latitude']:.5f}, {record['longitude']:.5f})")
+    logger.info(f"📍 {len(records)} facilities")
+    return True
+
+
+if __name__ == "__main__":
+    raise SystemExit(0 if main() else 1)
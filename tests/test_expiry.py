@@ -0,0 +1,46 @@
+import pandas as pd
+
+from expiry import drop_started_shifts, started_positions
+
+
+def _shifts(starts):
+    return pd.DataFrame({
+        'id': [str(i) for i in range(len(starts))],
+        'facility_id': ['1'] * len(starts),
+        'start_time_utc': pd.to_datetime(starts, utc=True, format='ISO8601'),
+    })
+
+
+def test_unsorted_shifts_are_all_checked():
+    shifts = _shifts(['2025-09-02', '2025-08-01', '2025-09-03', '2025-08-15T10:00', '2025-09-01'])
+    remaining, started = drop_started_shifts(shifts, '2025-09-01')
+    assert sorted(started['id']) == ['1', '3', '4']
+    assert sorted(remaining['id']) == ['0', '2']
+
+
+def test_sorted_and_unsorted_agree():
+    shifts = _shifts(['2025-08-01', '2025-08-15T10:00', '2025-09-01', '2025-09-02', '2025-09-03'])
+    shuffled = shifts.iloc[[3, 0, 4, 2, 1]]
+    for now in ['2025-07-01', '2025-08-15T10:00', '2025-08-15T10:00:01', '2025-09-01', '2025-10-01']:
+        assert set(drop_started_shifts(shifts, now)[1]['id']) == set(drop_started_shifts(shuffled, now)[1]['id'])
+
+
+def test_cutoff_keeps_later_shifts_in_the_same_minute():
+    shifts = _shifts(['2025-08-01T08:00:00', '2025-08-01T08:00:30'])
+    remaining, started = drop_started_shifts(shifts, '2025-08-01T08:00:10')
+    assert list(started['id']) == ['0']
+    assert list(remaining['id']) == ['1']
+
+
+def test_positions_since_previous_cutoff():
+    sorted_shifts = _shifts(['2025-08-01', '2025-08-02', '2025-08-03', '2025-08-04'])
+    unsorted_shifts = sorted_shifts.iloc[[2, 0, 3, 1]]
+    assert list(started_positions(sorted_shifts, '2025-08-03', since='2025-08-01')) == [1, 2]
+    assert sorted(unsorted_shifts.iloc[started_positions(unsorted_shifts, '2025-08-03', since='2025-08-01')]['id']) == ['1', '2']
+
+
+def test_unparsed_and_missing_start_times():
+    shifts = pd.DataFrame({'id': ['0', '1', '2'], 'start_time_utc': ['2025-08-02 10:00:00', None, '2025-07-30T09:00:00Z']})
+    remaining, started = drop_started_shifts(shifts, '2025-08-01')
+    assert list(started['id']) == ['2']
+    assert list(remaining['id']) == ['0', '1']